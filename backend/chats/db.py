@@ -0,0 +1,399 @@
+'''
+Database connection pool that survives warm invocations of the function.
+Each function directory is deployed on its own, so this module is vendored
+into every backend function that talks to Postgres and kept identical.
+
+Reads can be spread over streaming replicas whose URLs are listed in
+DATABASE_REPLICA_URLS (comma separated, so commas inside one are written
+%2C); get_read_pool() picks one round-robin among those whose
+last health check found them reachable and less than DB_REPLICA_MAX_LAG
+seconds behind, and falls back to the primary; give replica DSNs a
+connect_timeout so an unreachable one fails its check quickly. Writes
+always use get_pool().
+For read-your-writes, with_write_lsn() returns the primary's WAL position
+after a write as X-Db-Lsn; a client that sends it back as X-Read-After
+(or a unix timestamp of its write) is only served by a replica that has
+replayed that far.
+'''
+import json
+import os
+import threading
+import time
+from functools import wraps
+from itertools import count
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+import tracing
+
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_WAIT_TIMEOUT = float(os.environ.get('DB_POOL_WAIT_TIMEOUT', '5'))
+POOL_CHECK_INTERVAL = float(os.environ.get('DB_POOL_CHECK_INTERVAL', '30'))
+POOL_STATS_INTERVAL = float(os.environ.get('DB_POOL_STATS_INTERVAL', '60'))
+
+REPLICA_URLS = [dsn.strip() for dsn in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if dsn.strip()]
+REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', '2'))
+REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', '5'))
+
+READ_AFTER_HEADER = 'X-Read-After'
+WRITE_LSN_HEADER = 'X-Db-Lsn'
+
+# Position replayed so far and how far behind the primary that is; a server
+# that is not in recovery (a promoted replica, or the primary standing in for
+# one) is never behind. A replica that has replayed all it received counts
+# as caught up even when the primary has been idle since its last commit
+REPLICA_STATE_SQL = """
+    SELECT
+        CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END::text,
+        CASE
+            WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM clock_timestamp() - pg_last_xact_replay_timestamp()), 'Infinity')
+        END::float8,
+        EXTRACT(EPOCH FROM clock_timestamp())::float8
+"""
+
+
+class PoolTimeout(Exception):
+    '''Raised when no connection frees up within the wait timeout'''
+
+
+class ConnectionPool:
+    '''
+    Bounded pool of psycopg2 connections.
+    Idle connections are pinged before reuse once they have been idle longer
+    than check_interval, and broken ones are replaced transparently.
+    '''
+
+    def __init__(self, dsn: str, max_size: int = POOL_MAX_SIZE,
+                 wait_timeout: float = POOL_WAIT_TIMEOUT,
+                 check_interval: float = POOL_CHECK_INTERVAL) -> None:
+        self.dsn = dsn
+        self.max_size = max(1, max_size)
+        self.wait_timeout = wait_timeout
+        self.check_interval = check_interval
+        self._idle: List[Tuple[Any, float]] = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._counters: Dict[str, int] = {
+            'hits': 0, 'misses': 0, 'waits': 0, 'timeouts': 0, 'reconnects': 0
+        }
+        self._last_report = time.monotonic()
+
+    def _connect(self) -> Any:
+        with tracing.span('connect'):
+            return psycopg2.connect(self.dsn, connection_factory=tracing.TracedConnection)
+
+    def _is_healthy(self, conn: Any, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def getconn(self) -> Any:
+        '''Check out a connection, waiting up to wait_timeout if the pool is full'''
+        with tracing.span('checkout'):
+            return self._checkout()
+
+    def _checkout(self) -> Any:
+        deadline = time.monotonic() + self.wait_timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    self._counters['hits'] += 1
+                    break
+                if self._size < self.max_size:
+                    conn, idle_since = None, 0.0
+                    self._size += 1
+                    self._counters['misses'] += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolTimeout(f'no connection available within {self.wait_timeout}s')
+                self._counters['waits'] += 1
+                self._cond.wait(remaining)
+
+        try:
+            if conn is None:
+                return self._connect()
+            if self._is_healthy(conn, idle_since):
+                return conn
+            self._close_quietly(conn)
+            with self._cond:
+                self._counters['reconnects'] += 1
+            return self._connect()
+        except Exception:
+            self._release_slot()
+            raise
+
+    def putconn(self, conn: Any, discard: bool = False) -> None:
+        '''Return a connection; any open transaction is rolled back'''
+        if not discard and not conn.closed:
+            try:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                discard = True
+        if discard or conn.closed:
+            self._close_quietly(conn)
+            self._release_slot()
+        else:
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+        self._maybe_report()
+
+    def _release_slot(self) -> None:
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn: Any) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        '''Snapshot of pool counters and current occupancy'''
+        with self._cond:
+            snapshot = dict(self._counters)
+            snapshot['size'] = self._size
+            snapshot['idle'] = len(self._idle)
+            snapshot['max_size'] = self.max_size
+        return snapshot
+
+    def _maybe_report(self) -> None:
+        now = time.monotonic()
+        if now - self._last_report < POOL_STATS_INTERVAL:
+            return
+        self._last_report = now
+        print(json.dumps({'event': 'db_pool_stats', **self.stats()}))
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    '''Module-level pool, created on first use and kept while the instance is warm'''
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ.get('DATABASE_URL'))
+    return _pool
+
+
+def parse_lsn(lsn: str) -> int:
+    '''WAL position "16/B374D848" as a byte offset'''
+    high, _, low = lsn.strip().partition('/')
+    if not low:
+        raise ValueError(f'invalid LSN: {lsn!r}')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def parse_read_after(value: str) -> Tuple[Optional[int], Optional[float]]:
+    '''(LSN, unix timestamp) of an X-Read-After header, only one of them set'''
+    if '/' in value:
+        return parse_lsn(value), None
+    return None, float(value)
+
+
+class Replica:
+    '''A replica's pool and what its last health check found'''
+
+    def __init__(self, index: int, dsn: str) -> None:
+        self.index = index
+        self.pool = ConnectionPool(dsn)
+        self.healthy = False
+        self.replay_lsn = 0
+        self.lag = float('inf')
+        # Commits on the primary before this unix time are visible here
+        self.caught_up_to = 0.0
+        self.checked_at: Optional[float] = None
+        self.check_lock = threading.Lock()
+
+    def state(self) -> Dict[str, Any]:
+        return {'replica': self.index, 'healthy': self.healthy,
+                'lag': self.lag if self.lag != float('inf') else None, 'pool': self.pool.stats()}
+
+
+class ReadRouter:
+    '''
+    Round-robin over replicas for read-only requests. Each replica is checked
+    at most every check_interval seconds in the request path; one that cannot
+    be reached or is more than max_lag behind gets no reads until a later
+    check finds it back. A read-after requirement the last check cannot
+    vouch for triggers one more check of that replica before moving on.
+    '''
+
+    def __init__(self, dsns: List[str], max_lag: float = REPLICA_MAX_LAG,
+                 check_interval: float = REPLICA_CHECK_INTERVAL) -> None:
+        self.replicas = [Replica(index, dsn) for index, dsn in enumerate(dsns)]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._turn = count()
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {
+            'replica_reads': 0, 'primary_reads': 0, 'lagging': 0, 'unavailable': 0,
+            'checks': 0, 'failed_checks': 0
+        }
+        self._last_report = time.monotonic()
+
+    def check(self, replica: Replica) -> None:
+        '''Refresh the replica's health; skipped while another thread is checking it'''
+        if not replica.check_lock.acquire(blocking=False):
+            return
+        try:
+            healthy = False
+            try:
+                conn = replica.pool.getconn()
+            except (PoolTimeout, psycopg2.Error):
+                conn = None
+            if conn is not None:
+                discard = False
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute(REPLICA_STATE_SQL)
+                        lsn, lag, server_time = cursor.fetchone()
+                    replica.replay_lsn = parse_lsn(lsn) if lsn else 0
+                    replica.lag = lag
+                    replica.caught_up_to = server_time - lag
+                    healthy = lag <= self.max_lag
+                except psycopg2.Error:
+                    discard = True
+                finally:
+                    replica.pool.putconn(conn, discard=discard)
+            replica.healthy = healthy
+            replica.checked_at = time.monotonic()
+            with self._lock:
+                self._counters['checks'] += 1
+                if conn is None or not healthy:
+                    self._counters['failed_checks'] += 1
+        finally:
+            replica.check_lock.release()
+
+    def _caught_up(self, replica: Replica, lsn: Optional[int], timestamp: Optional[float]) -> bool:
+        return replica.healthy and (lsn is None or replica.replay_lsn >= lsn) and \
+            (timestamp is None or replica.caught_up_to >= timestamp)
+
+    def pool(self, read_after: Optional[str] = None) -> ConnectionPool:
+        '''Pool of the next replica that is healthy and has replayed read_after, else the primary'''
+        with tracing.span('route') as span:
+            try:
+                lsn, timestamp = parse_read_after(read_after) if read_after else (None, None)
+            except ValueError:
+                # A requirement that cannot be checked is met by the primary
+                self._count('primary_reads')
+                span.tag(target='primary')
+                return get_pool()
+            start = next(self._turn)
+            for offset in range(len(self.replicas)):
+                replica = self.replicas[(start + offset) % len(self.replicas)]
+                due = replica.checked_at is None or time.monotonic() - replica.checked_at >= self.check_interval
+                if due or (replica.healthy and not self._caught_up(replica, lsn, timestamp)):
+                    self.check(replica)
+                if self._caught_up(replica, lsn, timestamp):
+                    self._count('replica_reads')
+                    span.tag(target=f'replica{replica.index}')
+                    return replica.pool
+                self._count('lagging' if replica.healthy else 'unavailable')
+            self._count('primary_reads')
+            span.tag(target='primary')
+            return get_pool()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+        self._maybe_report()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshot: Dict[str, Any] = dict(self._counters)
+        snapshot['replicas'] = [replica.state() for replica in self.replicas]
+        return snapshot
+
+    def _maybe_report(self) -> None:
+        now = time.monotonic()
+        if now - self._last_report < POOL_STATS_INTERVAL:
+            return
+        self._last_report = now
+        print(json.dumps({'event': 'db_replica_stats', **self.stats()}))
+
+
+_router: Optional[ReadRouter] = None
+
+
+def get_router() -> Optional[ReadRouter]:
+    '''Module-level read router, None when no replicas are configured'''
+    global _router
+    if _router is None and REPLICA_URLS:
+        with _pool_lock:
+            if _router is None:
+                _router = ReadRouter(REPLICA_URLS)
+    return _router
+
+
+def request_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    '''Case-insensitive request header lookup'''
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+
+def reads_after_write(event: Dict[str, Any]) -> bool:
+    '''True when the request carries X-Read-After: a cached answer may predate the write it waits for'''
+    return request_header(event, READ_AFTER_HEADER) is not None
+
+
+def get_read_pool(event: Dict[str, Any]) -> ConnectionPool:
+    '''Pool for a request that only reads: a replica when one can serve it, else the primary'''
+    router = get_router()
+    if router is None:
+        return get_pool()
+    return router.pool(request_header(event, READ_AFTER_HEADER))
+
+
+def primary_lsn() -> str:
+    '''Current WAL position of the primary'''
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT pg_current_wal_lsn()::text')
+            return cursor.fetchone()[0]
+    finally:
+        pool.putconn(conn)
+
+
+def with_write_lsn(handler: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+    '''
+    Decorator for handler(event, context): successful responses to methods
+    other than GET carry the primary's WAL position after the write, which
+    clients pass back as X-Read-After. Does nothing without replicas.
+    '''
+    @wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        response = handler(event, context)
+        if get_router() is None or event.get('httpMethod', 'GET') in ('GET', 'OPTIONS') \
+                or response.get('statusCode', 200) >= 400:
+            return response
+        headers = dict(response.get('headers') or {})
+        headers[WRITE_LSN_HEADER] = primary_lsn()
+        exposed = headers.get('Access-Control-Expose-Headers')
+        headers['Access-Control-Expose-Headers'] = f'{exposed}, {WRITE_LSN_HEADER}' if exposed else WRITE_LSN_HEADER
+        return {**response, 'headers': headers}
+    return wrapper
@@ -1,12 +1,356 @@
 import json
 import os
-from typing import Dict, Any
+import time
+from typing import Dict, Any, Optional, Tuple
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from db import get_pool, get_read_pool, with_write_lsn
+import tracing
+import compression
+import serialize
+import statements
 
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_MAX_PAGE_SIZE = 200
+PREVIEW_LENGTH = 200
+SYNC_MESSAGE_LIMIT = 500
+SEND_BATCH_MAX_SIZE = 500
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+# messages is partitioned by month (see ensure_message_partitions): partitions
+# are kept this many months ahead, checked at most once per interval
+MESSAGE_PARTITION_MONTHS_AHEAD = int(os.environ.get('MESSAGE_PARTITION_MONTHS_AHEAD', '3'))
+MESSAGE_PARTITION_CHECK_INTERVAL = float(os.environ.get('MESSAGE_PARTITION_CHECK_INTERVAL', '3600'))
+# MESSAGE_ARCHIVE_AFTER_MONTHS: months of history kept attached besides the
+# current one; older partitions are detached into messages_archive_YYYY_MM
+# tables. Unset or 0 keeps everything
+MESSAGE_ARCHIVE_AFTER_MONTHS = int(os.environ.get('MESSAGE_ARCHIVE_AFTER_MONTHS', '0'))
+
+# One row per chat: summary columns on chats and the per-participant
+# unread counter are maintained by action=send and action=mark_read.
+# The list and message pages are the hottest reads and keyed by ids, so their
+# plan is the same for every user and chat: pinned generic, planned once per
+# connection (auto keeps re-planning them, the generic estimate looks worse)
+CHAT_LIST = statements.define('chats_list', """
+    SELECT 
+        c.id, c.name, c.is_group, c.avatar_url,
+        c.last_message_id,
+        c.last_message_preview as last_message,
+        c.last_message_at as last_message_time,
+        cp.last_read_message_id,
+        cp.unread_count
+    FROM chat_participants cp
+    INNER JOIN chats c ON c.id = cp.chat_id
+    WHERE cp.user_id = %(user_id)s
+    ORDER BY c.last_message_at DESC NULLS LAST, c.id DESC
+""", plan='generic')
+
+# Read status comes from read watermarks: someone else's message is read
+# once the viewer's watermark passes it, the viewer's own message once
+# every other participant's watermark does
+MESSAGES_PAGE_SQL = """
+    WITH {cursor_cte}watermarks AS (
+        SELECT 
+            COALESCE(MAX(last_read_message_id) FILTER (WHERE user_id = %(user_id)s), 0) as own,
+            COALESCE(MIN(COALESCE(last_read_message_id, 0)) FILTER (WHERE user_id != %(user_id)s), 0) as others
+        FROM chat_participants
+        WHERE chat_id = %(chat_id)s
+    )
+    SELECT 
+        m.id, m.content, m.message_type,
+        m.id <= CASE WHEN m.sender_id = %(user_id)s THEN w.others ELSE w.own END as is_read,
+        m.created_at,
+        m.sender_id, u.full_name as sender_name, u.avatar_url as sender_avatar
+    FROM messages m
+    INNER JOIN users u ON m.sender_id = u.id
+    CROSS JOIN watermarks w
+    WHERE m.chat_id = %(chat_id)s {cursor_filter}
+    ORDER BY m.created_at {order}, m.id {order}
+    LIMIT %(limit)s
+"""
+
+# Keyset pagination over idx_messages_chat_created_id: the cursor is
+# a message id whose (created_at, id) bounds the next page. The plain
+# created_at bound is what prunes month partitions (row comparisons do not);
+# the newest page reads partitions newest-first and stops at the limit
+PAGE_CURSOR_CTE = """page_cursor AS (
+        SELECT created_at, id FROM messages WHERE id = %(cursor_id)s AND chat_id = %(chat_id)s
+    ), """
+MESSAGES_LATEST = statements.define('chats_messages_latest', MESSAGES_PAGE_SQL.format(
+    cursor_cte='',
+    cursor_filter='',
+    order='DESC'
+), plan='generic')
+MESSAGES_BEFORE = statements.define('chats_messages_before', MESSAGES_PAGE_SQL.format(
+    cursor_cte=PAGE_CURSOR_CTE,
+    cursor_filter="""
+      AND m.created_at <= (SELECT created_at FROM page_cursor)
+      AND (m.created_at, m.id) < (SELECT created_at, id FROM page_cursor)""",
+    order='DESC'
+), plan='generic')
+MESSAGES_AFTER = statements.define('chats_messages_after', MESSAGES_PAGE_SQL.format(
+    cursor_cte=PAGE_CURSOR_CTE,
+    cursor_filter="""
+      AND m.created_at >= (SELECT created_at FROM page_cursor)
+      AND (m.created_at, m.id) > (SELECT created_at, id FROM page_cursor)""",
+    order='ASC'
+), plan='generic')
+
+SNAPSHOT_XMIN = statements.define('chats_snapshot_xmin', """
+    SELECT txid_snapshot_xmin(txid_current_snapshot()) AS xmin
+""")
+
+SYNC_CHATS = statements.define('chats_sync_chats', """
+    SELECT 
+        c.id, c.name, c.is_group, c.avatar_url,
+        c.last_message_id,
+        c.last_message_preview as last_message,
+        c.last_message_at as last_message_time,
+        cp.last_read_message_id,
+        cp.unread_count
+    FROM chat_participants cp
+    INNER JOIN chats c ON c.id = cp.chat_id
+    WHERE cp.user_id = %(user_id)s
+      AND (c.change_txid >= %(since)s OR cp.change_txid >= %(since)s)
+    ORDER BY c.last_message_at DESC NULLS LAST, c.id DESC
+""")
+
+SYNC_READ_STATE = statements.define('chats_sync_read_state', """
+    SELECT p.chat_id, p.user_id, p.last_read_message_id, p.unread_count
+    FROM chat_participants p
+    WHERE p.chat_id IN (SELECT chat_id FROM chat_participants WHERE user_id = %(user_id)s)
+      AND p.change_txid >= %(since)s
+""")
+
+SYNC_MESSAGES = statements.define('chats_sync_messages', """
+    SELECT 
+        m.id, m.chat_id, m.content, m.message_type, m.created_at,
+        m.sender_id, u.full_name as sender_name, u.avatar_url as sender_avatar,
+        m.change_txid
+    FROM messages m
+    INNER JOIN users u ON m.sender_id = u.id
+    WHERE m.chat_id IN (SELECT chat_id FROM chat_participants WHERE user_id = %(user_id)s)
+      AND (m.change_txid, m.id) > (%(since)s, %(since_message_id)s)
+      AND m.change_txid < %(xmin)s
+    ORDER BY m.change_txid, m.id
+    LIMIT %(limit)s
+""")
+
+# Insert, refresh the chat summary and bump the other participants'
+# unread counters in one statement and one transaction
+SEND = statements.define('chats_send', """
+    WITH new_message AS (
+        INSERT INTO messages (chat_id, sender_id, content, message_type)
+        VALUES (%(chat_id)s, %(sender_id)s, %(content)s, %(message_type)s)
+        RETURNING id, chat_id, sender_id, content, created_at
+    ), touched_chat AS (
+        UPDATE chats c SET
+            updated_at = CURRENT_TIMESTAMP,
+            last_message_id = nm.id,
+            last_message_preview = LEFT(nm.content, %(preview_length)s),
+            last_message_at = nm.created_at
+        FROM new_message nm
+        WHERE c.id = nm.chat_id
+    ), unread AS (
+        UPDATE chat_participants cp SET unread_count = cp.unread_count + 1
+        FROM new_message nm
+        WHERE cp.chat_id = nm.chat_id AND cp.user_id != nm.sender_id
+    )
+    SELECT id, content, created_at FROM new_message
+""")
+
+# Advance the read watermark (never backwards). Reading up to the latest
+# message zeroes the counter; a partial read recounts only what is left
+MARK_READ = statements.define('chats_mark_read', """
+    UPDATE chat_participants cp SET
+        last_read_message_id = w.target,
+        unread_count = CASE
+            WHEN w.target >= COALESCE(c.last_message_id, 0) THEN 0
+            ELSE (
+                SELECT COUNT(*) FROM messages m
+                WHERE m.chat_id = cp.chat_id AND m.id > w.target AND m.sender_id != cp.user_id
+            )
+        END
+    FROM chats c
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(%(message_id)s::integer, c.last_message_id) as target
+    ) w
+    WHERE cp.chat_id = %(chat_id)s AND cp.user_id = %(user_id)s
+      AND c.id = cp.chat_id
+      AND w.target > COALESCE(cp.last_read_message_id, 0)
+    RETURNING cp.last_read_message_id, cp.unread_count
+""")
+
+# One multi-row insert from parallel arrays (one statement whatever the batch
+# size); each touched chat's summary and unread counters are bumped once.
+# client_id makes a retried batch return the rows stored by the first attempt
+# instead of inserting them again: each message first claims its
+# (sender_id, client_id) in message_client_ids, which also fixes its id and
+# created_at, and only claimed messages are inserted
+SEND_BATCH = statements.define('chats_send_batch', """
+    WITH params AS (
+        SELECT %(sender_id)s::integer as sender_id, %(preview_length)s::integer as preview_length
+    ), batch AS (
+        SELECT b.position, b.chat_id::integer as chat_id, b.content, b.message_type, b.client_id
+        FROM unnest(%(chat_ids)s::text[], %(contents)s::text[], %(message_types)s::text[], %(client_ids)s::text[])
+            WITH ORDINALITY AS b(chat_id, content, message_type, client_id, position)
+    ), claimed AS (
+        INSERT INTO message_client_ids (sender_id, client_id, message_id, created_at)
+        SELECT p.sender_id, b.client_id, nextval('messages_id_seq'), CURRENT_TIMESTAMP
+        FROM batch b, params p
+        ORDER BY b.position
+        ON CONFLICT (sender_id, client_id) DO NOTHING
+        RETURNING client_id, message_id, created_at
+    ), inserted AS (
+        INSERT INTO messages (id, chat_id, sender_id, content, message_type, client_id, created_at)
+        SELECT c.message_id, b.chat_id, p.sender_id, b.content, b.message_type, b.client_id, c.created_at
+        FROM claimed c
+        JOIN batch b ON b.client_id = c.client_id
+        CROSS JOIN params p
+        ORDER BY b.position
+        RETURNING id, chat_id, content, created_at, client_id
+    ), latest AS (
+        SELECT DISTINCT ON (chat_id) id, chat_id, content, created_at
+        FROM inserted
+        ORDER BY chat_id, id DESC
+    ), touched_chats AS (
+        UPDATE chats c SET
+            updated_at = CURRENT_TIMESTAMP,
+            last_message_id = l.id,
+            last_message_preview = LEFT(l.content, p.preview_length),
+            last_message_at = l.created_at
+        FROM latest l, params p
+        WHERE c.id = l.chat_id
+    ), unread AS (
+        UPDATE chat_participants cp SET unread_count = cp.unread_count + n.inserted_count
+        FROM (SELECT chat_id, COUNT(*) as inserted_count FROM inserted GROUP BY chat_id) n, params p
+        WHERE cp.chat_id = n.chat_id AND cp.user_id != p.sender_id
+    )
+    SELECT 
+        b.client_id,
+        COALESCE(i.id, k.message_id) as id,
+        COALESCE(i.created_at, k.created_at) as created_at,
+        i.id IS NULL as duplicate
+    FROM batch b
+    CROSS JOIN params p
+    LEFT JOIN inserted i ON i.client_id = b.client_id
+    LEFT JOIN message_client_ids k ON i.id IS NULL AND k.sender_id = p.sender_id AND k.client_id = b.client_id
+    ORDER BY b.position
+""")
+
+# Claims of a concurrent identical retry: SEND_BATCH waited for them on
+# ON CONFLICT but read message_client_ids with its snapshot from before they
+# committed, so it returns NULL ids for them; a new statement sees them
+CLAIMED_CLIENT_IDS = statements.define('chats_claimed_client_ids', """
+    SELECT client_id, message_id as id, created_at
+    FROM message_client_ids
+    WHERE sender_id = %(sender_id)s AND client_id = ANY(%(client_ids)s::text[])
+""")
+
+# Full-text search over the chats the user is in, best matches first. The
+# query is parsed as web-search syntax ("quoted phrases", or, -word) and
+# matched per chat through idx_messages_chat_search; only the returned page
+# gets snippets, since ts_headline parses the content again. Pages continue
+# from the (rank, id) of the last result
+MESSAGE_SEARCH_SQL = """
+    WITH hits AS (
+        SELECT
+            m.id, m.chat_id, m.sender_id, m.created_at, m.content,
+            ts_rank(m.search_vector, websearch_to_tsquery('russian', %(q)s)) AS rank
+        FROM chat_participants cp
+        INNER JOIN messages m ON m.chat_id = cp.chat_id
+        WHERE cp.user_id = %(user_id)s
+          AND (%(chat_id)s::integer IS NULL OR cp.chat_id = %(chat_id)s::integer)
+          AND m.search_vector @@ websearch_to_tsquery('russian', %(q)s)
+    ), page AS (
+        SELECT * FROM hits
+        {cursor_filter}
+        ORDER BY rank DESC, id DESC
+        LIMIT %(limit)s
+    )
+    SELECT
+        p.id, p.chat_id, c.name as chat_name, p.created_at,
+        p.sender_id, u.full_name as sender_name,
+        ts_headline('russian', p.content, websearch_to_tsquery('russian', %(q)s),
+            'MaxFragments=2, MinWords=5, MaxWords=20') as snippet,
+        p.rank
+    FROM page p
+    INNER JOIN chats c ON c.id = p.chat_id
+    INNER JOIN users u ON u.id = p.sender_id
+    ORDER BY p.rank DESC, p.id DESC
+"""
+
+# Custom plans: the number of hits, and so the best join, depends on the words
+MESSAGE_SEARCH = statements.define('chats_message_search', MESSAGE_SEARCH_SQL.format(
+    cursor_filter=''
+), plan='custom')
+MESSAGE_SEARCH_NEXT = statements.define('chats_message_search_next', MESSAGE_SEARCH_SQL.format(
+    cursor_filter='WHERE (rank, id) < (%(cursor_rank)s::real, %(cursor_id)s)'
+), plan='custom')
+
+ENSURE_PARTITIONS = statements.define('chats_ensure_partitions', """
+    SELECT ensure_message_partitions(%(months_ahead)s)
+""")
+
+ARCHIVE_PARTITIONS = statements.define('chats_archive_partitions', """
+    SELECT archive_message_partitions(%(keep_months)s)
+""")
+
+partitions_checked_at: Optional[float] = None
+
+def maintain_message_partitions(conn: Any) -> None:
+    '''
+    Create the coming months' partitions of messages, and archive old ones if
+    MESSAGE_ARCHIVE_AFTER_MONTHS is set, at most once per check interval per
+    warm instance. Runs in its own transaction before a write; a failure
+    (e.g. the lock timeout) is logged and retried at the next interval,
+    months before the partition is needed.
+    '''
+    global partitions_checked_at
+    now = time.monotonic()
+    if partitions_checked_at is not None and now - partitions_checked_at < MESSAGE_PARTITION_CHECK_INTERVAL:
+        return
+    partitions_checked_at = now
+    cursor = conn.cursor()
+    try:
+        statements.execute(cursor, ENSURE_PARTITIONS, {'months_ahead': MESSAGE_PARTITION_MONTHS_AHEAD})
+        created = cursor.fetchone()[0]
+        archived = 0
+        if MESSAGE_ARCHIVE_AFTER_MONTHS > 0:
+            statements.execute(cursor, ARCHIVE_PARTITIONS, {'keep_months': MESSAGE_ARCHIVE_AFTER_MONTHS})
+            archived = cursor.fetchone()[0]
+        conn.commit()
+        if created or archived:
+            print(json.dumps({'event': 'message_partitions', 'created': created, 'archived': archived}))
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(json.dumps({'event': 'message_partitions_failed', 'error': str(e).strip()}))
+    finally:
+        cursor.close()
+
+def parse_sync_token(token: str) -> Tuple[int, int]:
+    '''Split a sync token "<txid>" or "<txid>:<message_id>" into its parts'''
+    txid, _, message_id = token.partition(':')
+    return int(txid), int(message_id or 0)
+
+def parse_search_cursor(token: str) -> Tuple[float, int]:
+    '''Split a search cursor "<rank>:<message_id>" into its parts'''
+    rank, _, message_id = token.partition(':')
+    return float(rank), int(message_id)
+
+def get_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    '''Case-insensitive request header lookup'''
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+@tracing.traced('chats')
+@compression.compressed
+@with_write_lsn
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Manage chats - get chat list, messages, send messages
+    Business: Manage chats - get chat list, messages, delta sync, message search, send messages (single or batched), mark read
     Args: event with httpMethod (GET/POST/OPTIONS), queryStringParameters, body
           context with request_id
     Returns: HTTP response with chat data or operation confirmation
@@ -19,36 +363,27 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, If-None-Match, X-Read-After',
+                'Access-Control-Expose-Headers': 'ETag',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    db_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(db_url)
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    pool = get_read_pool(event) if method == 'GET' else get_pool()
+    conn = pool.getconn()
+    cursor = serialize.cursor(conn)
     
     try:
         if method == 'GET':
             query_params = event.get('queryStringParameters', {})
             action = query_params.get('action', 'list')
+            tracing.tag(f'GET {action}')
             user_id = query_params.get('user_id', '1')
+            columnar = serialize.wants_columnar(event)
             
             if action == 'list':
-                cursor.execute(f"""
-                    SELECT 
-                        c.id, c.name, c.is_group, c.avatar_url,
-                        m.content as last_message,
-                        m.created_at as last_message_time,
-                        COUNT(CASE WHEN m.is_read = false AND m.sender_id != {user_id} THEN 1 END) as unread_count
-                    FROM chats c
-                    INNER JOIN chat_participants cp ON c.id = cp.chat_id
-                    LEFT JOIN messages m ON c.id = m.chat_id
-                    WHERE cp.user_id = {user_id}
-                    GROUP BY c.id, c.name, c.is_group, c.avatar_url, m.content, m.created_at
-                    ORDER BY m.created_at DESC NULLS LAST
-                """)
+                statements.execute(cursor, CHAT_LIST, {'user_id': user_id})
                 chats = cursor.fetchall()
                 
                 return {
@@ -58,7 +393,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'Access-Control-Allow-Origin': '*'
                     },
                     'isBase64Encoded': False,
-                    'body': json.dumps([dict(chat) for chat in chats], default=str)
+                    'body': tracing.dumps(serialize.table(serialize.columns(cursor), chats, columnar))
                 }
             
             elif action == 'messages':
@@ -70,16 +405,165 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'chat_id required'})
                     }
                 
-                cursor.execute(f"""
-                    SELECT 
-                        m.id, m.content, m.message_type, m.is_read, m.created_at,
-                        m.sender_id, u.full_name as sender_name, u.avatar_url as sender_avatar
-                    FROM messages m
-                    INNER JOIN users u ON m.sender_id = u.id
-                    WHERE m.chat_id = {chat_id}
-                    ORDER BY m.created_at ASC
-                """)
+                try:
+                    limit = min(max(int(query_params.get('limit', MESSAGES_PAGE_SIZE)), 1), MESSAGES_MAX_PAGE_SIZE)
+                    before_id = int(query_params['before']) if query_params.get('before') else None
+                    after_id = int(query_params['after']) if query_params.get('after') else None
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'limit, before and after must be integers'})
+                    }
+                
+                if after_id is not None:
+                    page = MESSAGES_AFTER
+                elif before_id is not None:
+                    page = MESSAGES_BEFORE
+                else:
+                    page = MESSAGES_LATEST
+                statements.execute(cursor, page, {
+                    'chat_id': chat_id,
+                    'user_id': user_id,
+                    'cursor_id': after_id if after_id is not None else before_id,
+                    'limit': limit + 1
+                })
                 messages = cursor.fetchall()
+                message_keys = serialize.columns(cursor)
+                
+                # m.id is the first column
+                has_more = len(messages) > limit
+                messages = messages[:limit]
+                if after_id is not None:
+                    # Pages are always returned newest-first; the forward cursor is
+                    # the newest message seen so the client can keep polling from it
+                    messages.reverse()
+                    next_cursor = messages[0][0] if messages else after_id
+                else:
+                    next_cursor = messages[-1][0] if messages and has_more else None
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'isBase64Encoded': False,
+                    'body': tracing.dumps({
+                        'messages': serialize.table(message_keys, messages, columnar),
+                        'next_cursor': next_cursor,
+                        'has_more': has_more
+                    })
+                }
+            
+            elif action == 'sync':
+                since = query_params.get('since')
+                try:
+                    since_txid, since_message_id = parse_sync_token(since) if since else (None, 0)
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'invalid sync token'})
+                    }
+                
+                # Every transaction older than the snapshot xmin has finished, so rows
+                # it wrote are visible below and no later commit can carry a lower txid.
+                # Messages are only paged below xmin, which keeps tokens monotonic and
+                # lets a truncated page resume from its last row without gaps
+                statements.execute(cursor, SNAPSHOT_XMIN)
+                snapshot_xmin = cursor.fetchone()[0]
+                changed_since = since_txid if since_txid is not None else 0
+                
+                statements.execute(cursor, SYNC_CHATS, {'user_id': user_id, 'since': changed_since})
+                chats = cursor.fetchall()
+                chat_keys = serialize.columns(cursor)
+                
+                statements.execute(cursor, SYNC_READ_STATE, {'user_id': user_id, 'since': changed_since})
+                read_state = cursor.fetchall()
+                read_state_keys = serialize.columns(cursor)
+                
+                # A first sync carries no history; clients page it with action=messages
+                messages = []
+                message_keys: Tuple[str, ...] = ()
+                if since_txid is not None:
+                    statements.execute(cursor, SYNC_MESSAGES, {
+                        'user_id': user_id,
+                        'since': since_txid,
+                        'since_message_id': since_message_id,
+                        'xmin': snapshot_xmin,
+                        'limit': SYNC_MESSAGE_LIMIT + 1
+                    })
+                    messages = cursor.fetchall()
+                    message_keys = serialize.columns(cursor)
+                
+                has_more = len(messages) > SYNC_MESSAGE_LIMIT
+                messages = messages[:SYNC_MESSAGE_LIMIT]
+                if has_more:
+                    last = serialize.record(message_keys, messages[-1])
+                    token = f"{last['change_txid']}:{last['id']}"
+                elif chats or read_state or messages or since is None:
+                    token = str(snapshot_xmin)
+                else:
+                    token = since
+                
+                if token == since and get_header(event, 'If-None-Match') == f'"{since}"':
+                    return {
+                        'statusCode': 304,
+                        'headers': {'ETag': f'"{since}"', 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': ''
+                    }
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'ETag': f'"{token}"'
+                    },
+                    'isBase64Encoded': False,
+                    'body': tracing.dumps({
+                        'token': token,
+                        'chats': serialize.table(chat_keys, chats, columnar),
+                        'messages': serialize.table(message_keys, messages, columnar, exclude=('change_txid',)),
+                        'read_state': serialize.table(read_state_keys, read_state, columnar),
+                        'has_more': has_more
+                    })
+                }
+            
+            elif action == 'search':
+                search_query = (query_params.get('q') or '').strip()
+                if not search_query:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'q required'})
+                    }
+                
+                try:
+                    limit = min(max(int(query_params.get('limit', SEARCH_PAGE_SIZE)), 1), SEARCH_MAX_PAGE_SIZE)
+                    chat_id = int(query_params['chat_id']) if query_params.get('chat_id') else None
+                    search_cursor = parse_search_cursor(query_params['cursor']) if query_params.get('cursor') else None
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'limit and chat_id must be integers, cursor a search cursor'})
+                    }
+                
+                search_params = {'q': search_query, 'user_id': user_id, 'chat_id': chat_id, 'limit': limit + 1}
+                if search_cursor is not None:
+                    search_params['cursor_rank'], search_params['cursor_id'] = search_cursor
+                    statements.execute(cursor, MESSAGE_SEARCH_NEXT, search_params)
+                else:
+                    statements.execute(cursor, MESSAGE_SEARCH, search_params)
+                results = cursor.fetchall()
+                
+                # rank is the last column and id the first
+                has_more = len(results) > limit
+                results = results[:limit]
+                next_cursor = f'{results[-1][-1]!r}:{results[-1][0]}' if has_more else None
                 
                 return {
                     'statusCode': 200,
@@ -88,17 +572,24 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'Access-Control-Allow-Origin': '*'
                     },
                     'isBase64Encoded': False,
-                    'body': json.dumps([dict(msg) for msg in messages], default=str)
+                    'body': tracing.dumps({
+                        'results': serialize.table(serialize.columns(cursor), results, columnar),
+                        'next_cursor': next_cursor,
+                        'has_more': has_more
+                    })
                 }
         
         elif method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
             action = body_data.get('action', 'send')
+            tracing.tag(f'POST {action}')
+            if action in ('send', 'send_batch'):
+                maintain_message_partitions(conn)
             
             if action == 'send':
                 chat_id = body_data.get('chat_id')
                 sender_id = body_data.get('sender_id', 1)
-                content = body_data.get('content', '').replace("'", "''")
+                content = body_data.get('content', '')
                 message_type = body_data.get('message_type', 'text')
                 
                 if not chat_id or not content:
@@ -108,14 +599,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'chat_id and content required'})
                     }
                 
-                cursor.execute(f"""
-                    INSERT INTO messages (chat_id, sender_id, content, message_type)
-                    VALUES ({chat_id}, {sender_id}, '{content}', '{message_type}')
-                    RETURNING id, content, created_at
-                """)
-                new_message = cursor.fetchone()
-                
-                cursor.execute(f"UPDATE chats SET updated_at = CURRENT_TIMESTAMP WHERE id = {chat_id}")
+                statements.execute(cursor, SEND, {
+                    'chat_id': chat_id,
+                    'sender_id': sender_id,
+                    'content': content,
+                    'message_type': message_type,
+                    'preview_length': PREVIEW_LENGTH
+                })
+                new_message = serialize.record(serialize.columns(cursor), cursor.fetchone())
                 conn.commit()
                 
                 return {
@@ -127,8 +618,97 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False,
                     'body': json.dumps({
                         'message': 'Message sent',
-                        'data': dict(new_message)
-                    }, default=str)
+                        'data': new_message
+                    })
+                }
+            
+            elif action == 'mark_read':
+                chat_id = body_data.get('chat_id')
+                user_id = body_data.get('user_id', 1)
+                message_id = body_data.get('message_id')
+                
+                if not chat_id:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'chat_id required'})
+                    }
+                
+                statements.execute(cursor, MARK_READ, {'chat_id': chat_id, 'user_id': user_id, 'message_id': message_id})
+                read_state = serialize.record(serialize.columns(cursor), cursor.fetchone())
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'isBase64Encoded': False,
+                    'body': json.dumps({
+                        'message': 'Chat marked as read' if read_state else 'Already read',
+                        'data': read_state
+                    })
+                }
+            
+            elif action == 'send_batch':
+                sender_id = body_data.get('sender_id', 1)
+                items = body_data.get('messages') or []
+                
+                error = None
+                if not isinstance(items, list) or not items:
+                    error = 'messages array required'
+                elif len(items) > SEND_BATCH_MAX_SIZE:
+                    error = f'at most {SEND_BATCH_MAX_SIZE} messages per batch'
+                elif any(not isinstance(item, dict) or not item.get('chat_id') or not item.get('content') or not item.get('client_id') for item in items):
+                    error = 'each message requires chat_id, content and client_id'
+                elif len({str(item['client_id']) for item in items}) != len(items):
+                    error = 'client_id must be unique within a batch'
+                if error:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': error})
+                    }
+                
+                statements.execute(cursor, SEND_BATCH, {
+                    'sender_id': sender_id,
+                    'preview_length': PREVIEW_LENGTH,
+                    'chat_ids': [str(item['chat_id']) for item in items],
+                    'contents': [item['content'] for item in items],
+                    'message_types': [item.get('message_type', 'text') for item in items],
+                    'client_ids': [str(item['client_id']) for item in items]
+                })
+                results = serialize.records(serialize.columns(cursor), cursor.fetchall())
+                unresolved = [result['client_id'] for result in results if result['id'] is None]
+                if unresolved:
+                    statements.execute(cursor, CLAIMED_CLIENT_IDS, {'sender_id': sender_id, 'client_ids': unresolved})
+                    claimed = {row['client_id']: row for row in serialize.records(serialize.columns(cursor), cursor.fetchall())}
+                    for result in results:
+                        if result['id'] is None and result['client_id'] in claimed:
+                            result.update(id=claimed[result['client_id']]['id'],
+                                          created_at=claimed[result['client_id']]['created_at'])
+                conn.commit()
+                
+                if any(result['id'] is None for result in results):
+                    # A claim the re-read still misses; the next retry returns the stored rows
+                    return {
+                        'statusCode': 409,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'a concurrent send of these messages is in progress, retry'})
+                    }
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'isBase64Encoded': False,
+                    'body': tracing.dumps({
+                        'message': 'Messages sent',
+                        'data': results
+                    })
                 }
         
         return {
@@ -139,4 +719,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cursor.close()
-        conn.close()
+        pool.putconn(conn)
@@ -0,0 +1,284 @@
+'''
+Per-request timing spans for the backend functions.
+Each invocation gets a Trace tagged with context.request_id and its action.
+Sampled traces (TRACE_SAMPLE_RATE) record connect/execute/fetch/serialize
+spans, are logged as one JSON line and feed per-span histograms that are
+reported periodically. Unsampled ones only keep the slow-query check, so
+the cost when sampling is off is a clock read around each statement.
+Vendored into each function that uses it and kept identical.
+'''
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0'))
+TRACE_SLOW_QUERY_MS = float(os.environ.get('TRACE_SLOW_QUERY_MS', '500'))
+TRACE_EXPLAIN_SLOW = os.environ.get('TRACE_EXPLAIN_SLOW', '') == '1'
+TRACE_STATS_INTERVAL = float(os.environ.get('TRACE_STATS_INTERVAL', '60'))
+
+SLOW_QUERY_MAX_LENGTH = 2000
+
+# Histogram bucket upper bounds in milliseconds, roughly x2 apart
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+
+class _NullSpan:
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+    def tag(self, **attrs: Any) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, trace: 'Trace', name: str, attrs: Dict[str, Any]) -> None:
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self) -> '_Span':
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.trace.record(self.name, (time.perf_counter() - self.started) * 1000, **self.attrs)
+
+    def tag(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+
+class Trace:
+    '''Spans of one invocation; span() is a no-op unless the trace is sampled'''
+
+    def __init__(self, function: str, request_id: Optional[str], action: Optional[str], sampled: bool) -> None:
+        self.function = function
+        self.request_id = request_id
+        self.action = action
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+
+    def span(self, name: str, **attrs: Any) -> Any:
+        return _Span(self, name, attrs) if self.sampled else _NULL_SPAN
+
+    def record(self, name: str, ms: float, **attrs: Any) -> None:
+        if self.sampled:
+            self.spans.append({'name': name, 'ms': round(ms, 3), **attrs})
+
+    def tag(self, action: str) -> None:
+        self.action = action
+
+
+class Histograms:
+    '''Bucketed span durations per (function, action, span), for sampled traces'''
+
+    def __init__(self) -> None:
+        self._counts: Dict[Tuple[str, str, str], List[int]] = defaultdict(lambda: [0] * len(BUCKETS_MS))
+        self._lock = threading.Lock()
+        self._last_report = time.monotonic()
+
+    def add(self, key: Tuple[str, str, str], ms: float) -> None:
+        index = next(i for i, bound in enumerate(BUCKETS_MS) if ms <= bound)
+        with self._lock:
+            self._counts[key][index] += 1
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        '''Count and bucket-bound p50/p95/p99 per key'''
+        with self._lock:
+            counts = {key: list(buckets) for key, buckets in self._counts.items()}
+        rows = []
+        for (function, action, span), buckets in sorted(counts.items()):
+            total = sum(buckets)
+            row: Dict[str, Any] = {'function': function, 'action': action, 'span': span, 'count': total}
+            for pct in (50, 95, 99):
+                running = 0
+                for bound, count in zip(BUCKETS_MS, buckets):
+                    running += count
+                    if running >= total * pct / 100:
+                        row[f'p{pct}_ms'] = bound if bound != float('inf') else None
+                        break
+            rows.append(row)
+        return rows
+
+    def maybe_report(self) -> None:
+        now = time.monotonic()
+        if now - self._last_report < TRACE_STATS_INTERVAL:
+            return
+        self._last_report = now
+        print(json.dumps({'event': 'trace_stats', 'spans': self.snapshot()}))
+
+
+histograms = Histograms()
+_local = threading.local()
+
+
+def current() -> Optional[Trace]:
+    return getattr(_local, 'trace', None)
+
+
+def span(name: str, **attrs: Any) -> Any:
+    '''Span on the current invocation's trace, e.g. with span('serialize'): ...'''
+    trace = current()
+    return trace.span(name, **attrs) if trace is not None else _NULL_SPAN
+
+
+def tag(action: str) -> None:
+    '''Name the action once the handler has parsed it'''
+    trace = current()
+    if trace is not None:
+        trace.tag(action)
+
+
+def dumps(obj: Any, **kwargs: Any) -> str:
+    '''json.dumps inside a serialize span'''
+    with span('serialize') as serialize:
+        body = json.dumps(obj, **kwargs)
+        serialize.tag(bytes=len(body))
+    return body
+
+
+def traced(function: str) -> Callable[[Callable[..., Dict[str, Any]]], Callable[..., Dict[str, Any]]]:
+    '''Decorator for handler(event, context): one Trace per invocation'''
+    def decorate(handler: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+        @wraps(handler)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            method = event.get('httpMethod', 'GET')
+            query_action = (event.get('queryStringParameters') or {}).get('action')
+            trace = Trace(
+                function,
+                getattr(context, 'request_id', None),
+                f'{method} {query_action}' if query_action else method,
+                TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+            )
+            _local.trace = trace
+            status = 500
+            try:
+                response = handler(event, context)
+                status = response.get('statusCode', 200)
+                return response
+            finally:
+                _local.trace = None
+                if trace.sampled:
+                    _finish(trace, status)
+        return wrapper
+    return decorate
+
+
+def _finish(trace: Trace, status: int) -> None:
+    total_ms = (time.perf_counter() - trace.started) * 1000
+    histograms.add((trace.function, trace.action or '', 'total'), total_ms)
+    for recorded in trace.spans:
+        histograms.add((trace.function, trace.action or '', recorded['name']), recorded['ms'])
+    print(json.dumps({
+        'event': 'trace',
+        'function': trace.function,
+        'request_id': trace.request_id,
+        'action': trace.action,
+        'status': status,
+        'ms': round(total_ms, 3),
+        'spans': trace.spans
+    }, default=str))
+    histograms.maybe_report()
+
+
+def _explain(cursor: Any) -> Optional[List[str]]:
+    '''Plan of the statement the cursor just ran, without executing it again'''
+    conn = cursor.connection
+    savepoint = not conn.autocommit
+    explain_cursor = psycopg2.extensions.cursor(conn)
+    try:
+        if savepoint:
+            explain_cursor.execute('SAVEPOINT trace_explain')
+        try:
+            explain_cursor.execute(b'EXPLAIN ' + cursor.query)
+            plan = [row[0] for row in explain_cursor.fetchall()]
+        except psycopg2.Error as e:
+            plan = [f'EXPLAIN failed: {e}'.strip()]
+            if savepoint:
+                explain_cursor.execute('ROLLBACK TO SAVEPOINT trace_explain')
+        if savepoint:
+            explain_cursor.execute('RELEASE SAVEPOINT trace_explain')
+        return plan
+    except psycopg2.Error:
+        return None
+    finally:
+        explain_cursor.close()
+
+
+def _after_execute(cursor: Any, ms: float) -> None:
+    trace = current()
+    if trace is not None:
+        trace.record('execute', ms, rows=cursor.rowcount)
+    if ms < TRACE_SLOW_QUERY_MS or TRACE_SLOW_QUERY_MS <= 0:
+        return
+    query = (cursor.query or b'').decode('utf-8', 'replace')
+    print(json.dumps({
+        'event': 'slow_query',
+        'function': trace.function if trace else None,
+        'request_id': trace.request_id if trace else None,
+        'action': trace.action if trace else None,
+        'ms': round(ms, 3),
+        'rows': cursor.rowcount,
+        'query': query[:SLOW_QUERY_MAX_LENGTH],
+        'plan': _explain(cursor) if TRACE_EXPLAIN_SLOW else None
+    }))
+
+
+_cursor_classes: Dict[type, type] = {}
+
+
+def _traced_cursor_class(base: type) -> type:
+    '''Subclass of a cursor factory that times execute and the fetch calls'''
+    cls = _cursor_classes.get(base)
+    if cls is not None:
+        return cls
+
+    class TracedCursor(base):  # type: ignore[misc, valid-type]
+        def execute(self, query: Any, vars: Any = None) -> Any:
+            started = time.perf_counter()
+            result = super().execute(query, vars)
+            _after_execute(self, (time.perf_counter() - started) * 1000)
+            return result
+
+        def fetchone(self) -> Any:
+            with span('fetch', rows=1):
+                return super().fetchone()
+
+        def fetchmany(self, size: Optional[int] = None) -> Any:
+            with span('fetch') as fetch:
+                rows = super().fetchmany(size) if size is not None else super().fetchmany()
+                fetch.tag(rows=len(rows))
+            return rows
+
+        def fetchall(self) -> Any:
+            with span('fetch') as fetch:
+                rows = super().fetchall()
+                fetch.tag(rows=len(rows))
+            return rows
+
+    TracedCursor.__name__ = f'Traced{base.__name__}'
+    _cursor_classes[base] = TracedCursor
+    return TracedCursor
+
+
+class TracedConnection(psycopg2.extensions.connection):
+    '''Connection whose cursors, of whatever cursor_factory, are traced'''
+
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _traced_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
@@ -0,0 +1,116 @@
+'''
+Negotiated compression of handler responses.
+Handlers build their response as before; compressed() then encodes bodies
+of at least COMPRESSION_MIN_BYTES with the best coding the client's
+Accept-Encoding allows (br, then gzip), returned base64 with
+isBase64Encoded so the gateway sends the compressed bytes. Such responses
+carry Vary: Accept-Encoding whether or not they were compressed. Brotli is
+used when the package is installed, otherwise only gzip is offered. The
+default levels are where bench/compression.py found most of the size
+saving for a small share of the CPU of the maximum ones.
+Vendored into each function that uses it and kept identical.
+'''
+import base64
+import os
+import zlib
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+import tracing
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '3'))
+BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '5'))
+
+
+def gzip_encode(data: bytes, level: int = GZIP_LEVEL) -> bytes:
+    # wbits=31 writes the gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def brotli_encode(data: bytes, quality: int = BROTLI_QUALITY) -> bytes:
+    return brotli.compress(data, mode=brotli.MODE_TEXT, quality=quality)
+
+
+# In order of preference when the client weighs them equally
+ENCODERS: Dict[str, Callable[[bytes], bytes]] = {}
+if brotli is not None:
+    ENCODERS['br'] = brotli_encode
+ENCODERS['gzip'] = gzip_encode
+
+
+def header(event: Dict[str, Any], name: str) -> Optional[str]:
+    '''Case-insensitive request header lookup'''
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+
+def accepted(accept_encoding: Optional[str]) -> Dict[str, float]:
+    '''Codings of an Accept-Encoding header and their q weights'''
+    weights = {}
+    for part in (accept_encoding or '').split(','):
+        coding, *params = [item.strip() for item in part.split(';')]
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding.lower()] = weight
+    return weights
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    '''The supported coding the client weighs highest, None for identity'''
+    weights = accepted(accept_encoding)
+    best, best_weight = None, 0.0
+    for coding in ENCODERS:
+        weight = weights.get(coding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def compress_response(event: Dict[str, Any], response: Dict[str, Any]) -> Dict[str, Any]:
+    '''The response with its body encoded for the client, when that is worth it'''
+    body = response.get('body')
+    if response.get('isBase64Encoded') or not isinstance(body, str) or len(body) < COMPRESSION_MIN_BYTES:
+        return response
+    headers = dict(response.get('headers') or {})
+    headers['Vary'] = 'Accept-Encoding'
+    coding = negotiate(header(event, 'Accept-Encoding'))
+    if coding is None:
+        return {**response, 'headers': headers}
+    data = body.encode('utf-8')
+    with tracing.span('compress', coding=coding) as span:
+        encoded = ENCODERS[coding](data)
+        span.tag(bytes=len(encoded))
+    if len(encoded) >= len(data):
+        return {**response, 'headers': headers}
+    headers['Content-Encoding'] = coding
+    return {
+        **response,
+        'headers': headers,
+        'isBase64Encoded': True,
+        'body': base64.b64encode(encoded).decode('ascii')
+    }
+
+
+def compressed(handler: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+    '''Decorator for handler(event, context), applied inside tracing.traced'''
+    @wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        return compress_response(event, handler(event, context))
+    return wrapper
@@ -1,13 +1,142 @@
 import json
+import hashlib
 import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from typing import Dict, Any, Optional
+from db import get_pool, get_read_pool, with_write_lsn
+import tracing
+import compression
+import serialize
+import statements
 
+DISCOVER_MAX_ENTRIES = int(os.environ.get('CONTACTS_DISCOVER_MAX_ENTRIES', '10000'))
+
+# Same setting as backend/presence: online while last_seen is younger than this
+PRESENCE_ONLINE_TTL = float(os.environ.get('PRESENCE_ONLINE_TTL', '120'))
+
+CONTACTS_PAGE_SIZE = 50
+CONTACTS_MAX_PAGE_SIZE = 200
+
+# One page of the contacts screen: each contact's user card, presence derived
+# from last_seen (written by backend/presence) and the direct chat with them.
+# Direct chats are found for the whole page at once: the page contacts'
+# participant rows (idx_chat_participants_user_chat) joined to the user's,
+# so a page costs the same however deep it is
+CONTACTS_PAGE_SQL = """
+    WITH {cursor_cte}page AS (
+        SELECT c.id, c.contact_user_id, c.contact_name, c.added_at
+        FROM contacts c
+        WHERE c.user_id = %(user_id)s {cursor_filter}
+        ORDER BY c.added_at DESC, c.id DESC
+        LIMIT %(limit)s
+    ), direct_chats AS (
+        SELECT DISTINCT ON (theirs.user_id)
+            theirs.user_id, ch.id, COALESCE(ch.last_message_at, ch.created_at) as last_activity_at
+        FROM page p
+        JOIN chat_participants theirs ON theirs.user_id = p.contact_user_id
+        JOIN chat_participants mine ON mine.chat_id = theirs.chat_id AND mine.user_id = %(user_id)s
+        JOIN chats ch ON ch.id = theirs.chat_id AND NOT ch.is_group
+        WHERE theirs.user_id != mine.user_id
+        ORDER BY theirs.user_id, last_activity_at DESC NULLS LAST, ch.id DESC
+    )
+    SELECT 
+        p.id as contact_id,
+        u.id, u.unique_id, u.username, u.full_name, 
+        u.phone, u.avatar_url,
+        CASE WHEN u.last_seen > LOCALTIMESTAMP - make_interval(secs => %(online_ttl)s)
+             THEN 'online' ELSE 'offline' END as status,
+        u.last_seen,
+        p.contact_name, p.added_at,
+        d.id as chat_id, d.last_activity_at as chat_last_activity_at
+    FROM page p
+    JOIN users u ON p.contact_user_id = u.id
+    LEFT JOIN direct_chats d ON d.user_id = p.contact_user_id
+    ORDER BY p.added_at DESC, p.id DESC
+"""
+
+# Keyset pagination over idx_contacts_user_added: the cursor is a contact id
+# whose (added_at, id) bounds the next page
+CONTACTS_FIRST_PAGE = statements.define('contacts_page_first', CONTACTS_PAGE_SQL.format(
+    cursor_cte='',
+    cursor_filter=''
+), plan='generic')
+CONTACTS_NEXT_PAGE = statements.define('contacts_page_next', CONTACTS_PAGE_SQL.format(
+    cursor_cte="""page_cursor AS (
+        SELECT added_at, id FROM contacts WHERE id = %(cursor_id)s AND user_id = %(user_id)s
+    ), """,
+    cursor_filter="""
+          AND (c.added_at, c.id) < (SELECT added_at, id FROM page_cursor)"""
+), plan='generic')
+
+# The whole address book travels as two arrays: one set-based join
+# against the unique_id index and one multi-row insert of the matches
+DISCOVER = statements.define('contacts_discover', """
+    WITH book AS (
+        SELECT DISTINCT ON (unique_id) unique_id, contact_name, position
+        FROM unnest(%(unique_ids)s::text[], %(names)s::text[]) WITH ORDINALITY
+            AS b(unique_id, contact_name, position)
+        ORDER BY unique_id, position
+    ), matched AS (
+        SELECT u.id, u.unique_id, u.username, u.full_name, u.avatar_url,
+               CASE WHEN u.last_seen > LOCALTIMESTAMP - make_interval(secs => %(online_ttl)s)
+                    THEN 'online' ELSE 'offline' END as status,
+               b.contact_name, b.position
+        FROM book b
+        JOIN users u ON u.unique_id = b.unique_id
+        WHERE u.id != %(user_id)s
+    ), added AS (
+        INSERT INTO contacts (user_id, contact_user_id, contact_name)
+        SELECT %(user_id)s, id, contact_name FROM matched ORDER BY id
+        ON CONFLICT (user_id, contact_user_id) DO NOTHING
+        RETURNING id, contact_user_id
+    )
+    SELECT 
+        m.id, m.unique_id, m.username, m.full_name, m.avatar_url, m.status,
+        m.contact_name, a.id as contact_id, a.id IS NOT NULL as added
+    FROM matched m
+    LEFT JOIN added a ON a.contact_user_id = m.id
+    ORDER BY m.position
+""")
+
+ADD_CONTACT = statements.define('contacts_add', """
+    INSERT INTO contacts (user_id, contact_user_id, contact_name)
+    VALUES (%(user_id)s, %(contact_user_id)s, %(contact_name)s)
+    ON CONFLICT (user_id, contact_user_id) DO NOTHING
+    RETURNING id
+""")
+
+REMOVE_CONTACT = statements.define('contacts_remove', """
+    UPDATE contacts SET contact_user_id = NULL WHERE id = %(contact_id)s
+""")
+
+def generate_user_id(phone: str) -> str:
+    '''Generate unique user ID from phone number using SHA256 hash'''
+    phone_clean = ''.join(filter(str.isdigit, phone))
+    hash_obj = hashlib.sha256(phone_clean.encode('utf-8'))
+    return hash_obj.hexdigest()[:16]
+
+def address_book_entry(item: Any) -> Optional[Dict[str, Any]]:
+    '''unique_id and display name of one address-book entry, or None if it has neither phone nor unique_id'''
+    if not isinstance(item, dict):
+        return None
+    if isinstance(item.get('unique_id'), str) and item['unique_id'].strip():
+        unique_id = item['unique_id'].strip().lower()
+    elif isinstance(item.get('phone'), str) and any(ch.isdigit() for ch in item['phone']):
+        unique_id = generate_user_id(item['phone'])
+    else:
+        return None
+    name = item.get('name')
+    return {'unique_id': unique_id, 'name': name if isinstance(name, str) else None}
+
+@tracing.traced('contacts')
+@compression.compressed
+@with_write_lsn
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Manage user contacts - list, add, and remove contacts
-    Args: event with httpMethod (GET/POST/DELETE/OPTIONS), body with contact data
+    Args: event with httpMethod (GET/POST/DELETE/OPTIONS), body with contact data;
+          GET pages contacts newest first with limit and cursor (next_cursor of
+          the previous page), each with user card, presence and direct chat
+          POST action=discover matches an address book ({phone|unique_id, name} list)
           context with request_id
     Returns: HTTP response with contacts list or operation status
     '''
@@ -19,35 +148,45 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Read-After',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    db_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(db_url)
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    pool = get_read_pool(event) if method == 'GET' else get_pool()
+    conn = pool.getconn()
+    cursor = serialize.cursor(conn)
     
     try:
         if method == 'GET':
-            query_params = event.get('queryStringParameters', {})
+            query_params = event.get('queryStringParameters') or {}
             user_id = query_params.get('user_id', '1')
             
-            cursor.execute(f"""
-                SELECT 
-                    c.id as contact_id,
-                    u.id, u.unique_id, u.username, u.full_name, 
-                    u.phone, u.avatar_url, u.status,
-                    c.contact_name, c.added_at
-                FROM contacts c
-                JOIN users u ON c.contact_user_id = u.id
-                WHERE c.user_id = {user_id}
-                ORDER BY c.added_at DESC
-            """)
+            try:
+                limit = min(max(int(query_params.get('limit', CONTACTS_PAGE_SIZE)), 1), CONTACTS_MAX_PAGE_SIZE)
+                cursor_id = int(query_params['cursor']) if query_params.get('cursor') else None
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'error': 'limit and cursor must be integers'})
+                }
             
+            params = {'user_id': user_id, 'online_ttl': PRESENCE_ONLINE_TTL, 'limit': limit + 1}
+            if cursor_id is None:
+                statements.execute(cursor, CONTACTS_FIRST_PAGE, params)
+            else:
+                statements.execute(cursor, CONTACTS_NEXT_PAGE, {**params, 'cursor_id': cursor_id})
             contacts = cursor.fetchall()
             
+            has_more = len(contacts) > limit
+            contacts = contacts[:limit]
+            
             return {
                 'statusCode': 200,
                 'headers': {
@@ -55,12 +194,65 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'Access-Control-Allow-Origin': '*'
                 },
                 'isBase64Encoded': False,
-                'body': json.dumps([dict(contact) for contact in contacts], default=str)
+                'body': tracing.dumps({
+                    'contacts': serialize.table(serialize.columns(cursor), contacts, serialize.wants_columnar(event)),
+                    'next_cursor': contacts[-1][0] if contacts and has_more else None,
+                    'has_more': has_more
+                })
             }
         
         elif method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
             user_id = body_data.get('user_id', 1)
+            
+            if body_data.get('action') == 'discover':
+                tracing.tag('POST discover')
+                items = body_data.get('contacts')
+                
+                error = None
+                if not isinstance(items, list) or not items:
+                    error = 'contacts array required'
+                elif len(items) > DISCOVER_MAX_ENTRIES:
+                    error = f'at most {DISCOVER_MAX_ENTRIES} contacts per request'
+                else:
+                    entries = [address_book_entry(item) for item in items]
+                    if any(entry is None for entry in entries):
+                        error = 'each contact requires phone or unique_id'
+                if error:
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'isBase64Encoded': False,
+                        'body': json.dumps({'error': error})
+                    }
+                
+                statements.execute(cursor, DISCOVER, {
+                    'user_id': user_id,
+                    'unique_ids': [entry['unique_id'] for entry in entries],
+                    'names': [entry['name'] for entry in entries],
+                    'online_ttl': PRESENCE_ONLINE_TTL
+                })
+                
+                matched = serialize.records(serialize.columns(cursor), cursor.fetchall())
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'isBase64Encoded': False,
+                    'body': tracing.dumps({
+                        'checked': len(entries),
+                        'added': sum(1 for row in matched if row['added']),
+                        'users': matched
+                    })
+                }
+            
             contact_user_id = body_data.get('contact_user_id')
             contact_name = body_data.get('contact_name', '')
             
@@ -75,14 +267,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'contact_user_id required'})
                 }
             
-            contact_name_escaped = contact_name.replace("'", "''")
-            
-            cursor.execute(f"""
-                INSERT INTO contacts (user_id, contact_user_id, contact_name)
-                VALUES ({user_id}, {contact_user_id}, '{contact_name_escaped}')
-                ON CONFLICT (user_id, contact_user_id) DO NOTHING
-                RETURNING id
-            """)
+            statements.execute(cursor, ADD_CONTACT, {
+                'user_id': user_id,
+                'contact_user_id': contact_user_id,
+                'contact_name': contact_name
+            })
             
             result = cursor.fetchone()
             conn.commit()
@@ -95,7 +284,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'Access-Control-Allow-Origin': '*'
                     },
                     'isBase64Encoded': False,
-                    'body': json.dumps({'message': 'Contact added successfully', 'id': result['id']})
+                    'body': json.dumps({'message': 'Contact added successfully', 'id': result[0]})
                 }
             else:
                 return {
@@ -123,7 +312,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'contact_id required'})
                 }
             
-            cursor.execute(f"UPDATE contacts SET contact_user_id = NULL WHERE id = {contact_id}")
+            statements.execute(cursor, REMOVE_CONTACT, {'contact_id': contact_id})
             conn.commit()
             
             return {
@@ -149,4 +338,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cursor.close()
-        conn.close()
+        pool.putconn(conn)
@@ -0,0 +1,113 @@
+'''
+Heartbeat buffer for the presence function.
+Heartbeats are collected per warm instance and written to users.last_seen in
+batches, so a client pinging every few seconds costs a row write only when
+its last_seen has moved by more than the write threshold.
+'''
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# last_seen is not rewritten until it would move by at least this much
+PRESENCE_WRITE_THRESHOLD = float(os.environ.get('PRESENCE_WRITE_THRESHOLD', '45'))
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get('PRESENCE_FLUSH_INTERVAL', '5'))
+PRESENCE_FLUSH_MAX_SIZE = int(os.environ.get('PRESENCE_FLUSH_MAX_SIZE', '500'))
+PRESENCE_STATS_INTERVAL = float(os.environ.get('PRESENCE_STATS_INTERVAL', '60'))
+
+# Users whose last write is remembered for the threshold check
+WRITTEN_MAX_ENTRIES = 100_000
+
+
+class HeartbeatBuffer:
+    '''
+    Latest heartbeat per user waiting to be written, plus the last value
+    written per user. A batch is due once the oldest pending heartbeat is
+    flush_interval old or flush_max_size users are pending.
+    '''
+
+    def __init__(self, write_threshold: float = PRESENCE_WRITE_THRESHOLD,
+                 flush_interval: float = PRESENCE_FLUSH_INTERVAL,
+                 flush_max_size: int = PRESENCE_FLUSH_MAX_SIZE) -> None:
+        self.write_threshold = write_threshold
+        self.flush_interval = flush_interval
+        self.flush_max_size = max(1, flush_max_size)
+        self._pending: Dict[int, float] = {}
+        self._pending_since = 0.0
+        self._written: 'OrderedDict[int, float]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {
+            'heartbeats': 0, 'skipped': 0, 'flushes': 0, 'flushed_users': 0, 'requeued': 0
+        }
+        self._last_report = time.monotonic()
+
+    def record(self, user_id: int, seen_at: float) -> bool:
+        '''Buffer a heartbeat (epoch seconds); False when it is below the write threshold'''
+        with self._lock:
+            self._counters['heartbeats'] += 1
+            if seen_at - self._written.get(user_id, float('-inf')) < self.write_threshold:
+                self._counters['skipped'] += 1
+                return False
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending[user_id] = max(seen_at, self._pending.get(user_id, seen_at))
+            return True
+
+    def take_due(self) -> List[Tuple[int, float]]:
+        '''Remove and return the pending batch if it is due, else an empty list'''
+        with self._lock:
+            if not self._pending:
+                return []
+            if (len(self._pending) < self.flush_max_size
+                    and time.monotonic() - self._pending_since < self.flush_interval):
+                return []
+            batch = sorted(self._pending.items())
+            self._pending = {}
+            return batch
+
+    def mark_written(self, stored: List[Tuple[int, float, bool]]) -> None:
+        '''
+        Remember users.last_seen after a flush, as (user_id, last_seen, written):
+        a row the write threshold skipped keeps the value already in the table
+        '''
+        with self._lock:
+            for user_id, last_seen, _ in stored:
+                self._written[user_id] = last_seen
+                self._written.move_to_end(user_id)
+            while len(self._written) > WRITTEN_MAX_ENTRIES:
+                self._written.popitem(last=False)
+            self._counters['flushes'] += 1
+            self._counters['flushed_users'] += sum(1 for _, _, written in stored if written)
+        self._maybe_report()
+
+    def requeue(self, batch: List[Tuple[int, float]]) -> None:
+        '''Put back a batch whose write failed; newer heartbeats win'''
+        with self._lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            for user_id, seen_at in batch:
+                self._pending[user_id] = max(seen_at, self._pending.get(user_id, seen_at))
+            self._counters['requeued'] += len(batch)
+
+    def last_seen(self, user_id: int) -> Optional[float]:
+        '''Newest heartbeat this instance knows of, buffered or written'''
+        with self._lock:
+            seen = [value for value in (self._pending.get(user_id), self._written.get(user_id)) if value is not None]
+        return max(seen) if seen else None
+
+    def stats(self) -> Dict[str, Any]:
+        '''Snapshot of counters and buffer occupancy'''
+        with self._lock:
+            snapshot: Dict[str, Any] = dict(self._counters)
+            snapshot['pending'] = len(self._pending)
+            snapshot['remembered'] = len(self._written)
+        return snapshot
+
+    def _maybe_report(self) -> None:
+        now = time.monotonic()
+        if now - self._last_report < PRESENCE_STATS_INTERVAL:
+            return
+        self._last_report = now
+        print(json.dumps({'event': 'presence_stats', **self.stats()}))
@@ -0,0 +1,192 @@
+import json
+import os
+import time
+from typing import Dict, Any, List, Optional, Tuple
+import psycopg2
+from db import get_pool, PoolTimeout
+import tracing
+import compression
+from heartbeats import HeartbeatBuffer
+
+# A user is online while their last_seen is younger than this; keep it above
+# the client heartbeat period plus PRESENCE_WRITE_THRESHOLD and the flush interval
+PRESENCE_ONLINE_TTL = float(os.environ.get('PRESENCE_ONLINE_TTL', '120'))
+PRESENCE_QUERY_MAX_USERS = 500
+# users.id is an integer column
+MAX_USER_ID = 2 ** 31 - 1
+
+# Shared by all invocations of a warm instance
+heartbeats = HeartbeatBuffer()
+
+def parse_user_id(value: Any) -> Optional[int]:
+    '''A users.id sent as a number or as digits; None for anything else, booleans and ids beyond MAX_USER_ID'''
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        value = int(value)
+    if not isinstance(value, int) or not 1 <= value <= MAX_USER_ID:
+        return None
+    return value
+
+def flush_heartbeats(batch: List[Tuple[int, float]]) -> List[Tuple[int, float, bool]]:
+    '''
+    Write a batch of heartbeats with one UPDATE ... FROM (VALUES ...). Returns
+    (user_id, last_seen, written) for each user of the batch that exists, with
+    the stored last_seen of rows the write threshold left alone.
+    '''
+    pool = get_pool()
+    conn = pool.getconn()
+    cursor = conn.cursor()
+    try:
+        values = ', '.join(['(%s::integer, %s::float8)'] * len(batch))
+        cursor.execute(f"""
+            WITH v(user_id, seen_at) AS (VALUES {values}),
+            updated AS (
+                UPDATE users u SET last_seen = to_timestamp(v.seen_at)::timestamp
+                FROM v
+                WHERE u.id = v.user_id
+                  AND (u.last_seen IS NULL
+                       OR u.last_seen < to_timestamp(v.seen_at)::timestamp - make_interval(secs => %s))
+                RETURNING u.id, u.last_seen
+            )
+            SELECT u.id, EXTRACT(EPOCH FROM COALESCE(w.last_seen, u.last_seen)::timestamptz)::float8,
+                   w.id IS NOT NULL
+            FROM v
+            JOIN users u ON u.id = v.user_id
+            LEFT JOIN updated w ON w.id = u.id
+        """, [param for row in batch for param in row] + [heartbeats.write_threshold])
+        rows = cursor.fetchall()
+        conn.commit()
+        return rows
+    finally:
+        cursor.close()
+        pool.putconn(conn)
+
+@tracing.traced('presence')
+@compression.compressed
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: User presence - record heartbeats and report who is online
+    Args: event with httpMethod (GET/POST/OPTIONS); POST body with user_id
+          is a heartbeat, GET takes user_ids (comma separated)
+    Returns: HTTP response with heartbeat status or presence per user
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+    
+    if method == 'POST':
+        body_data = json.loads(event.get('body') or '{}')
+        user_id = parse_user_id(body_data.get('user_id'))
+        if user_id is None:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'isBase64Encoded': False,
+                'body': json.dumps({'error': f'user_id required (an integer from 1 to {MAX_USER_ID})'})
+            }
+        
+        # Heartbeats are buffered; whichever invocation finds the batch due writes it
+        heartbeats.record(user_id, time.time())
+        batch = heartbeats.take_due()
+        flushed = 0
+        if batch:
+            try:
+                stored = flush_heartbeats(batch)
+            except psycopg2.DataError as e:
+                # Requeued, a batch the database refuses would fail every flush after it;
+                # its users send another heartbeat within the online TTL anyway
+                print(json.dumps({'event': 'presence_batch_rejected', 'users': len(batch), 'error': str(e).strip()}))
+            except (PoolTimeout, psycopg2.Error) as e:
+                # The heartbeat is buffered either way; the batch goes out with the next flush
+                heartbeats.requeue(batch)
+                print(json.dumps({'event': 'presence_flush_failed', 'users': len(batch), 'error': str(e).strip()}))
+            else:
+                heartbeats.mark_written(stored)
+                flushed = sum(1 for _, _, written in stored if written)
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'isBase64Encoded': False,
+            'body': json.dumps({'success': True, 'flushed': flushed})
+        }
+    
+    if method == 'GET':
+        query_params = event.get('queryStringParameters') or {}
+        raw_ids = [parse_user_id(value.strip()) for value in (query_params.get('user_ids') or '').split(',') if value.strip()]
+        if not raw_ids or None in raw_ids or len(raw_ids) > PRESENCE_QUERY_MAX_USERS:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'isBase64Encoded': False,
+                'body': json.dumps({'error': f'user_ids required (at most {PRESENCE_QUERY_MAX_USERS} integers)'})
+            }
+        user_ids = list(dict.fromkeys(raw_ids))
+        
+        pool = get_pool()
+        conn = pool.getconn()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT id, EXTRACT(EPOCH FROM last_seen::timestamptz)::float8 as last_seen
+                FROM users
+                WHERE id = ANY(%s)
+            """, (user_ids,))
+            stored = dict(cursor.fetchall())
+        finally:
+            cursor.close()
+            pool.putconn(conn)
+        
+        # Heartbeats still buffered in this instance are newer than the table
+        now = time.time()
+        presence = []
+        for user_id in user_ids:
+            if user_id not in stored:
+                continue
+            seen = [value for value in (stored[user_id], heartbeats.last_seen(user_id)) if value is not None]
+            last_seen = max(seen) if seen else None
+            presence.append({
+                'id': user_id,
+                'online': last_seen is not None and now - last_seen < PRESENCE_ONLINE_TTL,
+                'last_seen': last_seen
+            })
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'isBase64Encoded': False,
+            'body': tracing.dumps({'users': presence})
+        }
+    
+    return {
+        'statusCode': 405,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'isBase64Encoded': False,
+        'body': json.dumps({'error': 'Method not allowed'})
+    }
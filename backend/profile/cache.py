@@ -0,0 +1,105 @@
+'''
+Bounded in-process cache with LRU eviction and a per-entry TTL.
+Lives at module level, so it is shared by all invocations of a warm instance;
+the TTL is the staleness bound for writes made through other instances.
+Vendored into each function that uses it and kept identical.
+'''
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+CACHE_STATS_INTERVAL = float(os.environ.get('CACHE_STATS_INTERVAL', '60'))
+
+
+class TTLCache:
+    '''
+    LRU cache whose entries expire ttl seconds after they were stored.
+    Entries may carry tags so a write can drop every entry derived from
+    the same record, whatever key it was cached under.
+    '''
+
+    def __init__(self, name: str, max_entries: int, ttl: float) -> None:
+        self.name = name
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any, Tuple[str, ...]]]' = OrderedDict()
+        self._tags: Dict[str, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {
+            'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'invalidated': 0
+        }
+        self._last_report = time.monotonic()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        '''Cached value, or None when missing or expired'''
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                value = None
+            elif entry[0] <= now:
+                self._drop(key)
+                self._counters['expired'] += 1
+                self._counters['misses'] += 1
+                value = None
+            else:
+                self._entries.move_to_end(key)
+                self._counters['hits'] += 1
+                value = entry[1]
+        self._maybe_report()
+        return value
+
+    def set(self, key: Hashable, value: Any, tags: Iterable[str] = ()) -> None:
+        if self.ttl <= 0:
+            return
+        tags = tuple(tags)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self._counters['evicted'] += 1
+
+    def invalidate_tag(self, tag: str) -> None:
+        '''Drop every entry stored with the tag'''
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._drop(key)
+                self._counters['invalidated'] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _drop(self, key: Hashable) -> None:
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def stats(self) -> Dict[str, Any]:
+        '''Snapshot of counters, occupancy and hit ratio'''
+        with self._lock:
+            snapshot: Dict[str, Any] = dict(self._counters)
+            snapshot['entries'] = len(self._entries)
+        lookups = snapshot['hits'] + snapshot['misses']
+        snapshot['hit_ratio'] = round(snapshot['hits'] / lookups, 4) if lookups else 0.0
+        return snapshot
+
+    def _maybe_report(self) -> None:
+        now = time.monotonic()
+        if now - self._last_report < CACHE_STATS_INTERVAL:
+            return
+        self._last_report = now
+        print(json.dumps({'event': 'cache_stats', 'cache': self.name, **self.stats()}))
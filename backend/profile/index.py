@@ -1,20 +1,137 @@
 import json
 import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from typing import Dict, Any, List, Optional, Tuple
+from db import get_pool, get_read_pool, reads_after_write, with_write_lsn
+import tracing
+import compression
+import serialize
+import statements
+from cache import TTLCache
 import hashlib
 
+PROFILE_CACHE_MAX_ENTRIES = int(os.environ.get('PROFILE_CACHE_MAX_ENTRIES', '1024'))
+PROFILE_CACHE_TTL = float(os.environ.get('PROFILE_CACHE_TTL', '30'))
+
+PROFILE_BATCH_MAX_KEYS = int(os.environ.get('PROFILE_BATCH_MAX_KEYS', '500'))
+
+# Columns a profile lookup returns; fields= may narrow a multi-get to a subset
+PROFILE_FIELDS = ('id', 'unique_id', 'username', 'full_name', 'email', 'phone', 'bio', 'avatar_url', 'status', 'last_seen')
+
+# Columns PUT may change; the ones missing from the body are left as they are
+PROFILE_UPDATE_FIELDS = ('full_name', 'email', 'phone', 'bio', 'username', 'avatar_url')
+
+PROFILE_BY_ID = statements.define('profile_by_id', f"""
+    SELECT {', '.join(PROFILE_FIELDS)} FROM users WHERE id = %(id)s
+""")
+
+PROFILE_BY_UNIQUE_ID = statements.define('profile_by_unique_id', f"""
+    SELECT {', '.join(PROFILE_FIELDS)} FROM users WHERE unique_id = %(unique_id)s
+""")
+
+# Multi-get statements by lookup column
+PROFILES_BY = {
+    column: statements.define(f'profiles_by_{column}', f"""
+        SELECT {', '.join(PROFILE_FIELDS)} FROM users WHERE {column} = ANY(%(keys)s)
+    """)
+    for column in ('id', 'unique_id')
+}
+
+UPDATE_PROFILE = statements.define('profile_update', f"""
+    UPDATE users SET
+        {', '.join(f'{field} = COALESCE(%({field})s, {field})' for field in PROFILE_UPDATE_FIELDS + ('unique_id',))},
+        updated_at = CURRENT_TIMESTAMP
+    WHERE id = %(id)s
+    RETURNING id, unique_id, username, full_name, email, phone, bio, avatar_url, status
+""")
+
+profile_cache = TTLCache('profile', PROFILE_CACHE_MAX_ENTRIES, PROFILE_CACHE_TTL)
+
 def generate_user_id(phone: str) -> str:
     '''Generate unique user ID from phone number using SHA256 hash'''
     phone_clean = ''.join(filter(str.isdigit, phone))
     hash_obj = hashlib.sha256(phone_clean.encode('utf-8'))
     return hash_obj.hexdigest()[:16]
 
+def profile_cache_key(query_params: Dict[str, Any]) -> Optional[str]:
+    '''Normalized cache key for a profile lookup; phones are keyed by their unique ID'''
+    if query_params.get('phone'):
+        return f"unique_id:{generate_user_id(query_params['phone'])}"
+    if query_params.get('id'):
+        return f"id:{query_params['id'].strip()}"
+    return None
+
+def parse_batch_keys(query_params: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    '''
+    Lookup column and de-duplicated keys of a multi-get (ids= or unique_ids=,
+    comma separated, in request order); raises ValueError on bad input
+    '''
+    if query_params.get('ids') and query_params.get('unique_ids'):
+        raise ValueError('use either ids or unique_ids, not both')
+    column = 'id' if query_params.get('ids') else 'unique_id'
+    raw_keys = [key.strip() for key in query_params.get('ids' if column == 'id' else 'unique_ids').split(',') if key.strip()]
+    if column == 'id':
+        if not all(key.isdigit() for key in raw_keys):
+            raise ValueError('ids must be integers')
+        raw_keys = [int(key) for key in raw_keys]
+    keys = list(dict.fromkeys(raw_keys))
+    if not keys:
+        raise ValueError(f'{column}s must not be empty')
+    if len(keys) > PROFILE_BATCH_MAX_KEYS:
+        raise ValueError(f'at most {PROFILE_BATCH_MAX_KEYS} keys per request')
+    return column, keys
+
+def parse_fields(raw: Optional[str]) -> Tuple[str, ...]:
+    '''Projected columns of a multi-get; id and unique_id are always included'''
+    if not raw:
+        return PROFILE_FIELDS
+    requested = {field.strip() for field in raw.split(',') if field.strip()}
+    unknown = requested - set(PROFILE_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(field for field in PROFILE_FIELDS if field in requested or field in ('id', 'unique_id'))
+
+def get_profiles(event: Dict[str, Any], column: str, keys: List[Any]) -> Dict[Any, Dict[str, Any]]:
+    '''
+    Profiles by id or unique_id. Keys cached by single lookups are served from
+    the warm instance; the rest come from one = ANY query (on a replica when
+    the request can be served by one) and are cached too. A request with
+    X-Read-After neither reads nor fills the cache.
+    '''
+    use_cache = not reads_after_write(event)
+    found: Dict[Any, Dict[str, Any]] = {}
+    misses = []
+    for key in keys:
+        cached_body = profile_cache.get(f'{column}:{key}') if use_cache else None
+        if cached_body is not None:
+            found[key] = json.loads(cached_body)
+        else:
+            misses.append(key)
+    if not misses:
+        return found
+    
+    pool = get_read_pool(event)
+    conn = pool.getconn()
+    cursor = serialize.cursor(conn)
+    try:
+        statements.execute(cursor, PROFILES_BY[column], {'keys': misses})
+        for user in serialize.records(serialize.columns(cursor), cursor.fetchall()):
+            if use_cache:
+                profile_cache.set(f'{column}:{user[column]}', json.dumps(user), tags=(f"user:{user['id']}",))
+            found[user[column]] = user
+    finally:
+        cursor.close()
+        pool.putconn(conn)
+    return found
+
+@tracing.traced('profile')
+@compression.compressed
+@with_write_lsn
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Manage user profile - get and update user information
-    Args: event with httpMethod (GET/PUT/OPTIONS), body with user data
+    Args: event with httpMethod (GET/PUT/OPTIONS), body with user data;
+          GET takes id or phone, or ids/unique_ids (comma separated) with
+          optional fields for a multi-get
           context with request_id
     Returns: HTTP response with user profile data or update confirmation
     '''
@@ -27,16 +144,66 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Read-After',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    # Database connection
-    db_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(db_url)
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    # Multi-get: one response for every avatar/name a list view needs
+    query_params = event.get('queryStringParameters') or {}
+    if method == 'GET' and (query_params.get('ids') or query_params.get('unique_ids')):
+        try:
+            column, keys = parse_batch_keys(query_params)
+            fields = parse_fields(query_params.get('fields'))
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'isBase64Encoded': False,
+                'body': json.dumps({'error': str(e)})
+            }
+        
+        found = get_profiles(event, column, keys)
+        rows = [tuple(found[key][field] for field in fields) for key in keys if key in found]
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'isBase64Encoded': False,
+            'body': tracing.dumps({
+                'users': serialize.table(fields, rows, serialize.wants_columnar(event)),
+                'missing': [key for key in keys if key not in found]
+            })
+        }
+    
+    # Repeated lookups are answered by the warm instance without a connection,
+    # unless the client waits for a write another instance may have handled
+    cache_key = None
+    if method == 'GET' and not reads_after_write(event):
+        cache_key = profile_cache_key(event.get('queryStringParameters') or {})
+        cached_body = profile_cache.get(cache_key) if cache_key else None
+        if cached_body is not None:
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'X-Cache': 'HIT'
+                },
+                'isBase64Encoded': False,
+                'body': cached_body
+            }
+    
+    # Database connection from the warm pool; reads may go to a replica
+    pool = get_read_pool(event) if method == 'GET' else get_pool()
+    conn = pool.getconn()
+    cursor = serialize.cursor(conn)
     
     try:
         if method == 'GET':
@@ -46,16 +213,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             phone = query_params.get('phone')
             
             if phone:
-                # Generate unique ID from phone
+                # Generate unique ID from phone; it is indexed and ignores formatting
                 unique_id = generate_user_id(phone)
-                phone_escaped = phone.replace("'", "''")
-                cursor.execute(
-                    f"SELECT id, unique_id, username, full_name, email, phone, bio, avatar_url, status, last_seen FROM users WHERE phone = '{phone_escaped}'"
-                )
+                statements.execute(cursor, PROFILE_BY_UNIQUE_ID, {'unique_id': unique_id})
             elif user_id:
-                cursor.execute(
-                    f"SELECT id, unique_id, username, full_name, email, phone, bio, avatar_url, status, last_seen FROM users WHERE id = {user_id}"
-                )
+                statements.execute(cursor, PROFILE_BY_ID, {'id': user_id})
             else:
                 return {
                     'statusCode': 400,
@@ -67,7 +229,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'id or phone parameter required'})
                 }
             
-            user = cursor.fetchone()
+            user = serialize.record(serialize.columns(cursor), cursor.fetchone())
             
             if not user:
                 return {
@@ -80,14 +242,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'User not found'})
                 }
             
+            body = tracing.dumps(user)
+            if cache_key:
+                profile_cache.set(cache_key, body, tags=(f"user:{user['id']}",))
+            
             return {
                 'statusCode': 200,
                 'headers': {
                     'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
+                    'Access-Control-Allow-Origin': '*',
+                    'X-Cache': 'MISS'
                 },
                 'isBase64Encoded': False,
-                'body': json.dumps(dict(user), default=str)
+                'body': body
             }
         
         elif method == 'PUT':
@@ -95,35 +262,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             body_data = json.loads(event.get('body', '{}'))
             user_id = body_data.get('id', 1)
             
-            update_fields = []
-            if 'full_name' in body_data:
-                full_name = body_data['full_name'].replace("'", "''")
-                update_fields.append(f"full_name = '{full_name}'")
-            if 'email' in body_data:
-                email = body_data['email'].replace("'", "''")
-                update_fields.append(f"email = '{email}'")
-            if 'phone' in body_data:
-                phone = body_data['phone'].replace("'", "''")
-                unique_id = generate_user_id(phone)
-                update_fields.append(f"phone = '{phone}'")
-                update_fields.append(f"unique_id = '{unique_id}'")
-            if 'bio' in body_data:
-                bio = body_data['bio'].replace("'", "''")
-                update_fields.append(f"bio = '{bio}'")
-            if 'username' in body_data:
-                username = body_data['username'].replace("'", "''")
-                update_fields.append(f"username = '{username}'")
-            if 'avatar_url' in body_data:
-                avatar_url = body_data['avatar_url'].replace("'", "''")
-                update_fields.append(f"avatar_url = '{avatar_url}'")
-            
-            if update_fields:
-                update_fields.append("updated_at = CURRENT_TIMESTAMP")
-                update_query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = {user_id} RETURNING id, unique_id, username, full_name, email, phone, bio, avatar_url, status"
-                
-                cursor.execute(update_query)
-                updated_user = cursor.fetchone()
+            if any(field in body_data for field in PROFILE_UPDATE_FIELDS):
+                changes = {field: body_data.get(field) for field in PROFILE_UPDATE_FIELDS}
+                changes['unique_id'] = generate_user_id(changes['phone']) if changes['phone'] is not None else None
+                statements.execute(cursor, UPDATE_PROFILE, {'id': user_id, **changes})
+                updated_user = serialize.record(serialize.columns(cursor), cursor.fetchone())
                 conn.commit()
+                if updated_user:
+                    profile_cache.invalidate_tag(f"user:{updated_user['id']}")
                 
                 return {
                     'statusCode': 200,
@@ -134,8 +280,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False,
                     'body': json.dumps({
                         'message': 'Profile updated successfully',
-                        'user': dict(updated_user)
-                    }, default=str)
+                        'user': updated_user
+                    })
                 }
             
             return {
@@ -161,4 +307,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        pool.putconn(conn)
\ No newline at end of file
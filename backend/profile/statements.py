@@ -0,0 +1,169 @@
+'''
+Named statements prepared once per pooled connection.
+Queries are defined at import with %(name)s placeholders, as psycopg2 takes
+them. The first execute on a connection sends PREPARE with the placeholders
+numbered $1..$n; later ones send only EXECUTE name(...) with the bound
+values, so Postgres skips parsing and, once it settles on a generic plan,
+planning too. Postgres only switches to a generic plan when its estimated
+cost is no worse than the custom ones', so a statement can pin its choice:
+plan='generic' for keyed lookups whose plan never changes, plan='custom' for
+ones whose best plan depends on the values (LIKE patterns, skewed columns),
+which are still parsed once but planned for every execution. Execution
+counters and the server's generic/custom plan counts are reported
+periodically. DB_PREPARED_STATEMENTS=0 runs the same SQL
+unprepared, for poolers in transaction mode that do not keep session state.
+Vendored into each function that uses it and kept identical.
+'''
+import json
+import os
+import re
+import threading
+import time
+import weakref
+from typing import Any, Dict, List, Mapping, Optional, Set
+
+import psycopg2
+import psycopg2.extensions
+
+PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1') != '0'
+STATEMENT_STATS_INTERVAL = float(os.environ.get('DB_STATEMENT_STATS_INTERVAL', '60'))
+
+_PLACEHOLDER = re.compile(r'%\((\w+)\)s|%%')
+_NAME = re.compile(r'[a-z_][a-z0-9_]*')
+
+# plan= of a statement and the plan_cache_mode it runs under
+PLAN_CACHE_MODES = {'auto': 'auto', 'custom': 'force_custom_plan', 'generic': 'force_generic_plan'}
+
+
+class Statement:
+    '''One named query; params are its placeholder names in $n order'''
+
+    def __init__(self, name: str, sql: str, plan: str = 'auto') -> None:
+        if not _NAME.fullmatch(name):
+            raise ValueError(f'invalid statement name: {name!r}')
+        if plan not in PLAN_CACHE_MODES:
+            raise ValueError(f"{name}: plan must be one of {', '.join(PLAN_CACHE_MODES)}")
+        if '%' in _PLACEHOLDER.sub('', sql):
+            raise ValueError(f'{name}: only %(name)s placeholders and %% are supported')
+        params: List[str] = []
+
+        def number(match: Any) -> str:
+            if match.group(1) is None:
+                return '%'
+            if match.group(1) not in params:
+                params.append(match.group(1))
+            return f'${params.index(match.group(1)) + 1}'
+
+        self.name = name
+        self.sql = sql
+        self.plan = plan
+        self.prepare_sql = f'PREPARE {name} AS {_PLACEHOLDER.sub(number, sql)}'
+        self.params = tuple(params)
+        self.execute_sql = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f'EXECUTE {name}'
+
+
+class _Session:
+    '''What one connection has prepared, and the plan mode set in its open transaction'''
+
+    def __init__(self) -> None:
+        self.prepared: Set[str] = set()
+        self.plan = 'auto'
+
+
+class StatementRegistry:
+    '''Statements of one function and the connections each is prepared on'''
+
+    def __init__(self) -> None:
+        self._statements: Dict[str, Statement] = {}
+        self._sessions: 'weakref.WeakKeyDictionary[Any, _Session]' = weakref.WeakKeyDictionary()
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._last_report = time.monotonic()
+
+    def define(self, name: str, sql: str, plan: str = 'auto') -> Statement:
+        if name in self._statements:
+            raise ValueError(f'statement {name} is already defined')
+        statement = self._statements[name] = Statement(name, sql, plan)
+        self._counters[name] = {'executions': 0, 'prepares': 0}
+        return statement
+
+    def execute(self, cursor: Any, statement: Statement, params: Optional[Mapping[str, Any]] = None) -> None:
+        '''Run a statement on the cursor, preparing it first if its connection has not'''
+        params = params or {}
+        if not PREPARED_STATEMENTS:
+            cursor.execute(statement.sql, params)
+            self._count(statement, 'executions')
+            return
+        conn = cursor.connection
+        with self._lock:
+            session = self._sessions.setdefault(conn, _Session())
+        # plan_cache_mode is read at EXECUTE. SET LOCAL ends with the transaction,
+        # so it is sent again only when a new one starts or the mode changes
+        if conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            session.plan = 'auto'
+        # A prepared statement outlives a rolled-back transaction, so the set
+        # only has to follow the connection
+        if statement.name not in session.prepared:
+            cursor.execute(statement.prepare_sql)
+            session.prepared.add(statement.name)
+            self._count(statement, 'prepares')
+        if statement.plan != session.plan:
+            cursor.execute(f'SET LOCAL plan_cache_mode = {PLAN_CACHE_MODES[statement.plan]}')
+            session.plan = statement.plan
+        cursor.execute(statement.execute_sql, [params[name] for name in statement.params])
+        self._count(statement, 'executions')
+        self._maybe_report(conn)
+
+    def _count(self, statement: Statement, counter: str) -> None:
+        with self._lock:
+            self._counters[statement.name][counter] += 1
+
+    def stats(self) -> List[Dict[str, Any]]:
+        '''Executions and prepares per statement since the instance started'''
+        with self._lock:
+            return [{'name': name, **counters} for name, counters in sorted(self._counters.items())]
+
+    def plan_cache(self, conn: Any) -> Dict[str, Dict[str, Any]]:
+        '''The server's generic and custom plan counts for this registry's statements on one connection'''
+        cursor = psycopg2.extensions.cursor(conn)
+        try:
+            cursor.execute('SELECT * FROM pg_prepared_statements')
+            keys = [column[0] for column in cursor.description]
+            plans = {}
+            for row in cursor.fetchall():
+                entry = dict(zip(keys, row))
+                if entry['name'] in self._statements:
+                    # generic_plans and custom_plans appeared in PostgreSQL 14
+                    plans[entry['name']] = {
+                        'generic_plans': entry.get('generic_plans'),
+                        'custom_plans': entry.get('custom_plans')
+                    }
+            return plans
+        finally:
+            cursor.close()
+
+    def _maybe_report(self, conn: Any) -> None:
+        now = time.monotonic()
+        if now - self._last_report < STATEMENT_STATS_INTERVAL:
+            return
+        self._last_report = now
+        try:
+            plans = self.plan_cache(conn)
+        except psycopg2.Error:
+            plans = {}
+        print(json.dumps({
+            'event': 'statement_stats',
+            'statements': [{**row, **plans.get(row['name'], {})} for row in self.stats()]
+        }))
+
+
+registry = StatementRegistry()
+
+
+def define(name: str, sql: str, plan: str = 'auto') -> Statement:
+    '''Register a query under a name unique within the function; plan is auto, custom or generic'''
+    return registry.define(name, sql, plan)
+
+
+def execute(cursor: Any, statement: Statement, params: Optional[Mapping[str, Any]] = None) -> None:
+    registry.execute(cursor, statement, params)
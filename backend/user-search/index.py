@@ -1,12 +1,83 @@
 import json
 import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import re
+from typing import Dict, Any, List, Tuple
+from db import get_read_pool, reads_after_write
+import tracing
+import compression
+import serialize
+import statements
+from cache import TTLCache
 
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+PHONE_TERM = re.compile(r'^[\d\s+()-]+$')
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get('SEARCH_CACHE_MAX_ENTRIES', '2048'))
+SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', '10'))
+
+search_cache = TTLCache('user-search', SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_TTL)
+
+def tier_conditions(phone: bool) -> List[str]:
+    '''Match conditions of the exact, prefix and similarity tiers'''
+    exact = "unique_id = lower(%(term)s) OR lower(username) = lower(%(term)s)"
+    prefix = "lower(username) LIKE lower(%(prefix)s) OR lower(full_name) LIKE lower(%(prefix)s)"
+    similar = """
+        username ILIKE %(contains)s OR full_name ILIKE %(contains)s
+        OR username %% %(term)s OR full_name %% %(term)s
+    """
+    if phone:
+        exact += " OR phone_digits = %(digits)s"
+        prefix += " OR phone_digits LIKE %(digits_prefix)s"
+        similar += " OR phone_digits LIKE %(digits_contains)s"
+    return [exact, prefix, similar]
+
+def tier_sql(tier: int, phone: bool, resume: bool) -> str:
+    '''One tier's page, nearest-first from the search_text GiST index'''
+    conditions = tier_conditions(phone)
+    distance = "(search_text <-> %(term)s)::float8"
+    # Leave out higher tiers' rows; unlike NOT, IS NOT TRUE keeps rows whose
+    # phone_digits is NULL, and the planner can estimate it
+    where = ' AND '.join([f"({conditions[tier]})"] + [f"({higher}) IS NOT TRUE" for higher in conditions[:tier]])
+    if resume:
+        where += f" AND ({distance} > %(after_distance)s OR ({distance} = %(after_distance)s AND id > %(after_id)s))"
+    return f"""
+        SELECT 
+            id, unique_id, username, full_name, phone, avatar_url, status,
+            {tier} as rank,
+            {distance} as distance
+        FROM users
+        WHERE {where}
+        ORDER BY search_text <-> %(term)s, id
+        LIMIT %(limit)s
+    """
+
+# A statement per tier, with or without phone-digit matching and with or
+# without a position to resume from inside the tier. How selective a LIKE
+# pattern is decides between the GiST order and a bitmap of matches, so each
+# execution is planned for its own term
+TIER_STATEMENTS = {
+    (tier, phone, resume): statements.define(
+        f"user_search_tier{tier}{'_phone' if phone else ''}{'_resume' if resume else ''}",
+        tier_sql(tier, phone, resume),
+        plan='custom'
+    )
+    for tier in range(3) for phone in (False, True) for resume in (False, True)
+}
+
+def escape_like(term: str) -> str:
+    '''Escape LIKE wildcards so the term is matched literally'''
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def parse_search_cursor(cursor: str) -> Tuple[int, float, int]:
+    '''Split a "<rank>:<distance>:<id>" page cursor'''
+    rank, distance, user_id = cursor.split(':')
+    return int(rank), float(distance), int(user_id)
+
+@tracing.traced('user-search')
+@compression.compressed
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Search users by username or phone number
+    Business: Search users by unique ID, username, name or phone number, ranked and paginated
     Args: event with httpMethod (GET/OPTIONS), query with search term
           context with request_id
     Returns: HTTP response with list of found users
@@ -19,7 +90,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Read-After',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -36,47 +107,115 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Method not allowed'})
         }
     
-    db_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(db_url)
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    query_params = event.get('queryStringParameters') or {}
+    search_term = ' '.join(query_params.get('q', '').split())
+    
+    if not search_term:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Search term required'})
+        }
     
     try:
-        query_params = event.get('queryStringParameters', {})
-        search_term = query_params.get('q', '').strip()
-        
-        if not search_term:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': 'Search term required'})
-            }
-        
-        search_escaped = search_term.replace("'", "''")
+        limit = min(max(int(query_params.get('limit', SEARCH_PAGE_SIZE)), 1), SEARCH_MAX_PAGE_SIZE)
+        after = parse_search_cursor(query_params['cursor']) if query_params.get('cursor') else None
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'invalid limit or cursor'})
+        }
+    
+    escaped = escape_like(search_term)
+    digits = ''.join(filter(str.isdigit, search_term))
+    if not PHONE_TERM.match(search_term) or len(digits) < 3:
+        digits = ''
+    
+    # Search-as-you-type repeats the same queries; answer them from the warm instance,
+    # unless the client waits for a write another instance may have handled
+    columnar = serialize.wants_columnar(event)
+    use_cache = not reads_after_write(event)
+    cache_key = (search_term.lower(), limit, query_params.get('cursor') or '', columnar)
+    cached_body = search_cache.get(cache_key) if use_cache else None
+    if cached_body is not None:
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'X-Cache': 'HIT'
+            },
+            'isBase64Encoded': False,
+            'body': cached_body
+        }
+    
+    pool = get_read_pool(event)
+    conn = pool.getconn()
+    cursor = serialize.cursor(conn)
+    
+    try:
+        # Rank: exact unique_id/username/phone match, then prefix, then similarity
+        # to search_text (username, name and phone digits). Trigrams cannot narrow
+        # one- or two-letter terms, so those stop at prefix. Tiers run in order until
+        # the page is full, each read nearest-first from the search_text GiST index;
+        # pages continue after the (rank, distance, id) of the previous page's last row
+        tiers = [0, 1] + ([2] if len(search_term) >= 3 else [])
+        users = []
+        keys: Tuple[str, ...] = ()
+        for tier in tiers:
+            if after and tier < after[0]:
+                continue
+            resume = after is not None and tier == after[0]
+            statements.execute(cursor, TIER_STATEMENTS[(tier, bool(digits), resume)], {
+                'term': search_term,
+                'prefix': escaped + '%',
+                'contains': '%' + escaped + '%',
+                'digits': digits,
+                'digits_prefix': digits + '%',
+                'digits_contains': '%' + digits + '%',
+                'after_distance': after[1] if after else None,
+                'after_id': after[2] if after else None,
+                'limit': limit + 1 - len(users)
+            })
+            users.extend(cursor.fetchall())
+            keys = serialize.columns(cursor)
+            if len(users) > limit:
+                break
         
-        cursor.execute(f"""
-            SELECT id, unique_id, username, full_name, phone, avatar_url, status
-            FROM users
-            WHERE username ILIKE '%{search_escaped}%'
-               OR phone LIKE '%{search_escaped}%'
-            LIMIT 20
-        """)
+        has_more = len(users) > limit
+        users = users[:limit]
+        next_cursor = None
+        if has_more:
+            last = serialize.record(keys, users[-1])
+            next_cursor = f"{last['rank']}:{last['distance']!r}:{last['id']}"
         
-        users = cursor.fetchall()
+        body = tracing.dumps({
+            'users': serialize.table(keys, users, columnar, exclude=('rank', 'distance')),
+            'next_cursor': next_cursor
+        })
+        if use_cache:
+            search_cache.set(cache_key, body)
         
         return {
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
+                'Access-Control-Allow-Origin': '*',
+                'X-Cache': 'MISS'
             },
             'isBase64Encoded': False,
-            'body': json.dumps([dict(user) for user in users], default=str)
+            'body': body
         }
     
     finally:
         cursor.close()
-        conn.close()
+        pool.putconn(conn)
@@ -0,0 +1,333 @@
+'''
+Call log kept from the signaling flow: an offer opens a call in the calls
+table (ringing), the answer makes it active and the first leave of either
+side ends it (ended, or cancelled/declined if it was never answered);
+calls left ringing past the ring timeout are closed as missed. A call is
+keyed by its roomId, so clients open a fresh room per call.
+
+Writes are write-behind: the handler only appends the event to an
+in-process buffer, and a background thread flushes it every
+SIGNALING_CALL_LOG_FLUSH_INTERVAL seconds (sooner once FLUSH_SIZE events
+are waiting) as a few set-based statements in one transaction, however many
+events there are. A flush that loses its connection keeps its events for
+the next one, up to MAX_PENDING; a batch the database rejects is split
+until the events it refuses are found, and those are dropped and logged.
+Events still buffered when an instance is torn down are lost.
+Only messages whose from/to are user ids (numbers or digit strings up to
+MAX_ID) are logged, since calls references users; others are relayed but counted as
+skipped.
+'''
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2
+
+from db import get_pool, PoolTimeout
+from store import text_id
+import serialize
+
+CALL_LOG = os.environ.get('SIGNALING_CALL_LOG', '1') != '0'
+FLUSH_INTERVAL = float(os.environ.get('SIGNALING_CALL_LOG_FLUSH_INTERVAL', '1'))
+FLUSH_SIZE = int(os.environ.get('SIGNALING_CALL_LOG_FLUSH_SIZE', '200'))
+MAX_PENDING = int(os.environ.get('SIGNALING_CALL_LOG_MAX_PENDING', '10000'))
+RING_TIMEOUT = float(os.environ.get('SIGNALING_CALL_RING_TIMEOUT', '60'))
+
+CALL_TYPES = ('audio', 'video')
+# calls.room_id is VARCHAR(100)
+ROOM_ID_MAX_LENGTH = 100
+
+CLOSE_MISSED_SQL = """
+    UPDATE calls SET status = 'missed', ended_at = started_at + make_interval(secs => %(ring_timeout)s)
+    WHERE status = 'ringing' AND ended_at IS NULL
+      AND started_at < LOCALTIMESTAMP - make_interval(secs => %(ring_timeout)s)
+"""
+
+# Offers and answers both open the call, so an answer flushed by another
+# instance before the offer still finds it; later offers in the room
+# (renegotiation) leave the open call as it is
+OPEN_SQL = """
+    INSERT INTO calls (room_id, caller_id, receiver_id, call_type, status, started_at)
+    SELECT DISTINCT ON (e.room_id)
+        e.room_id, e.caller_id, e.receiver_id, e.call_type, 'ringing', to_timestamp(e.at)::timestamp
+    FROM json_to_recordset(%(events)s::json)
+        AS e(room_id text, caller_id integer, receiver_id integer, call_type text, at float8)
+    INNER JOIN users caller ON caller.id = e.caller_id
+    INNER JOIN users receiver ON receiver.id = e.receiver_id
+    ORDER BY e.room_id, e.at
+    ON CONFLICT (room_id) WHERE ended_at IS NULL DO NOTHING
+"""
+
+ANSWER_SQL = """
+    UPDATE calls c SET status = 'active', answered_at = a.answered_at
+    FROM (
+        SELECT e.room_id, to_timestamp(MIN(e.at))::timestamp AS answered_at
+        FROM json_to_recordset(%(events)s::json) AS e(room_id text, at float8)
+        GROUP BY e.room_id
+    ) a
+    WHERE c.room_id = a.room_id AND c.ended_at IS NULL AND c.status = 'ringing'
+"""
+
+LEAVE_SQL = """
+    UPDATE calls c SET
+        status = CASE
+            WHEN c.status = 'active' THEN 'ended'
+            WHEN l.user_id = c.caller_id THEN 'cancelled'
+            ELSE 'declined'
+        END,
+        ended_at = l.left_at,
+        duration = CASE WHEN c.answered_at IS NULL THEN 0
+            ELSE GREATEST(EXTRACT(EPOCH FROM l.left_at - c.answered_at), 0)::integer END
+    FROM (
+        -- Participants only, before picking the first leave: anyone else
+        -- leaving the room first must not hide the leave that ends the call
+        SELECT DISTINCT ON (e.room_id) e.room_id, e.user_id, to_timestamp(e.at)::timestamp AS left_at
+        FROM json_to_recordset(%(events)s::json) AS e(room_id text, user_id integer, at float8)
+        INNER JOIN calls p ON p.room_id = e.room_id AND p.ended_at IS NULL
+            AND e.user_id IN (p.caller_id, p.receiver_id)
+        ORDER BY e.room_id, e.at
+    ) l
+    WHERE c.room_id = l.room_id AND c.ended_at IS NULL
+"""
+
+# Newest first, keyset on id; each side of the union is read through
+# idx_calls_caller / idx_calls_receiver
+HISTORY_SQL = """
+    SELECT
+        c.id,
+        CASE WHEN c.caller_id = %(user_id)s THEN 'outgoing' ELSE 'incoming' END AS direction,
+        u.id AS peer_id, u.full_name AS peer_name, u.avatar_url AS peer_avatar,
+        c.call_type, c.status, c.duration, c.started_at, c.answered_at, c.ended_at
+    FROM (
+        (
+            SELECT id, caller_id, receiver_id, call_type, status, duration, started_at, answered_at, ended_at
+            FROM calls
+            WHERE caller_id = %(user_id)s AND id < %(before)s
+            ORDER BY id DESC
+            LIMIT %(limit)s
+        )
+        UNION ALL
+        (
+            SELECT id, caller_id, receiver_id, call_type, status, duration, started_at, answered_at, ended_at
+            FROM calls
+            WHERE receiver_id = %(user_id)s AND caller_id <> %(user_id)s AND id < %(before)s
+            ORDER BY id DESC
+            LIMIT %(limit)s
+        )
+    ) c
+    LEFT JOIN users u ON u.id = CASE WHEN c.caller_id = %(user_id)s THEN c.receiver_id ELSE c.caller_id END
+    ORDER BY c.id DESC
+    LIMIT %(limit)s
+"""
+
+# users.id and calls.id are integer columns
+MAX_ID = 2 ** 31 - 1
+# Larger than any calls.id, for the first history page
+NO_CURSOR = MAX_ID
+
+
+def numeric_id(value: Any) -> Optional[int]:
+    '''users.id a signaling id names: a number, or its digits as the store keys it; None outside 1..MAX_ID'''
+    text = text_id(value)
+    if text is None or not (text.isascii() and text.isdigit()):
+        return None
+    number = int(text)
+    return number if 1 <= number <= MAX_ID else None
+
+
+def call_type(message: Dict[str, Any]) -> str:
+    '''callType if the client sent one, else video when the SDP has a video section'''
+    if message.get('callType') in CALL_TYPES:
+        return message['callType']
+    data = message.get('data')
+    sdp = data.get('sdp') if isinstance(data, dict) else data
+    return 'video' if isinstance(sdp, str) and 'm=video' in sdp else 'audio'
+
+
+def generations(events: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    '''
+    Split events so that a room never sees an offer after a leave within one
+    part: each part is applied as open, answer, leave, and a call that ends
+    and a new one in the same room have to be applied in that order.
+    '''
+    parts: List[List[Dict[str, Any]]] = [[]]
+    ended = set()
+    for event in events:
+        if event['kind'] == 'offer' and event['room_id'] in ended:
+            parts.append([])
+            ended = set()
+        if event['kind'] == 'leave':
+            ended.add(event['room_id'])
+        parts[-1].append(event)
+    return parts
+
+
+class CallLog:
+    '''Write-behind buffer of call events and the call history read'''
+
+    def __init__(self) -> None:
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._counters = {
+            'recorded': 0, 'skipped': 0, 'flushed': 0, 'flushes': 0, 'failed_flushes': 0, 'dropped': 0, 'rejected': 0
+        }
+
+    def record(self, message: Dict[str, Any]) -> None:
+        '''Buffer the call event a signaling message carries, if any; never touches the database'''
+        kind = message.get('type')
+        if not CALL_LOG or kind not in ('offer', 'answer', 'leave'):
+            return
+        room_id = str(message.get('roomId', 'default'))
+        sender, recipient = numeric_id(message.get('from')), numeric_id(message.get('to'))
+        if sender is None or (kind != 'leave' and recipient is None) or len(room_id) > ROOM_ID_MAX_LENGTH:
+            with self._lock:
+                self._counters['skipped'] += 1
+            return
+        event: Dict[str, Any] = {'kind': kind, 'room_id': room_id, 'at': time.time()}
+        if kind == 'leave':
+            event['user_id'] = sender
+        else:
+            # The answer comes from the receiver
+            caller, receiver = (sender, recipient) if kind == 'offer' else (recipient, sender)
+            event.update(caller_id=caller, receiver_id=receiver, call_type=call_type(message))
+        with self._lock:
+            self._pending.append(event)
+            self._counters['recorded'] += 1
+            overflow = len(self._pending) - MAX_PENDING
+            if overflow > 0:
+                del self._pending[:overflow]
+                self._counters['dropped'] += overflow
+            full = len(self._pending) >= FLUSH_SIZE
+        self._ensure_flusher()
+        if full:
+            self._wakeup.set()
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._run, name='call-log-flusher', daemon=True)
+                self._flusher.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(FLUSH_INTERVAL)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        '''
+        Write every buffered event; returns how many were written. A batch a
+        statement rejects is split in halves that are written on their own,
+        down to single events, which are dropped and logged; only a lost
+        connection puts events back for the next flush.
+        '''
+        with self._flush_lock:
+            with self._lock:
+                events, self._pending = self._pending, []
+            if not events:
+                return 0
+            pool = get_pool()
+            try:
+                conn = pool.getconn()
+            except (PoolTimeout, psycopg2.Error) as e:
+                self._requeue(events, str(e).strip())
+                return 0
+            written, broken = 0, False
+            # Parts still to write, oldest first, so the halves of a split keep their order
+            parts = [events]
+            try:
+                while parts:
+                    part = parts.pop(0)
+                    try:
+                        self._write(conn, part)
+                    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                        broken = True
+                        self._requeue([event for rest in [part] + parts for event in rest], str(e).strip())
+                        break
+                    except psycopg2.Error as e:
+                        try:
+                            conn.rollback()
+                        except psycopg2.Error:
+                            broken = True
+                            self._requeue([event for rest in [part] + parts for event in rest], str(e).strip())
+                            break
+                        if len(part) == 1:
+                            self._reject(part[0], str(e).strip())
+                        else:
+                            half = len(part) // 2
+                            parts[:0] = [part[:half], part[half:]]
+                        continue
+                    written += len(part)
+            finally:
+                pool.putconn(conn, discard=broken)
+            if written:
+                with self._lock:
+                    self._counters['flushed'] += written
+                    self._counters['flushes'] += 1
+            return written
+
+    @staticmethod
+    def _write(conn: Any, events: List[Dict[str, Any]]) -> None:
+        '''Apply events in one transaction: a few set-based statements however many there are'''
+        with conn.cursor() as cursor:
+            cursor.execute(CLOSE_MISSED_SQL, {'ring_timeout': RING_TIMEOUT})
+            for part in generations(events):
+                for kinds, sql in ((('offer', 'answer'), OPEN_SQL), (('answer',), ANSWER_SQL),
+                                   (('leave',), LEAVE_SQL)):
+                    selected = [event for event in part if event['kind'] in kinds]
+                    if selected:
+                        cursor.execute(sql, {'events': json.dumps(selected)})
+        conn.commit()
+
+    def _reject(self, event: Dict[str, Any], error: str) -> None:
+        '''Drop an event the database refuses on its own, so it cannot hold up the ones after it'''
+        with self._lock:
+            self._counters['rejected'] += 1
+        print(json.dumps({'event': 'call_log_event_rejected', 'call_event': event, 'error': error}))
+
+    def _requeue(self, events: List[Dict[str, Any]], error: str) -> None:
+        '''Put a failed flush back in front of what arrived since, oldest dropped beyond MAX_PENDING'''
+        with self._lock:
+            self._pending[:0] = events
+            overflow = len(self._pending) - MAX_PENDING
+            if overflow > 0:
+                del self._pending[:overflow]
+                self._counters['dropped'] += overflow
+            self._counters['failed_flushes'] += 1
+        print(json.dumps({'event': 'call_log_flush_failed', 'events': len(events), 'error': error}))
+
+    def history(self, user_id: int, limit: int, before: Optional[int]) -> Tuple[Tuple[str, ...], List[tuple]]:
+        '''Up to limit calls of the user older than call id before, newest first'''
+        # Calls this instance has buffered show up in its own history right away
+        self.flush()
+        pool = get_pool()
+        conn = pool.getconn()
+        try:
+            cursor = serialize.cursor(conn)
+            cursor.execute(HISTORY_SQL, {
+                'user_id': user_id,
+                'before': before if before is not None else NO_CURSOR,
+                'limit': limit
+            })
+            rows = cursor.fetchall()
+            keys = serialize.columns(cursor)
+            cursor.close()
+            return keys, rows
+        finally:
+            pool.putconn(conn)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'pending': len(self._pending), **self._counters}
+
+
+call_log = CallLog()
+atexit.register(call_log.flush)
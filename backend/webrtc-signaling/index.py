@@ -1,15 +1,34 @@
 import json
-from typing import Dict, Any, List
-from datetime import datetime
+import os
+from typing import Dict, Any
+from store import create_store, text_id
+from calllog import call_log, numeric_id, MAX_ID
+import serialize
+import tracing
+import compression
 
-# In-memory storage (in production use Redis/Database)
-active_connections: Dict[str, set] = {}
-pending_messages: Dict[str, List[Dict[str, Any]]] = {}
+# Longest a GET may be held open; keep it below the function timeout
+MAX_POLL_WAIT = float(os.environ.get('SIGNALING_MAX_POLL_WAIT', '25'))
 
+# Room membership and per-user queues; SIGNALING_STORE picks a backend that
+# instances share (postgres) or the single-instance in-memory default
+store = create_store()
+
+# Types relayed to the recipient's queue; ice-candidates carries a list in data
+RELAYED_TYPES = ('offer', 'answer', 'ice-candidate', 'ice-candidates')
+
+CALL_HISTORY_PAGE_SIZE = 20
+CALL_HISTORY_MAX_PAGE_SIZE = 100
+
+@tracing.traced('webrtc-signaling')
+@compression.compressed
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: WebRTC signaling server for audio/video calls
-    Args: event with httpMethod, body for signaling messages
+    Business: WebRTC signaling server for audio/video calls, and their call history
+    Args: event with httpMethod, body for one signaling message or a JSON
+          array of them (e.g. a burst of ICE candidates),
+          queryStringParameters userId and optional wait (long-poll seconds),
+          or action=calls with userId, limit and before (call id) for history
     Returns: HTTP response with signaling data
     '''
     method: str = event.get('httpMethod', 'GET')
@@ -28,16 +47,50 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     if method == 'POST':
         body_data = json.loads(event.get('body', '{}'))
+        
+        if isinstance(body_data, list):
+            if not all(isinstance(item, dict) and item.get('type') in ('join', 'leave') + RELAYED_TYPES
+                       for item in body_data):
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'Invalid message type'})
+                }
+            
+            relayed = []
+            for item in body_data:
+                call_log.record(item)
+                room = text_id(item.get('roomId', 'default'))
+                if item['type'] == 'join':
+                    store.join(room, text_id(item.get('from')))
+                elif item['type'] == 'leave':
+                    store.leave(room, text_id(item.get('from')))
+                else:
+                    relayed.append((text_id(item.get('to')), item))
+            store.enqueue_many(relayed)
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'success': True, 'accepted': len(body_data)})
+            }
+        
         msg_type = body_data.get('type')
-        from_user = body_data.get('from')
-        to_user = body_data.get('to')
+        # Rooms and queues are keyed by text, whether ids come as numbers or strings
+        from_user = text_id(body_data.get('from'))
+        to_user = text_id(body_data.get('to'))
         data = body_data.get('data')
-        room_id = body_data.get('roomId', 'default')
+        room_id = text_id(body_data.get('roomId', 'default'))
+        call_log.record(body_data)
         
         if msg_type == 'join':
-            if room_id not in active_connections:
-                active_connections[room_id] = set()
-            active_connections[room_id].add(from_user)
+            participants = store.join(room_id, from_user)
             
             return {
                 'statusCode': 200,
@@ -47,13 +100,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 },
                 'body': json.dumps({
                     'success': True,
-                    'participants': list(active_connections[room_id])
+                    'participants': participants
                 })
             }
         
         elif msg_type == 'leave':
-            if room_id in active_connections:
-                active_connections[room_id].discard(from_user)
+            store.leave(room_id, from_user)
             return {
                 'statusCode': 200,
                 'headers': {
@@ -63,10 +115,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'success': True})
             }
         
-        elif msg_type in ['offer', 'answer', 'ice-candidate']:
-            if to_user not in pending_messages:
-                pending_messages[to_user] = []
-            pending_messages[to_user].append(body_data)
+        elif msg_type in RELAYED_TYPES:
+            store.enqueue(to_user, body_data)
             
             return {
                 'statusCode': 200,
@@ -90,6 +140,52 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         query_params = event.get('queryStringParameters', {})
         user_id = query_params.get('userId')
         
+        if query_params.get('metrics'):
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'store': store.stats(), 'call_log': call_log.stats()})
+            }
+        
+        if query_params.get('action') == 'calls':
+            try:
+                # Ids beyond the integer columns would fail in the database
+                history_user = numeric_id(user_id)
+                limit = min(max(int(query_params.get('limit', CALL_HISTORY_PAGE_SIZE)), 1), CALL_HISTORY_MAX_PAGE_SIZE)
+                before = numeric_id(query_params['before']) if query_params.get('before') else None
+                if history_user is None or (query_params.get('before') and before is None):
+                    raise ValueError
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': f'userId and before must be ids from 1 to {MAX_ID}, limit an integer'})
+                }
+            
+            keys, calls = call_log.history(history_user, limit + 1, before)
+            has_more = len(calls) > limit
+            calls = calls[:limit]
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': tracing.dumps({
+                    'calls': serialize.table(keys, calls, serialize.wants_columnar(event)),
+                    # id is the first column
+                    'next_cursor': calls[-1][0] if has_more else None,
+                    'has_more': has_more
+                })
+            }
+        
         if not user_id:
             return {
                 'statusCode': 400,
@@ -100,9 +196,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'userId required'})
             }
         
-        messages = pending_messages.get(user_id, [])
-        if user_id in pending_messages:
-            del pending_messages[user_id]
+        try:
+            wait = min(max(float(query_params.get('wait') or 0), 0), MAX_POLL_WAIT)
+        except ValueError:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': 'wait must be a number of seconds'})
+            }
+        
+        # wait > 0 holds the request until a message arrives or the wait expires
+        messages = store.wait_for_messages(user_id, wait) if wait else store.drain(user_id)
         
         return {
             'statusCode': 200,
@@ -110,7 +217,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({'messages': messages})
+            'body': tracing.dumps({'messages': messages})
         }
     
     return {
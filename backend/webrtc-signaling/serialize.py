@@ -0,0 +1,64 @@
+'''
+Row serialization for the backend functions.
+Rows come from plain tuple cursors with the column keys read once from
+cursor.description, and TIMESTAMP/DATE values stay in PostgreSQL's text
+form instead of being parsed into datetimes and turned back into strings
+by json.dumps(default=str). Row sets are objects by default, or columnar
+(column names once, then row arrays) for clients that ask for it.
+Vendored into each function that uses it and kept identical.
+'''
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import psycopg2.extensions
+
+# timestamp (without time zone) and date; the schema has no timestamptz columns
+TEXT_DATETIME_OIDS = (1114, 1082)
+
+COLUMNAR_FORMAT = 'columnar'
+
+
+def _cast_datetime(value: Optional[str], cursor: Any) -> Optional[str]:
+    '''PostgreSQL prints "2024-05-01 10:00:00.5"; str(datetime) pads the fraction to microseconds'''
+    if value is not None and len(value) > 19 and value[19] == '.':
+        return value.ljust(26, '0')
+    return value
+
+
+TEXT_DATETIME = psycopg2.extensions.new_type(TEXT_DATETIME_OIDS, 'TEXT_DATETIME', _cast_datetime)
+
+
+def cursor(conn: Any) -> Any:
+    '''Tuple cursor whose timestamps and dates arrive as JSON-ready strings'''
+    cur = conn.cursor()
+    psycopg2.extensions.register_type(TEXT_DATETIME, cur)
+    return cur
+
+
+def columns(cur: Any) -> Tuple[str, ...]:
+    '''Column keys of the statement the cursor just ran'''
+    return tuple(column[0] for column in cur.description)
+
+
+def record(keys: Sequence[str], row: Optional[Sequence[Any]]) -> Optional[Dict[str, Any]]:
+    return dict(zip(keys, row)) if row is not None else None
+
+
+def records(keys: Sequence[str], rows: Iterable[Sequence[Any]]) -> List[Dict[str, Any]]:
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def table(keys: Sequence[str], rows: List[Sequence[Any]], columnar: bool,
+          exclude: Tuple[str, ...] = ()) -> Any:
+    '''A row set as a list of objects, or {"columns": [...], "rows": [[...], ...]}'''
+    if exclude:
+        kept = [i for i, key in enumerate(keys) if key not in exclude]
+        keys = [keys[i] for i in kept]
+        rows = [tuple(row[i] for i in kept) for row in rows]
+    if columnar:
+        return {'columns': list(keys), 'rows': rows}
+    return records(keys, rows)
+
+
+def wants_columnar(event: Dict[str, Any]) -> bool:
+    '''Clients opt in to columnar row sets with ?format=columnar'''
+    return (event.get('queryStringParameters') or {}).get('format') == COLUMNAR_FORMAT
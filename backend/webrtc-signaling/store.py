@@ -0,0 +1,599 @@
+'''
+Shared state for the signaling server: room membership and per-user message
+queues. The backend is picked with SIGNALING_STORE:
+  memory   - module-level dicts, one instance only (default)
+  postgres - tables from db_migrations plus LISTEN/NOTIFY, horizontally scalable
+  sqlite   - a local file, for running several processes on one machine in tests
+'''
+import json
+import os
+import select
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+NOTIFY_CHANNEL = 'signaling'
+POLL_LINGER = float(os.environ.get('SIGNALING_POLL_LINGER', '0.05'))
+# Queued messages older than MESSAGE_TTL are never delivered; rooms without a
+# join for ROOM_TTL are forgotten; each user keeps at most QUEUE_MAX_MESSAGES
+MESSAGE_TTL = float(os.environ.get('SIGNALING_MESSAGE_TTL', '120'))
+ROOM_TTL = float(os.environ.get('SIGNALING_ROOM_TTL', '3600'))
+QUEUE_MAX_MESSAGES = int(os.environ.get('SIGNALING_QUEUE_MAX_MESSAGES', '256'))
+# Expired entries reclaimed per request (memory) / seconds between sweeps (tables)
+SWEEP_BATCH = 4
+SWEEP_INTERVAL = float(os.environ.get('SIGNALING_SWEEP_INTERVAL', '30'))
+STATS_INTERVAL = float(os.environ.get('SIGNALING_STATS_INTERVAL', '60'))
+
+NEGOTIATION_TYPES = ('offer', 'answer')
+CANDIDATE_TYPES = ('ice-candidate', 'ice-candidates')
+
+
+def text_id(value: Any) -> Optional[str]:
+    '''User or room id as stored: clients send numbers as well as strings, rooms and queues are keyed by text'''
+    return None if value is None else str(value)
+
+
+def peer_key(message: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    '''Sender and room a message belongs to; its recipient is the queue owner'''
+    return text_id(message.get('from')), text_id(message.get('roomId', 'default'))
+
+
+def candidate_batch(message: Dict[str, Any]) -> Dict[str, Any]:
+    '''A fresh ice-candidates entry holding the candidates of message'''
+    candidates = message.get('data') if message.get('type') == 'ice-candidates' else [message.get('data')]
+    return {
+        'type': 'ice-candidates',
+        'from': message.get('from'),
+        'to': message.get('to'),
+        'roomId': message.get('roomId', 'default'),
+        'data': list(candidates or [])
+    }
+
+
+def compact(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    '''
+    Drop everything a later offer/answer from the same sender and room
+    supersedes (it restarts ICE), then merge that sender's remaining ICE
+    candidates into one ice-candidates entry at the position of the first.
+    Supersession goes by arrival order, so clients post an offer/answer
+    and only then the candidates gathered for it.
+    '''
+    last_negotiation: Dict[Tuple[Any, Any], int] = {}
+    for index, message in enumerate(messages):
+        if message.get('type') in NEGOTIATION_TYPES:
+            last_negotiation[peer_key(message)] = index
+
+    compacted: List[Dict[str, Any]] = []
+    batches: Dict[Tuple[Any, Any], Dict[str, Any]] = {}
+    for index, message in enumerate(messages):
+        key = peer_key(message)
+        if index < last_negotiation.get(key, -1):
+            continue
+        if message.get('type') not in CANDIDATE_TYPES:
+            compacted.append(message)
+        elif key in batches:
+            batches[key]['data'].extend(candidate_batch(message)['data'])
+        else:
+            batches[key] = candidate_batch(message)
+            compacted.append(batches[key])
+    return compacted
+
+
+class Waiters:
+    '''
+    Long-poll wake-ups. Each notification for a user wakes that user's
+    longest-waiting poller only, so concurrent polls are served in FIFO order
+    instead of all racing to drain the same queue.
+    '''
+
+    def __init__(self) -> None:
+        self._queues: Dict[str, Deque[threading.Event]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, user_id: str, front: bool = False) -> threading.Event:
+        waiter = threading.Event()
+        with self._lock:
+            queue = self._queues.setdefault(user_id, deque())
+            if front:
+                queue.appendleft(waiter)
+            else:
+                queue.append(waiter)
+        return waiter
+
+    def unregister(self, user_id: str, waiter: threading.Event) -> None:
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue is None:
+                return
+            try:
+                queue.remove(waiter)
+            except ValueError:
+                pass
+            if not queue:
+                del self._queues[user_id]
+
+    def notify(self, user_id: str) -> None:
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if not queue:
+                return
+            waiter = queue.popleft()
+            if not queue:
+                del self._queues[user_id]
+        waiter.set()
+
+
+class SignalingStore(ABC):
+    '''Atomic operations every backend provides'''
+
+    # Upper bound on a single sleep while long-polling; backends whose
+    # notifications can be missed re-check their queue at this interval
+    poll_interval = 1.0
+
+    def __init__(self) -> None:
+        self.waiters = Waiters()
+        self._last_sweep = time.monotonic()
+        self._last_report = time.monotonic()
+
+    def stats(self) -> Dict[str, int]:
+        '''Gauges and counters describing what the store currently holds'''
+        return {}
+
+    def maybe_report(self) -> None:
+        now = time.monotonic()
+        if now - self._last_report < STATS_INTERVAL:
+            return
+        self._last_report = now
+        print(json.dumps({'event': 'signaling_store_stats', **self.stats()}))
+
+    def _sweep_due(self) -> bool:
+        '''True at most once per SWEEP_INTERVAL, for backends that sweep in bulk'''
+        now = time.monotonic()
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return False
+        self._last_sweep = now
+        return True
+
+    def wait_for_messages(self, user_id: str, timeout: float) -> List[Dict[str, Any]]:
+        '''
+        Drain the user's queue, waiting up to timeout seconds for a first message.
+        Once something arrives the poll lingers briefly so a burst (an answer
+        followed by its ICE candidates) is delivered by one response.
+        '''
+        deadline = time.monotonic() + timeout
+        # Registered before the first drain so an enqueue in between is not missed
+        waiter = self.waiters.register(user_id)
+        try:
+            messages = self.drain(user_id)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return messages
+                if messages:
+                    deadline = min(deadline, time.monotonic() + POLL_LINGER)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return messages
+                if waiter.wait(min(remaining, self.poll_interval)):
+                    # Woken but another poller may have drained first; keep our turn
+                    waiter = self.waiters.register(user_id, front=True)
+                messages.extend(self.drain(user_id))
+        finally:
+            self.waiters.unregister(user_id, waiter)
+
+    @abstractmethod
+    def join(self, room_id: str, user_id: str) -> List[str]:
+        '''Add the user to the room and return its participants'''
+
+    @abstractmethod
+    def leave(self, room_id: str, user_id: str) -> None:
+        '''Remove the user from the room'''
+
+    @abstractmethod
+    def enqueue(self, user_id: str, message: Dict[str, Any]) -> None:
+        '''Append a message to the user's queue'''
+
+    @abstractmethod
+    def drain(self, user_id: str) -> List[Dict[str, Any]]:
+        '''
+        Remove and return every queued message for the user, oldest first,
+        with superseded messages dropped and ICE candidates merged (compact)
+        '''
+
+    def enqueue_many(self, items: List[Tuple[str, Dict[str, Any]]]) -> None:
+        '''Enqueue (user_id, message) pairs posted together'''
+        for user_id, message in items:
+            self.enqueue(user_id, message)
+
+
+class MemoryStore(SignalingStore):
+    '''
+    Wake-ups reach pollers of the same instance only.
+    Rooms and queues are kept in least-recently-touched order, so each request
+    can reclaim a few expired entries from the front: amortized O(1) cleanup
+    with no background thread.
+    '''
+
+    poll_interval = 5.0
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.active_connections: 'OrderedDict[str, Set[str]]' = OrderedDict()
+        self.pending_messages: 'OrderedDict[str, Deque[Tuple[float, Dict[str, Any]]]]' = OrderedDict()
+        self._room_touched: Dict[str, float] = {}
+        self._members = 0
+        self._queued = 0
+        self._counters = {
+            'dropped_messages': 0, 'expired_messages': 0, 'expired_rooms': 0,
+            'superseded_messages': 0, 'coalesced_candidates': 0
+        }
+        self._lock = threading.Lock()
+
+    def join(self, room_id: str, user_id: str) -> List[str]:
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            participants = self.active_connections.get(room_id)
+            if participants is None:
+                participants = self.active_connections[room_id] = set()
+            else:
+                self.active_connections.move_to_end(room_id)
+            self._room_touched[room_id] = now
+            if user_id not in participants:
+                participants.add(user_id)
+                self._members += 1
+            return list(participants)
+
+    def leave(self, room_id: str, user_id: str) -> None:
+        with self._lock:
+            self._sweep(time.monotonic())
+            participants = self.active_connections.get(room_id)
+            if participants is None or user_id not in participants:
+                return
+            participants.discard(user_id)
+            self._members -= 1
+            if not participants:
+                self._drop_room(room_id)
+
+    def enqueue(self, user_id: str, message: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        key = peer_key(message)
+        with self._lock:
+            self._sweep(now)
+            queue = self.pending_messages.get(user_id)
+            if queue is None:
+                queue = self.pending_messages[user_id] = deque()
+            else:
+                self.pending_messages.move_to_end(user_id)
+            if message.get('type') in NEGOTIATION_TYPES and queue:
+                # A new offer/answer supersedes what this peer queued before it
+                kept = [entry for entry in queue if peer_key(entry[1]) != key]
+                self._queued -= len(queue) - len(kept)
+                self._counters['superseded_messages'] += len(queue) - len(kept)
+                queue.clear()
+                queue.extend(kept)
+            if message.get('type') in CANDIDATE_TYPES:
+                # Coalesce into the peer's candidate batch when it is the newest entry
+                if queue and queue[-1][1].get('type') == 'ice-candidates' and peer_key(queue[-1][1]) == key:
+                    batch = queue.pop()[1]
+                    batch['data'].extend(candidate_batch(message)['data'])
+                    queue.append((now, batch))
+                    self._counters['coalesced_candidates'] += 1
+                    message = None
+                else:
+                    message = candidate_batch(message)
+            if message is not None:
+                if len(queue) >= QUEUE_MAX_MESSAGES:
+                    queue.popleft()
+                    self._queued -= 1
+                    self._counters['dropped_messages'] += 1
+                queue.append((now, message))
+                self._queued += 1
+        self.waiters.notify(user_id)
+        self.maybe_report()
+
+    def drain(self, user_id: str) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            queue = self.pending_messages.pop(user_id, None)
+            if not queue:
+                return []
+            self._queued -= len(queue)
+            messages = [message for queued_at, message in queue if now - queued_at < MESSAGE_TTL]
+            self._counters['expired_messages'] += len(queue) - len(messages)
+        return compact(messages)
+
+    def _sweep(self, now: float) -> None:
+        '''Reclaim up to SWEEP_BATCH expired queues and rooms from the stale end'''
+        for _ in range(SWEEP_BATCH):
+            user_id = next(iter(self.pending_messages), None)
+            # The least recently fed queue; if its newest message is still fresh, all are
+            if user_id is None or now - self.pending_messages[user_id][-1][0] < MESSAGE_TTL:
+                break
+            queue = self.pending_messages.pop(user_id)
+            self._queued -= len(queue)
+            self._counters['expired_messages'] += len(queue)
+        for _ in range(SWEEP_BATCH):
+            room_id = next(iter(self.active_connections), None)
+            if room_id is None or now - self._room_touched[room_id] < ROOM_TTL:
+                break
+            self._members -= len(self.active_connections[room_id])
+            self._drop_room(room_id)
+            self._counters['expired_rooms'] += 1
+
+    def _drop_room(self, room_id: str) -> None:
+        del self.active_connections[room_id]
+        del self._room_touched[room_id]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'rooms': len(self.active_connections),
+                'room_members': self._members,
+                'queues': len(self.pending_messages),
+                'queued_messages': self._queued,
+                **self._counters
+            }
+
+
+class PostgresStore(SignalingStore):
+    '''
+    Rooms and queues in the signaling_* tables. Every enqueue also sends
+    NOTIFY on the signaling channel with the recipient id as payload; a
+    listener thread per instance turns those into local wake-ups, so a poll
+    on one instance sees messages posted through any other.
+    '''
+
+    poll_interval = 5.0
+
+    def __init__(self) -> None:
+        super().__init__()
+        from db import get_pool
+        self.pool = get_pool()
+        self._listener: Optional[threading.Thread] = None
+        self._listener_lock = threading.Lock()
+
+    def wait_for_messages(self, user_id: str, timeout: float) -> List[Dict[str, Any]]:
+        self._ensure_listener()
+        return super().wait_for_messages(user_id, timeout)
+
+    def _ensure_listener(self) -> None:
+        with self._listener_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='signaling-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self) -> None:
+        import psycopg2
+        import psycopg2.extensions
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.pool.dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {NOTIFY_CHANNEL}')
+                while True:
+                    if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.waiters.notify(conn.notifies.pop(0).payload)
+            except psycopg2.Error:
+                # Pollers fall back to poll_interval re-checks until we are back
+                if conn is not None:
+                    conn.close()
+                time.sleep(1)
+
+    def _run(self, query: str, params: Any, fetch: bool = False) -> List[tuple]:
+        return self._run_many([(query, params)], fetch)
+
+    def _run_many(self, statements: List[Tuple[str, Any]], fetch: bool = False) -> List[tuple]:
+        '''Execute statements in one transaction; returns rows of the last one'''
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                for query, params in statements:
+                    cursor.execute(query, params)
+                rows = cursor.fetchall() if fetch else []
+            conn.commit()
+            return rows
+        finally:
+            self.pool.putconn(conn)
+
+    def join(self, room_id: str, user_id: str) -> List[str]:
+        rows = self._run("""
+            WITH joined AS (
+                INSERT INTO signaling_rooms (room_id, user_id) VALUES (%s::text, %s::text)
+                ON CONFLICT (room_id, user_id) DO UPDATE SET joined_at = CURRENT_TIMESTAMP
+                RETURNING user_id
+            )
+            SELECT user_id FROM signaling_rooms WHERE room_id = %s::text
+            UNION
+            SELECT user_id FROM joined
+        """, (room_id, user_id, room_id), fetch=True)
+        return [row[0] for row in rows]
+
+    def leave(self, room_id: str, user_id: str) -> None:
+        self._run("DELETE FROM signaling_rooms WHERE room_id = %s::text AND user_id = %s::text", (room_id, user_id))
+
+    def enqueue(self, user_id: str, message: Dict[str, Any]) -> None:
+        self.enqueue_many([(user_id, message)])
+
+    def enqueue_many(self, items: List[Tuple[str, Dict[str, Any]]]) -> None:
+        '''All messages of one POST go in with a single transaction'''
+        statements = []
+        for user_id, message in items:
+            if message.get('type') in NEGOTIATION_TYPES:
+                # A new offer/answer supersedes what this peer queued before it
+                statements.append(("""
+                    DELETE FROM signaling_queue
+                    WHERE user_id = %s::text AND payload->>'from' = %s::text
+                      AND COALESCE(payload->>'roomId', 'default') = %s::text
+                """, (user_id,) + peer_key(message)))
+            # Insert, drop the oldest beyond the per-user cap and notify in one statement
+            statements.append(("""
+                WITH queued AS (
+                    INSERT INTO signaling_queue (user_id, payload) VALUES (%(user_id)s::text, %(payload)s)
+                ), trimmed AS (
+                    DELETE FROM signaling_queue
+                    WHERE user_id = %(user_id)s::text AND id <= (
+                        SELECT id FROM signaling_queue WHERE user_id = %(user_id)s::text
+                        ORDER BY id DESC OFFSET %(keep)s LIMIT 1
+                    )
+                )
+                SELECT pg_notify(%(channel)s, %(user_id)s::text)
+            """, {
+                'user_id': user_id,
+                'payload': json.dumps(message),
+                'keep': QUEUE_MAX_MESSAGES - 1,
+                'channel': NOTIFY_CHANNEL
+            }))
+        self._run_many(statements)
+        self._maybe_sweep()
+
+    def drain(self, user_id: str) -> List[Dict[str, Any]]:
+        rows = self._run("""
+            DELETE FROM signaling_queue WHERE user_id = %s::text
+            RETURNING id, payload, created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+        """, (user_id, MESSAGE_TTL), fetch=True)
+        return compact([payload for _, payload, fresh in sorted(rows, key=lambda row: row[0]) if fresh])
+
+    def _maybe_sweep(self) -> None:
+        if not self._sweep_due():
+            return
+        self._run("""
+            WITH expired_messages AS (
+                DELETE FROM signaling_queue WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            )
+            DELETE FROM signaling_rooms WHERE joined_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+        """, (MESSAGE_TTL, ROOM_TTL))
+        self.maybe_report()
+
+    def stats(self) -> Dict[str, int]:
+        rows = self._run("""
+            SELECT 
+                (SELECT COUNT(DISTINCT room_id) FROM signaling_rooms),
+                (SELECT COUNT(*) FROM signaling_rooms),
+                (SELECT COUNT(DISTINCT user_id) FROM signaling_queue),
+                (SELECT COUNT(*) FROM signaling_queue)
+        """, (), fetch=True)
+        return dict(zip(('rooms', 'room_members', 'queues', 'queued_messages'), rows[0]))
+
+
+class SqliteStore(SignalingStore):
+    '''Other processes cannot signal us, so waiting pollers re-check quickly'''
+
+    poll_interval = 0.05
+
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS signaling_rooms (
+                    room_id TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    joined_at REAL NOT NULL,
+                    PRIMARY KEY (room_id, user_id)
+                );
+                CREATE TABLE IF NOT EXISTS signaling_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_signaling_queue_user ON signaling_queue(user_id, id);
+                CREATE INDEX IF NOT EXISTS idx_signaling_queue_created ON signaling_queue(created_at);
+                CREATE INDEX IF NOT EXISTS idx_signaling_rooms_joined ON signaling_rooms(joined_at);
+            """)
+
+    def _transaction(self, statements: List[tuple]) -> List[tuple]:
+        '''Run statements in one write transaction; returns rows of the first one'''
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._conn.execute(*statements[0]).fetchall()
+                for statement in statements[1:]:
+                    self._conn.execute(*statement)
+                self._conn.execute('COMMIT')
+                return rows
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def join(self, room_id: str, user_id: str) -> List[str]:
+        self._transaction([
+            ('INSERT OR REPLACE INTO signaling_rooms (room_id, user_id, joined_at) VALUES (?, ?, ?)',
+             (room_id, user_id, time.time()))
+        ])
+        with self._lock:
+            rows = self._conn.execute('SELECT user_id FROM signaling_rooms WHERE room_id = ?', (room_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def leave(self, room_id: str, user_id: str) -> None:
+        self._transaction([
+            ('DELETE FROM signaling_rooms WHERE room_id = ? AND user_id = ?', (room_id, user_id))
+        ])
+
+    def enqueue(self, user_id: str, message: Dict[str, Any]) -> None:
+        statements = []
+        if message.get('type') in NEGOTIATION_TYPES:
+            # A new offer/answer supersedes what this peer queued before it
+            statements.append(("""DELETE FROM signaling_queue WHERE user_id = ?
+                    AND CAST(json_extract(payload, '$.from') AS TEXT) = ?
+                    AND CAST(COALESCE(json_extract(payload, '$.roomId'), 'default') AS TEXT) = ?""",
+                               (user_id,) + peer_key(message)))
+        self._transaction(statements + [
+            ('INSERT INTO signaling_queue (user_id, payload, created_at) VALUES (?, ?, ?)',
+             (user_id, json.dumps(message), time.time())),
+            ("""DELETE FROM signaling_queue WHERE user_id = ? AND id <= (
+                    SELECT id FROM signaling_queue WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+                )""", (user_id, user_id, QUEUE_MAX_MESSAGES))
+        ])
+        self.waiters.notify(user_id)
+        self._maybe_sweep()
+
+    def drain(self, user_id: str) -> List[Dict[str, Any]]:
+        rows = self._transaction([
+            ('SELECT payload FROM signaling_queue WHERE user_id = ? AND created_at > ? ORDER BY id',
+             (user_id, time.time() - MESSAGE_TTL)),
+            ('DELETE FROM signaling_queue WHERE user_id = ?', (user_id,))
+        ])
+        return compact([json.loads(row[0]) for row in rows])
+
+    def _maybe_sweep(self) -> None:
+        if not self._sweep_due():
+            return
+        now = time.time()
+        self._transaction([
+            ('DELETE FROM signaling_queue WHERE created_at < ?', (now - MESSAGE_TTL,)),
+            ('DELETE FROM signaling_rooms WHERE joined_at < ?', (now - ROOM_TTL,))
+        ])
+        self.maybe_report()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT 
+                    (SELECT COUNT(DISTINCT room_id) FROM signaling_rooms),
+                    (SELECT COUNT(*) FROM signaling_rooms),
+                    (SELECT COUNT(DISTINCT user_id) FROM signaling_queue),
+                    (SELECT COUNT(*) FROM signaling_queue)
+            """).fetchone()
+        return dict(zip(('rooms', 'room_members', 'queues', 'queued_messages'), row))
+
+
+def create_store() -> SignalingStore:
+    '''Store selected by SIGNALING_STORE'''
+    backend = os.environ.get('SIGNALING_STORE', 'memory')
+    if backend == 'postgres':
+        return PostgresStore()
+    if backend == 'sqlite':
+        return SqliteStore(os.environ.get('SIGNALING_SQLITE_PATH', 'signaling.sqlite3'))
+    return MemoryStore()
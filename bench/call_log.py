@@ -0,0 +1,137 @@
+'''
+Benchmark: call log written behind the webrtc-signaling hot path.
+
+Runs against the schema built by bench/seed.py. Each call is an offer, an
+answer and a leave posted to the handler in a fresh room between two seeded
+users, timed per POST in three modes: call log off, write-behind (the
+default: the event is buffered and a background thread flushes it), and
+write-through (the buffer is flushed inside every request, as an inline
+INSERT/UPDATE would). Then a backlog of buffered calls is flushed at once,
+and the call history is paged for the busiest user once calls holds
+--history-calls rows.
+
+    DATABASE_URL=postgresql://... python bench/call_log.py
+'''
+import argparse
+import json
+import os
+import random
+import time
+from types import ModuleType
+from typing import Dict, List
+
+import psycopg2
+
+from common import event, load_handler, summary, with_search_path, Context
+from seed import SCHEMA
+
+# Callers and receivers are drawn from this many users, so histories grow
+CALL_USERS = 1000
+
+
+def load_signaling(dsn: str, env: Dict[str, str]) -> ModuleType:
+    os.environ.update(env)
+    try:
+        return load_handler('webrtc-signaling', dsn)
+    finally:
+        for key in env:
+            del os.environ[key]
+
+
+def post(signaling: ModuleType, body: Dict[str, object]) -> None:
+    response = signaling.handler(event('POST', body=body), Context())
+    assert response['statusCode'] == 200, response
+
+
+def call_messages(rng: random.Random, room: str) -> List[Dict[str, object]]:
+    caller, receiver = rng.sample(range(2, CALL_USERS + 2), 2)
+    sdp = 'v=0\r\nm=audio 9 UDP/TLS/RTP/SAVPF 111\r\n' + ('m=video 9 UDP/TLS/RTP/SAVPF 96\r\n' if rng.random() < 0.3 else '')
+    return [
+        {'type': 'offer', 'from': caller, 'to': receiver, 'roomId': room, 'data': {'type': 'offer', 'sdp': sdp}},
+        {'type': 'answer', 'from': receiver, 'to': caller, 'roomId': room, 'data': {'type': 'answer', 'sdp': sdp}},
+        {'type': 'leave', 'from': rng.choice((caller, receiver)), 'roomId': room},
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--schema', default=SCHEMA)
+    parser.add_argument('--calls', type=int, default=300, help='calls posted per mode')
+    parser.add_argument('--backlog', type=int, default=5000, help='calls buffered before one flush')
+    parser.add_argument('--history-calls', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    dsn = with_search_path(os.environ['DATABASE_URL'], args.schema)
+    rng = random.Random(42)
+    run = int(time.time())
+
+    print(f'{args.calls} calls per mode, 3 POSTs each, wall clock per POST')
+    modes = {
+        'off': load_signaling(dsn, {'SIGNALING_CALL_LOG': '0'}),
+        'write-behind': load_signaling(dsn, {}),
+        'write-through': load_signaling(dsn, {}),
+    }
+    for mode, signaling in modes.items():
+        samples: List[float] = []
+        for n in range(args.calls):
+            for message in call_messages(rng, f'bench-{run}-{mode}-{n}'):
+                started = time.perf_counter()
+                post(signaling, message)
+                if mode == 'write-through':
+                    signaling.call_log.flush()
+                samples.append((time.perf_counter() - started) * 1000)
+        print(f'{mode:14}{summary(samples)}')
+    modes['write-behind'].call_log.flush()
+
+    signaling = load_signaling(dsn, {'SIGNALING_CALL_LOG_FLUSH_INTERVAL': '3600', 'SIGNALING_CALL_LOG_FLUSH_SIZE': '1000000',
+                                     'SIGNALING_CALL_LOG_MAX_PENDING': '1000000'})
+    for n in range(args.backlog):
+        for message in call_messages(rng, f'bench-{run}-backlog-{n}'):
+            signaling.call_log.record(message)
+    started = time.perf_counter()
+    flushed = signaling.call_log.flush()
+    elapsed = time.perf_counter() - started
+    print(f'flush of {flushed} buffered events: {elapsed * 1000:.0f}ms, {flushed / elapsed:.0f} events/s')
+
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM calls')
+        missing = args.history_calls - cursor.fetchone()[0]
+        if missing > 0:
+            # Ended calls in the same shape the call log writes
+            cursor.execute("""
+                INSERT INTO calls (room_id, caller_id, receiver_id, call_type, status, duration, started_at, answered_at, ended_at)
+                SELECT
+                    'history-' || i, 2 + (i * 7919) %% %(users)s, 2 + (i * 104729 + 1) %% %(users)s,
+                    CASE WHEN i %% 3 = 0 THEN 'video' ELSE 'audio' END, 'ended', 60,
+                    LOCALTIMESTAMP - make_interval(mins => i::integer), LOCALTIMESTAMP - make_interval(mins => i::integer),
+                    LOCALTIMESTAMP - make_interval(mins => i::integer) + INTERVAL '60 seconds'
+                FROM generate_series(1::bigint, %(missing)s) AS i
+            """, {'users': CALL_USERS, 'missing': missing})
+            cursor.execute('ANALYZE calls')
+        cursor.execute("""
+            SELECT user_id, COUNT(*) FROM (
+                SELECT caller_id AS user_id FROM calls UNION ALL SELECT receiver_id FROM calls
+            ) sides GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1
+        """)
+        user_id, user_calls = cursor.fetchone()
+        cursor.execute('SELECT COUNT(*) FROM calls')
+        total = cursor.fetchone()[0]
+    conn.close()
+
+    print(f'history of user {user_id}: {user_calls} of {total} calls, 20 per page')
+    params = {'action': 'calls', 'userId': str(user_id)}
+    for page in range(1, 6):
+        samples = []
+        for _ in range(50):
+            started = time.perf_counter()
+            response = signaling.handler(event('GET', params), Context())
+            samples.append((time.perf_counter() - started) * 1000)
+        body = json.loads(response['body'])
+        print(f'page {page:<9}{summary(samples)}')
+        if body['next_cursor'] is None:
+            break
+        params = {**params, 'before': str(body['next_cursor'])}
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+'''
+Helpers shared by the benchmark scripts: loading a backend handler in-process,
+building API-gateway style events and summarising latencies.
+'''
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional
+
+import psycopg2.extensions
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+
+
+class Context:
+    '''Minimal stand-in for the cloud function context object'''
+
+    def __init__(self, request_id: str = 'bench') -> None:
+        self.request_id = request_id
+
+
+def with_search_path(dsn: str, schema: str) -> str:
+    '''DSN whose sessions resolve unqualified tables in the given schema first'''
+    return psycopg2.extensions.make_dsn(dsn, options=f'-csearch_path={schema},public')
+
+
+def load_handler(function: str, database_url: Optional[str] = None) -> ModuleType:
+    '''
+    Import backend/<function>/index.py under a unique module name.
+    Every function ships its own sibling modules (db.py, ...), so those are
+    dropped from sys.modules first and re-imported from the function directory.
+    '''
+    function_dir = BACKEND_DIR / function
+    if database_url:
+        os.environ['DATABASE_URL'] = database_url
+    for sibling in function_dir.glob('*.py'):
+        sys.modules.pop(sibling.stem, None)
+    sys.path.insert(0, str(function_dir))
+    try:
+        spec = importlib.util.spec_from_file_location(f"bench_{function.replace('-', '_')}", function_dir / 'index.py')
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(str(function_dir))
+    return module
+
+
+class QueryCounter:
+    '''Statements executed per thread, by handlers whose pool was instrumented'''
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._cursor_classes: Dict[type, type] = {}
+
+    @property
+    def value(self) -> int:
+        return getattr(self._local, 'value', 0)
+
+    def add(self) -> None:
+        self._local.value = self.value + 1
+
+    def cursor_class(self, base: type) -> type:
+        '''Subclass of a cursor factory that counts its statements, a real cursor for psycopg2'''
+        cls = self._cursor_classes.get(base)
+        if cls is None:
+            counter = self
+
+            class CountingCursor(base):  # type: ignore[misc, valid-type]
+                def execute(self, *args: Any, **kwargs: Any) -> Any:
+                    counter.add()
+                    return super().execute(*args, **kwargs)
+
+                def executemany(self, *args: Any, **kwargs: Any) -> Any:
+                    counter.add()
+                    return super().executemany(*args, **kwargs)
+
+            cls = self._cursor_classes[base] = CountingCursor
+        return cls
+
+
+def count_queries(module: ModuleType, counter: QueryCounter) -> None:
+    '''Count every statement the handler module runs through its db.get_pool() pool'''
+    # Read-only handlers import just get_read_pool; it shares the db module's get_pool
+    get_pool = getattr(module, 'get_pool', None) or getattr(module, 'get_read_pool', None)
+    if get_pool is None:
+        return
+    pool = get_pool.__globals__['get_pool']()
+    connect = pool._connect
+
+    def counted_connect() -> Any:
+        conn = connect()
+        cursor = conn.cursor
+
+        def counting_cursor(*args: Any, cursor_factory: Optional[type] = None, **kwargs: Any) -> Any:
+            base = cursor_factory or conn.cursor_factory or psycopg2.extensions.cursor
+            return cursor(*args, cursor_factory=counter.cursor_class(base), **kwargs)
+
+        conn.cursor = counting_cursor
+        return conn
+
+    pool._connect = counted_connect
+
+
+def event(method: str, params: Optional[Dict[str, str]] = None, body: Optional[Dict[str, Any]] = None,
+          headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    return {
+        'httpMethod': method,
+        'queryStringParameters': params or {},
+        'headers': headers or {},
+        'body': json.dumps(body) if body is not None else '',
+    }
+
+
+def timed(fn: Callable[[], Any], repeat: int) -> List[float]:
+    '''Wall-clock milliseconds for each of repeat calls'''
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summary(samples: List[float]) -> str:
+    return (f'p50={percentile(samples, 50):8.2f}ms  p95={percentile(samples, 95):8.2f}ms  '
+            f'mean={statistics.fmean(samples):8.2f}ms')
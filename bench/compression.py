@@ -0,0 +1,113 @@
+'''
+Benchmark: response compression per endpoint.
+
+Runs against the schema built by bench/seed.py (with the calls that
+bench/call_log.py leaves for the call history). For a typical response of
+each endpoint it prints the size and CPU per compression level of gzip and
+brotli, which is how the defaults in compression.py were picked, then the
+handler latency and bytes sent without compression and with each coding at
+its default level. Brotli rows need the brotli package.
+
+    DATABASE_URL=postgresql://... python bench/compression.py
+'''
+import argparse
+import base64
+import os
+import time
+from typing import Any, Dict, List, Tuple
+
+import psycopg2
+
+from common import event, load_handler, percentile, summary, timed, with_search_path, Context
+from seed import SCHEMA
+
+GZIP_LEVELS = (1, 3, 5, 6, 9)
+BROTLI_QUALITIES = (1, 3, 4, 5, 6, 9, 11)
+
+
+def cpu_ms(fn: Any, repeat: int) -> float:
+    '''Median CPU milliseconds of fn()'''
+    samples = []
+    for _ in range(repeat):
+        started = time.process_time()
+        fn()
+        samples.append((time.process_time() - started) * 1000)
+    return percentile(samples, 50)
+
+
+def endpoints(dsn: str) -> List[Tuple[str, str, Dict[str, str]]]:
+    '''(label, function, query) of each response measured, keyed from the busiest chat and users'''
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cursor:
+        cursor.execute('SELECT chat_id FROM messages GROUP BY chat_id ORDER BY COUNT(*) DESC LIMIT 1')
+        chat_id = cursor.fetchone()[0]
+        cursor.execute('SELECT user_id FROM chat_participants WHERE chat_id = %s ORDER BY user_id LIMIT 1', (chat_id,))
+        user_id = cursor.fetchone()[0]
+        cursor.execute('SELECT user_id FROM contacts GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1')
+        contact_owner = cursor.fetchone()[0]
+        cursor.execute('SELECT caller_id FROM calls GROUP BY caller_id ORDER BY COUNT(*) DESC LIMIT 1')
+        row = cursor.fetchone()
+        caller = row[0] if row else user_id
+    conn.close()
+    chat = {'chat_id': str(chat_id), 'user_id': str(user_id)}
+    return [
+        ('chats list', 'chats', {'action': 'list', 'user_id': str(user_id)}),
+        ('messages 50', 'chats', {'action': 'messages', **chat}),
+        ('messages 200', 'chats', {'action': 'messages', 'limit': '200', **chat}),
+        ('messages 200 col', 'chats', {'action': 'messages', 'limit': '200', 'format': 'columnar', **chat}),
+        ('message search', 'chats', {'action': 'search', 'q': 'message', 'limit': '50', 'user_id': str(user_id)}),
+        ('contacts', 'contacts', {'user_id': str(contact_owner)}),
+        ('profiles 50', 'profile', {'ids': ','.join(str(i) for i in range(2, 52))}),
+        ('user search', 'user-search', {'q': 'ann'}),
+        ('call history', 'webrtc-signaling', {'action': 'calls', 'userId': str(caller), 'limit': '100'}),
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--schema', default=SCHEMA)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    dsn = with_search_path(os.environ['DATABASE_URL'], args.schema)
+    handlers: Dict[str, Any] = {}
+    measured = endpoints(dsn)
+    for _, function, _ in measured:
+        if function not in handlers:
+            handlers[function] = load_handler(function, dsn)
+    compression = handlers['chats'].compression
+    codings = list(compression.ENCODERS)
+
+    print('compressed size (% of body) and CPU per level')
+    for label, function, params in measured:
+        body = handlers[function].handler(event('GET', params), Context())['body'].encode('utf-8')
+        cells = []
+        for level in GZIP_LEVELS:
+            size = len(compression.gzip_encode(body, level))
+            cells.append(f'gzip-{level} {size / len(body):4.0%} {cpu_ms(lambda: compression.gzip_encode(body, level), args.repeat):5.2f}ms')
+        if 'br' in codings:
+            for quality in BROTLI_QUALITIES:
+                size = len(compression.brotli_encode(body, quality))
+                cells.append(f'br-{quality} {size / len(body):4.0%} '
+                             f'{cpu_ms(lambda: compression.brotli_encode(body, quality), args.repeat):5.2f}ms')
+        print(f'{label:18}{len(body):8} bytes')
+        for i in range(0, len(cells), 4):
+            print(' ' * 18 + '   '.join(cells[i:i + 4]))
+
+    print(f'handler with Accept-Encoding, default levels (gzip {compression.GZIP_LEVEL}, '
+          f'br {compression.BROTLI_QUALITY}), {args.repeat} runs, wall clock')
+    for label, function, params in measured:
+        for coding in ['identity'] + codings:
+            request = event('GET', params, headers={'Accept-Encoding': coding})
+
+            def call() -> Dict[str, Any]:
+                response = handlers[function].handler(request, Context())
+                assert response['statusCode'] == 200, response
+                return response
+
+            response = call()
+            sent = len(base64.b64decode(response['body'])) if response.get('isBase64Encoded') else len(response['body'])
+            print(f'{label:18}{coding:10}{summary(timed(call, args.repeat))}  {sent:8} bytes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+'''
+Benchmark: matching a phone address book against registered users.
+
+Seeds bench_contacts.users and bench_contacts.contacts (same columns and
+indexes as public, run the migrations first) and times POST action=discover
+on backend/contacts with an address book of which about half is registered.
+"import" starts from an empty contact list, "resync" repeats the same book.
+
+    DATABASE_URL=postgresql://... python bench/contact_discovery.py --book 5000
+'''
+import argparse
+import os
+import random
+
+import psycopg2
+
+from common import event, load_handler, summary, timed, with_search_path, Context
+
+SCHEMA = 'bench_contacts'
+
+OWNER_ID = 1
+
+
+def phone(i: int) -> str:
+    return f'+7 (9{i % 100:02d}) {i // 100:07d}'
+
+
+def seed(conn, users: int) -> None:
+    with conn.cursor() as cursor:
+        cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA}')
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {SCHEMA}.users (LIKE public.users INCLUDING ALL)')
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {SCHEMA}.contacts (LIKE public.contacts INCLUDING ALL)')
+        cursor.execute(f'SELECT COUNT(*) FROM {SCHEMA}.users')
+        if cursor.fetchone()[0] == users:
+            return
+        cursor.execute(f'TRUNCATE {SCHEMA}.users, {SCHEMA}.contacts')
+        cursor.execute(f"""
+            INSERT INTO {SCHEMA}.users (id, username, full_name, email, phone, unique_id, status)
+            SELECT
+                i,
+                'user_' || i,
+                'User ' || i,
+                'user_' || i || '@example.com',
+                '+7 (9' || LPAD((i %% 100)::text, 2, '0') || ') ' || LPAD((i / 100)::text, 7, '0'),
+                SUBSTRING(ENCODE(SHA256(('79' || LPAD((i %% 100)::text, 2, '0') || LPAD((i / 100)::text, 7, '0'))::bytea), 'hex'), 1, 16),
+                'offline'
+            FROM generate_series(1, %s) AS i
+        """, (users,))
+        cursor.execute(f'ANALYZE {SCHEMA}.users')
+    conn.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--book', type=int, default=5000, help='address book entries')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    dsn = with_search_path(os.environ['DATABASE_URL'], SCHEMA)
+    conn = psycopg2.connect(dsn)
+    seed(conn, args.users)
+    contacts = load_handler('contacts', dsn)
+
+    # Registered numbers and numbers beyond the seeded range, interleaved
+    book = [
+        {'phone': phone(random.randint(2, args.users) if i % 2 else args.users + 1 + i), 'name': f'Contact {i}'}
+        for i in range(args.book)
+    ]
+    body = {'action': 'discover', 'user_id': OWNER_ID, 'contacts': book}
+
+    def clear() -> None:
+        with conn.cursor() as cursor:
+            cursor.execute('DELETE FROM contacts WHERE user_id = %s', (OWNER_ID,))
+        conn.commit()
+
+    def discover() -> None:
+        response = contacts.handler(event('POST', body=body), Context())
+        assert response['statusCode'] == 200, response
+
+    def fresh_import() -> None:
+        clear()
+        discover()
+
+    print(f'{args.users} users, address book of {args.book}, {args.repeat} runs')
+    print(f'import   {summary(timed(fresh_import, args.repeat))}  (includes clearing contacts)')
+    print(f'resync   {summary(timed(discover, args.repeat))}')
+    clear()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
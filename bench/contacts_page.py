@@ -0,0 +1,161 @@
+'''
+Benchmark: contacts screen for users with 5,000 contacts.
+
+Runs against the schema built by bench/seed.py. The first run gives
+--owners users --contacts contacts each, added a hundred at a time (so
+pages cross runs of equal added_at), and a direct chat with every other
+one of them. For those users it times the contacts GET on its first page,
+on a page deep in the list and walking every page, against what the
+screen needed before: the whole list in one response (the query the GET
+ran until now) plus the user's chat list to find the direct chats, and
+prints the buffers each page query touches.
+
+    DATABASE_URL=postgresql://... python bench/contacts_page.py
+'''
+import argparse
+import json
+import os
+import time
+from types import ModuleType
+from typing import Dict, List, Optional
+
+import psycopg2
+
+from common import event, load_handler, summary, timed, with_search_path, Context
+from seed import SCHEMA
+
+# The contacts GET before pagination: every contact, cards and presence only
+FULL_LIST_SQL = """
+    SELECT
+        c.id as contact_id,
+        u.id, u.unique_id, u.username, u.full_name,
+        u.phone, u.avatar_url,
+        CASE WHEN u.last_seen > LOCALTIMESTAMP - make_interval(secs => 120)
+             THEN 'online' ELSE 'offline' END as status,
+        u.last_seen,
+        c.contact_name, c.added_at
+    FROM contacts c
+    JOIN users u ON c.contact_user_id = u.id
+    WHERE c.user_id = %(user_id)s
+    ORDER BY c.added_at DESC
+"""
+
+
+def ensure_owners(dsn: str, owners: int, contacts: int) -> List[int]:
+    '''The last `owners` users, each given `contacts` contacts and direct chats with half of them'''
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cursor:
+        cursor.execute('SELECT MAX(id) FROM users')
+        max_user = cursor.fetchone()[0]
+        owner_ids = list(range(max_user - owners + 1, max_user + 1))
+        cursor.execute('SELECT COUNT(*) FROM contacts WHERE user_id = ANY(%s)', (owner_ids,))
+        if cursor.fetchone()[0] >= owners * contacts * 0.99:
+            return owner_ids
+        started = time.perf_counter()
+        cursor.execute("""
+            INSERT INTO contacts (user_id, contact_user_id, contact_name, added_at)
+            SELECT owner, 2 + ((owner::bigint * 7919 + k::bigint * 104729) %% (%(max_user)s - 1)),
+                   'Contact ' || k, LOCALTIMESTAMP - make_interval(hours => k / 100)
+            FROM unnest(%(owners)s::integer[]) AS owner, generate_series(1, %(contacts)s) AS k
+            ON CONFLICT (user_id, contact_user_id) DO NOTHING
+        """, {'owners': owner_ids, 'contacts': contacts, 'max_user': max_user})
+        cursor.execute("""
+            WITH pairs AS (
+                SELECT user_id AS owner, contact_user_id AS contact, row_number() OVER (ORDER BY id) AS n
+                FROM contacts
+                WHERE user_id = ANY(%(owners)s) AND id %% 2 = 0 AND contact_user_id != user_id
+            ), created AS (
+                INSERT INTO chats (name, is_group, last_message_at)
+                SELECT 'Direct ' || owner || '-' || contact, false, LOCALTIMESTAMP - make_interval(mins => n::integer)
+                FROM pairs
+                RETURNING id, name
+            )
+            INSERT INTO chat_participants (chat_id, user_id)
+            SELECT c.id, member
+            FROM created c
+            JOIN pairs p ON c.name = 'Direct ' || p.owner || '-' || p.contact
+            CROSS JOIN LATERAL (VALUES (p.owner), (p.contact)) AS m(member)
+            ON CONFLICT (chat_id, user_id) DO NOTHING
+        """, {'owners': owner_ids})
+        for table in ('contacts', 'chats', 'chat_participants'):
+            cursor.execute(f'ANALYZE {table}')
+        print(f'gave {owners} users {contacts} contacts each: {time.perf_counter() - started:.1f}s')
+    conn.close()
+    return owner_ids
+
+
+def get_page(contacts: ModuleType, user_id: int, limit: int, cursor: Optional[int] = None) -> Dict[str, object]:
+    params = {'user_id': str(user_id), 'limit': str(limit)}
+    if cursor is not None:
+        params['cursor'] = str(cursor)
+    response = contacts.handler(event('GET', params), Context())
+    assert response['statusCode'] == 200, response
+    return json.loads(response['body'])
+
+
+def walk(contacts: ModuleType, user_id: int, limit: int) -> List[Dict[str, object]]:
+    '''Every page of the user's contacts, in order'''
+    pages = [get_page(contacts, user_id, limit)]
+    while pages[-1]['has_more']:
+        pages.append(get_page(contacts, user_id, limit, pages[-1]['next_cursor']))
+    return pages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--schema', default=SCHEMA)
+    parser.add_argument('--owners', type=int, default=20)
+    parser.add_argument('--contacts', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    dsn = with_search_path(os.environ['DATABASE_URL'], args.schema)
+    owner_ids = ensure_owners(dsn, args.owners, args.contacts)
+    contacts = load_handler('contacts', dsn)
+    chats = load_handler('chats', dsn)
+    owners = iter(owner_ids * (args.repeat * 100))
+
+    # Every contact exactly once across pages, and the direct chats found
+    pages = walk(contacts, owner_ids[0], 200)
+    rows = [row for page in pages for row in page['contacts']]
+    assert len({row['contact_id'] for row in rows}) == len(rows)
+    with_chat = sum(1 for row in rows if row['chat_id'] is not None)
+    print(f'user {owner_ids[0]}: {len(rows)} contacts in {len(pages)} pages of 200, {with_chat} with a direct chat')
+
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cursor:
+        def full_list() -> None:
+            cursor.execute(FULL_LIST_SQL, {'user_id': next(owners)})
+            cursor.fetchall()
+
+        print('before: whole list in one response, then the chat list for the direct chats')
+        print(f'{"full list query":22}{summary(timed(full_list, args.repeat))}')
+        response = chats.handler(event('GET', {'action': 'list', 'user_id': str(owner_ids[0])}), Context())
+        print(f'{"chat list":22}{summary(timed(lambda: chats.handler(event("GET", {"action": "list", "user_id": str(next(owners))}), Context()), args.repeat))}'
+              f'  {len(response["body"])} bytes')
+
+        for limit in (50, 200):
+            print(f'contacts GET, {limit} per page')
+            first = get_page(contacts, owner_ids[0], limit)
+            print(f'{"first page":22}{summary(timed(lambda: get_page(contacts, next(owners), limit), args.repeat))}'
+                  f'  {len(json.dumps(first))} bytes')
+            deep = {owner: walk(contacts, owner, limit)[-2]['next_cursor'] for owner in owner_ids}
+            deep_owners = iter(owner_ids * args.repeat)
+
+            def deep_page() -> None:
+                owner = next(deep_owners)
+                get_page(contacts, owner, limit, deep[owner])
+            print(f'{"last page":22}{summary(timed(deep_page, args.repeat))}')
+            print(f'{"every page":22}{summary(timed(lambda: walk(contacts, next(owners), limit), max(args.repeat // 10, 3)))}')
+
+            for label, cursor_id in (('first page', None), ('last page', deep[owner_ids[0]])):
+                sql = contacts.CONTACTS_NEXT_PAGE if cursor_id is not None else contacts.CONTACTS_FIRST_PAGE
+                cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql.sql}', {
+                    'user_id': owner_ids[0], 'online_ttl': 120, 'limit': limit + 1, 'cursor_id': cursor_id
+                })
+                plan = cursor.fetchone()[0][0]
+                print(f'{"":22}{label}: {plan["Execution Time"]:.2f}ms in the server, '
+                      f'{plan["Plan"]["Shared Hit Blocks"] + plan["Plan"]["Shared Read Blocks"]} buffers')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
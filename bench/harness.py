@@ -0,0 +1,280 @@
+'''
+Benchmark harness: every backend action against a seeded database.
+
+Imports each handler in-process and replays generated requests for every
+action (bench/seed.py builds the data), one phase per action plus a final
+weighted mix. Keys are skewed towards the busiest users and chats, like real
+traffic. Reports p50/p95/p99 latency, throughput and statements per request,
+and with --check fails when an action regressed against a stored baseline.
+
+    DATABASE_URL=postgresql://... python bench/seed.py --scale 1
+    DATABASE_URL=postgresql://... python bench/harness.py --save-baseline
+    DATABASE_URL=postgresql://... python bench/harness.py --check
+'''
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import psycopg2
+
+from common import count_queries, event, load_handler, percentile, with_search_path, Context, QueryCounter
+from seed import SCHEMA, group_size, member
+
+BASELINE_PATH = Path(__file__).resolve().parent / 'baseline.json'
+
+SEARCH_TERMS = ['ann', 'an', 'petrov', 'ivanva', 'maks', '9991234', '+7 (905) 00', 'anna petrova']
+
+PROFILE_LIST_FIELDS = 'username,full_name,avatar_url,status'
+
+
+class Data(NamedTuple):
+    users: int
+    chats: int
+    contact_owners: int
+
+
+class Action(NamedTuple):
+    name: str
+    function: str
+    weight: int
+    make: Callable[[random.Random, Data], Dict[str, Any]]
+
+
+def skewed(rng: random.Random, n: int) -> int:
+    '''1..n, with low values (the seed's busiest chats, earliest users) far more likely'''
+    return 1 + min(n - 1, int(n * rng.random() ** 3))
+
+
+def chat_member(rng: random.Random, data: Data) -> Tuple[int, int]:
+    chat = skewed(rng, data.chats)
+    return chat, member(chat, rng.randrange(group_size(chat)), data.users)
+
+
+def search_term(rng: random.Random, data: Data) -> str:
+    if rng.random() < 0.5:
+        return rng.choice(SEARCH_TERMS)
+    # Search-as-you-type: a prefix of some username
+    username = f'user_{skewed(rng, data.users)}'
+    return username[:rng.randint(3, len(username))]
+
+
+def chats_list(rng: random.Random, data: Data) -> Dict[str, Any]:
+    _, user_id = chat_member(rng, data)
+    return event('GET', {'action': 'list', 'user_id': str(user_id)})
+
+
+def chats_messages(rng: random.Random, data: Data) -> Dict[str, Any]:
+    chat_id, user_id = chat_member(rng, data)
+    return event('GET', {'action': 'messages', 'chat_id': str(chat_id), 'user_id': str(user_id)})
+
+
+def chats_sync(rng: random.Random, data: Data) -> Dict[str, Any]:
+    _, user_id = chat_member(rng, data)
+    return event('GET', {'action': 'sync', 'user_id': str(user_id)})
+
+
+def chats_send(rng: random.Random, data: Data) -> Dict[str, Any]:
+    chat_id, sender_id = chat_member(rng, data)
+    return event('POST', body={'action': 'send', 'chat_id': chat_id, 'sender_id': sender_id,
+                               'content': f'bench {rng.random()}'})
+
+
+def contacts_list(rng: random.Random, data: Data) -> Dict[str, Any]:
+    # seed.py gives contacts to users 2..contact_owners+1
+    return event('GET', {'user_id': str(1 + skewed(rng, data.contact_owners))})
+
+
+def profile_get(rng: random.Random, data: Data) -> Dict[str, Any]:
+    return event('GET', {'id': str(1 + skewed(rng, data.users))})
+
+
+def profile_multi_get(rng: random.Random, data: Data) -> Dict[str, Any]:
+    # Hydrating a group chat: every member of one group
+    chat = 10 * skewed(rng, max(1, data.chats // 10))
+    ids = ','.join(str(member(chat, k, data.users)) for k in range(group_size(chat)))
+    return event('GET', {'ids': ids, 'fields': PROFILE_LIST_FIELDS})
+
+
+def user_search(rng: random.Random, data: Data) -> Dict[str, Any]:
+    return event('GET', {'q': search_term(rng, data)})
+
+
+def signaling_offer(rng: random.Random, data: Data) -> Dict[str, Any]:
+    return event('POST', body={'type': 'offer', 'from': f'u{rng.randrange(1000)}', 'to': f'u{rng.randrange(1000)}',
+                               'data': {'type': 'offer', 'sdp': 'v=0' + 'x' * 2000}})
+
+
+def signaling_poll(rng: random.Random, data: Data) -> Dict[str, Any]:
+    return event('GET', {'userId': f'u{rng.randrange(1000)}'})
+
+
+def presence_heartbeat(rng: random.Random, data: Data) -> Dict[str, Any]:
+    return event('POST', body={'user_id': 1 + skewed(rng, data.users)})
+
+
+# name, function directory, weight in the mix, request builder
+ACTIONS = [
+    Action('chats.list', 'chats', 20, chats_list),
+    Action('chats.messages', 'chats', 25, chats_messages),
+    Action('chats.sync', 'chats', 10, chats_sync),
+    Action('chats.send', 'chats', 8, chats_send),
+    Action('contacts.list', 'contacts', 5, contacts_list),
+    Action('profile.get', 'profile', 10, profile_get),
+    Action('profile.multi_get', 'profile', 5, profile_multi_get),
+    Action('user_search', 'user-search', 8, user_search),
+    Action('signaling.offer', 'webrtc-signaling', 3, signaling_offer),
+    Action('signaling.poll', 'webrtc-signaling', 3, signaling_poll),
+    Action('presence.heartbeat', 'presence', 3, presence_heartbeat),
+]
+
+
+class Result(NamedTuple):
+    latencies: List[float]
+    queries: List[int]
+    errors: int
+    elapsed: float
+
+    def report(self) -> Dict[str, float]:
+        return {
+            'requests': len(self.latencies),
+            'p50': round(percentile(self.latencies, 50), 3),
+            'p95': round(percentile(self.latencies, 95), 3),
+            'p99': round(percentile(self.latencies, 99), 3),
+            'rps': round(len(self.latencies) / self.elapsed, 1),
+            'queries': round(statistics.fmean(self.queries), 2),
+            'errors': self.errors,
+        }
+
+
+def replay(requests: List[Tuple[Any, Dict[str, Any]]], concurrency: int, counter: QueryCounter) -> Result:
+    '''Run (module, event) pairs on concurrency threads'''
+    latencies: List[float] = []
+    queries: List[int] = []
+    errors = 0
+    lock = threading.Lock()
+    pending = iter(requests)
+
+    def worker() -> None:
+        nonlocal errors
+        for module, request in pending:
+            before = counter.value
+            started = time.perf_counter()
+            response = module.handler(request, Context())
+            latency = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(latency)
+                queries.append(counter.value - before)
+                errors += response['statusCode'] >= 400
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return Result(latencies, queries, errors, time.perf_counter() - started)
+
+
+def regressions(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+                tolerance: float) -> List[str]:
+    '''Actions slower (p95), less throughput or more statements per request than the baseline'''
+    found = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['p95'] > base['p95'] * (1 + tolerance):
+            found.append(f"{name}: p95 {result['p95']}ms vs baseline {base['p95']}ms")
+        if result['rps'] < base['rps'] * (1 - tolerance):
+            found.append(f"{name}: {result['rps']} req/s vs baseline {base['rps']} req/s")
+        if result['queries'] > base['queries'] + 0.01:
+            found.append(f"{name}: {result['queries']} queries/request vs baseline {base['queries']}")
+    return found
+
+
+def data_sizes(dsn: str) -> Data:
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT (SELECT MAX(id) FROM users), (SELECT MAX(id) FROM chats), (SELECT MAX(user_id) FROM contacts)')
+            max_user, max_chat, max_owner = cursor.fetchone()
+    finally:
+        conn.close()
+    if not max_chat:
+        raise SystemExit('bench schema is empty; run bench/seed.py first')
+    # seed.py numbers users from 2 (1 is the migrations' demo user)
+    return Data(users=max_user - 1, chats=max_chat, contact_owners=max(1, (max_owner or 2) - 1))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--schema', default=SCHEMA)
+    parser.add_argument('--requests', type=int, default=500, help='requests per action phase')
+    parser.add_argument('--mix-requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=50, help='unrecorded requests per phase')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--action', action='append', help='only these actions (repeatable)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true', help='exit 1 on regressions against the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed latency/throughput drift')
+    args = parser.parse_args()
+
+    dsn = with_search_path(os.environ['DATABASE_URL'], args.schema)
+    os.environ['DB_POOL_MAX_SIZE'] = str(args.concurrency)
+    os.environ.setdefault('SIGNALING_STORE', 'memory')
+    data = data_sizes(dsn)
+    actions = [action for action in ACTIONS if not args.action or action.name in args.action]
+
+    counter = QueryCounter()
+    modules: Dict[str, Any] = {}
+    for function in dict.fromkeys(action.function for action in actions):
+        modules[function] = load_handler(function, dsn)
+        count_queries(modules[function], counter)
+
+    rng = random.Random(args.seed)
+    results: Dict[str, Dict[str, float]] = {}
+    print(f'{data}, concurrency {args.concurrency}')
+    print(f"{'action':20} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>9} {'queries':>8} {'errors':>7}")
+
+    def phase(name: str, picks: Callable[[], Action], count: int) -> None:
+        requests = []
+        for _ in range(args.warmup + count):
+            action = picks()
+            requests.append((modules[action.function], action.make(rng, data)))
+        replay(requests[:args.warmup], args.concurrency, counter)
+        result = replay(requests[args.warmup:], args.concurrency, counter).report()
+        results[name] = result
+        print(f"{name:20} {result['p50']:8.2f}ms {result['p95']:8.2f}ms {result['p99']:8.2f}ms "
+              f"{result['rps']:9.1f} {result['queries']:8.2f} {result['errors']:7d}")
+
+    for action in actions:
+        phase(action.name, lambda action=action: action, args.requests)
+    weights = [action.weight for action in actions]
+    phase('mix', lambda: rng.choices(actions, weights)[0], args.mix_requests)
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + '\n')
+        print(f'baseline written to {args.baseline}')
+    if args.check:
+        baseline: Optional[Dict[str, Dict[str, float]]] = (
+            json.loads(args.baseline.read_text()) if args.baseline.exists() else None
+        )
+        if baseline is None:
+            raise SystemExit(f'no baseline at {args.baseline}; run with --save-baseline first')
+        found = regressions(results, baseline, args.tolerance)
+        for line in found:
+            print(f'REGRESSION {line}')
+        sys.exit(1 if found else 0)
+
+
+if __name__ == '__main__':
+    main()
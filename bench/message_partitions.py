@@ -0,0 +1,99 @@
+'''
+Benchmark: chat list and message pages on plain and month-partitioned messages.
+
+Needs two schemas seeded from the same data, one stopping before the
+partitioning migration and one with all migrations; at --scale 2 (100M
+messages over the past year) that is
+
+    DATABASE_URL=postgresql://... python bench/seed.py --schema bench_unpartitioned --until 13 --scale 2
+    DATABASE_URL=postgresql://... python bench/seed.py --schema bench --scale 2
+    DATABASE_URL=postgresql://... python bench/message_partitions.py
+
+backend/chats is loaded once per schema and each pair of requests is timed
+alternately. The pages are the newest one, one deep in the busiest chat's
+history (cursor a few months back) and a client's poll for messages after
+one it has (cursor near the newest). Ends with the size of each layout.
+'''
+import argparse
+import os
+from types import ModuleType
+from typing import Dict, List
+
+import psycopg2
+
+from common import event, load_handler, summary, timed, with_search_path, Context
+from seed import SCHEMA
+
+
+def requests_for(dsn: str) -> Dict[str, Dict[str, str]]:
+    '''The same requests for a schema, from the busiest chat and one of its members'''
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cursor:
+        cursor.execute('SELECT chat_id FROM messages GROUP BY chat_id ORDER BY COUNT(*) DESC LIMIT 1')
+        chat_id = cursor.fetchone()[0]
+        cursor.execute('SELECT user_id FROM chat_participants WHERE chat_id = %s ORDER BY user_id LIMIT 1', (chat_id,))
+        user_id = cursor.fetchone()[0]
+        cursor.execute("""
+            SELECT id FROM messages
+            WHERE chat_id = %s AND created_at < LOCALTIMESTAMP - INTERVAL '120 days'
+            ORDER BY created_at DESC, id DESC LIMIT 1
+        """, (chat_id,))
+        deep_id = cursor.fetchone()[0]
+        cursor.execute('SELECT id FROM messages WHERE chat_id = %s ORDER BY created_at DESC, id DESC OFFSET 20 LIMIT 1',
+                       (chat_id,))
+        recent_id = cursor.fetchone()[0]
+    conn.close()
+    messages = {'action': 'messages', 'chat_id': str(chat_id), 'user_id': str(user_id)}
+    return {
+        'list': {'action': 'list', 'user_id': str(user_id)},
+        'messages': messages,
+        'messages before': {**messages, 'before': str(deep_id)},
+        'messages after': {**messages, 'after': str(recent_id)},
+    }
+
+
+def layout(dsn: str) -> str:
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT COUNT(i.inhrelid), pg_size_pretty(
+                pg_total_relation_size('messages'::regclass) + COALESCE(SUM(pg_total_relation_size(i.inhrelid)), 0)
+            )
+            FROM pg_inherits i WHERE i.inhparent = 'messages'::regclass
+        """)
+        partitions, size = cursor.fetchone()
+    conn.close()
+    return f'{partitions} partitions, {size}' if partitions else f'one table, {size}'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--before-schema', default='bench_unpartitioned')
+    parser.add_argument('--after-schema', default=SCHEMA)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    dsns = {
+        'plain': with_search_path(os.environ['DATABASE_URL'], args.before_schema),
+        'partitioned': with_search_path(os.environ['DATABASE_URL'], args.after_schema),
+    }
+    requests = {mode: requests_for(dsn) for mode, dsn in dsns.items()}
+    assert requests['plain'] == requests['partitioned'], 'the schemas were seeded differently'
+    handlers: Dict[str, ModuleType] = {mode: load_handler('chats', dsn) for mode, dsn in dsns.items()}
+
+    print(f"chat {requests['plain']['messages']['chat_id']}, {args.repeat} runs, wall clock")
+    for label, params in requests['plain'].items():
+        samples: Dict[str, List[float]] = {mode: [] for mode in handlers}
+        for _ in range(args.repeat):
+            for mode, chats in handlers.items():
+                def request() -> None:
+                    response = chats.handler(event('GET', params), Context())
+                    assert response['statusCode'] == 200, response
+                samples[mode].extend(timed(request, 1))
+        for mode, ms in samples.items():
+            print(f'{label:16}{mode:13}{summary(ms)}')
+
+    for mode, dsn in dsns.items():
+        print(f'{mode:13}{layout(dsn)}')
+
+
+if __name__ == '__main__':
+    main()
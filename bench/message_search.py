@@ -0,0 +1,74 @@
+'''
+Benchmark: backend/chats action=search.
+
+Runs against the schema built by bench/seed.py; at --scale 1 that is 50M
+messages. The searching user is a member of the busiest chat, and the
+terms are taken from one of its messages so each selectivity is present:
+the message number (one hit), its run of letters (about one message in
+two thousand), a phrase of both, "message" (every message) and a word
+that is nowhere. Each is searched across all of the user's chats and
+within the busiest one, first page and the page after it.
+
+    DATABASE_URL=postgresql://... python bench/message_search.py
+'''
+import argparse
+import json
+import os
+from typing import Dict, Optional
+
+import psycopg2
+
+from common import event, load_handler, summary, timed, with_search_path, Context
+from seed import SCHEMA
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--schema', default=SCHEMA)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    dsn = with_search_path(os.environ['DATABASE_URL'], args.schema)
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cursor:
+        cursor.execute('SELECT chat_id FROM messages GROUP BY chat_id ORDER BY COUNT(*) DESC LIMIT 1')
+        chat_id = cursor.fetchone()[0]
+        cursor.execute('SELECT user_id FROM chat_participants WHERE chat_id = %s ORDER BY user_id LIMIT 1', (chat_id,))
+        user_id = cursor.fetchone()[0]
+        cursor.execute('SELECT content FROM messages WHERE chat_id = %s ORDER BY created_at DESC, id DESC OFFSET 1000 LIMIT 1',
+                       (chat_id,))
+        _, number, letters = cursor.fetchone()[0].split(' ')
+        cursor.execute("""
+            SELECT COUNT(*) FROM messages
+            WHERE chat_id IN (SELECT chat_id FROM chat_participants WHERE user_id = %s)
+        """, (user_id,))
+        in_scope = cursor.fetchone()[0]
+    conn.close()
+
+    chats = load_handler('chats', dsn)
+    terms = {
+        'number': number,
+        'letters': letters,
+        'phrase': f'"message {number}"',
+        'common word': 'message',
+        'no match': 'zebra',
+    }
+    print(f'user {user_id}: {in_scope} messages in their chats, busiest chat {chat_id}; '
+          f'{args.repeat} runs, wall clock')
+    for scope, scope_params in (('all chats', {}), ('one chat', {'chat_id': str(chat_id)})):
+        for label, q in terms.items():
+            params: Dict[str, str] = {'action': 'search', 'user_id': str(user_id), 'q': q, **scope_params}
+            body = json.loads(chats.handler(event('GET', params), Context())['body'])
+            pages = [('first page', params)]
+            next_cursor: Optional[str] = body['next_cursor']
+            if next_cursor is not None:
+                pages.append(('next page', {**params, 'cursor': next_cursor}))
+            for page, page_params in pages:
+                def request() -> None:
+                    response = chats.handler(event('GET', page_params), Context())
+                    assert response['statusCode'] == 200, response
+                results = len(json.loads(chats.handler(event('GET', page_params), Context())['body'])['results'])
+                print(f'{scope:10}{label:13}{page:12}{summary(timed(request, args.repeat))}  {results} results')
+
+
+if __name__ == '__main__':
+    main()
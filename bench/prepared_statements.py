@@ -0,0 +1,85 @@
+'''
+Benchmark: chat list and message pages with and without prepared statements.
+
+Runs against the schema built by bench/seed.py. backend/chats is loaded
+twice, once with DB_PREPARED_STATEMENTS=0 (every request sends its SQL to be
+parsed and planned) and once with the default registry (PREPARE once per
+connection, then EXECUTE), and each pair of requests is timed alternately
+so both see the same cache state. Ends with the server's generic/custom
+plan counts for the prepared statements.
+
+    DATABASE_URL=postgresql://... python bench/prepared_statements.py
+'''
+import argparse
+import os
+from types import ModuleType
+from typing import Dict, List
+
+import psycopg2
+
+from common import event, load_handler, summary, timed, with_search_path, Context
+from seed import SCHEMA
+
+
+def load_chats(dsn: str, prepared: bool) -> ModuleType:
+    os.environ['DB_PREPARED_STATEMENTS'] = '1' if prepared else '0'
+    try:
+        return load_handler('chats', dsn)
+    finally:
+        del os.environ['DB_PREPARED_STATEMENTS']
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--schema', default=SCHEMA)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    dsn = with_search_path(os.environ['DATABASE_URL'], args.schema)
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cursor:
+        # The busiest chat, one of its members, and a message halfway down its history
+        cursor.execute('SELECT chat_id FROM messages GROUP BY chat_id ORDER BY COUNT(*) DESC LIMIT 1')
+        chat_id = cursor.fetchone()[0]
+        cursor.execute('SELECT user_id FROM chat_participants WHERE chat_id = %s ORDER BY user_id LIMIT 1', (chat_id,))
+        user_id = cursor.fetchone()[0]
+        cursor.execute('SELECT id FROM messages WHERE chat_id = %s ORDER BY created_at DESC, id DESC OFFSET 1000 LIMIT 1', (chat_id,))
+        row = cursor.fetchone()
+        before_id = row[0] if row else None
+    conn.close()
+
+    requests: Dict[str, Dict[str, str]] = {
+        'list': {'action': 'list', 'user_id': str(user_id)},
+        'messages': {'action': 'messages', 'chat_id': str(chat_id), 'user_id': str(user_id)},
+    }
+    if before_id is not None:
+        requests['messages before'] = {**requests['messages'], 'before': str(before_id)}
+
+    handlers = {'unprepared': load_chats(dsn, False), 'prepared': load_chats(dsn, True)}
+    print(f'chat {chat_id}, user {user_id}, {args.repeat} runs, wall clock')
+    for label, params in requests.items():
+        samples: Dict[str, List[float]] = {mode: [] for mode in handlers}
+        for _ in range(args.repeat):
+            for mode, chats in handlers.items():
+                def request() -> None:
+                    response = chats.handler(event('GET', params), Context())
+                    assert response['statusCode'] == 200, response
+                samples[mode].extend(timed(request, 1))
+        for mode, ms in samples.items():
+            print(f'{label:16}{mode:12}{summary(ms)}')
+
+    chats = handlers['prepared']
+    pool = chats.get_pool()
+    conn = pool.getconn()
+    try:
+        plans = chats.statements.registry.plan_cache(conn)
+    finally:
+        pool.putconn(conn)
+    print('plan cache on one pooled connection')
+    for row in chats.statements.registry.stats():
+        if row['executions']:
+            print(f"  {row['name']:24} executions={row['executions']:5} prepares={row['prepares']:3} "
+                  f"{plans.get(row['name'], {})}")
+
+
+if __name__ == '__main__':
+    main()
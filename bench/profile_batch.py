@@ -0,0 +1,84 @@
+'''
+Benchmark: hydrating a list of profiles with one multi-get versus N lookups.
+
+Seeds bench_profile.users (same columns and indexes as public.users, run the
+migrations first) and, for several list sizes, times N single GET ?id=
+calls against one GET ?ids=...&fields=... call to backend/profile. The
+profile cache is disabled so both sides hit the database; in production
+every single lookup is also a separate HTTP round trip, which is not counted.
+
+    DATABASE_URL=postgresql://... python bench/profile_batch.py --users 100000
+'''
+import argparse
+import os
+import random
+
+import psycopg2
+
+from common import event, load_handler, summary, timed, with_search_path, Context
+
+SCHEMA = 'bench_profile'
+
+LIST_SIZES = [10, 50, 200]
+
+LIST_FIELDS = 'username,full_name,avatar_url,status'
+
+
+def seed(conn, users: int) -> None:
+    with conn.cursor() as cursor:
+        cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA}')
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {SCHEMA}.users (LIKE public.users INCLUDING ALL)')
+        cursor.execute(f'SELECT COUNT(*) FROM {SCHEMA}.users')
+        if cursor.fetchone()[0] == users:
+            return
+        cursor.execute(f'TRUNCATE {SCHEMA}.users')
+        cursor.execute(f"""
+            INSERT INTO {SCHEMA}.users (id, username, full_name, email, phone, unique_id, bio, status)
+            SELECT
+                i,
+                'user_' || i,
+                'User ' || i,
+                'user_' || i || '@example.com',
+                '+7 (9' || LPAD((i %% 100)::text, 2, '0') || ') ' || LPAD((i / 100)::text, 7, '0'),
+                SUBSTRING(MD5(i::text), 1, 16),
+                REPEAT('bio ', 50),
+                'offline'
+            FROM generate_series(1, %s) AS i
+        """, (users,))
+        cursor.execute(f'ANALYZE {SCHEMA}.users')
+    conn.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    dsn = with_search_path(os.environ['DATABASE_URL'], SCHEMA)
+    conn = psycopg2.connect(dsn)
+    seed(conn, args.users)
+    conn.close()
+    os.environ['PROFILE_CACHE_TTL'] = '0'
+    profile = load_handler('profile', dsn)
+
+    print(f'{args.users} users, {args.repeat} runs per list size')
+    for size in LIST_SIZES:
+        ids = random.sample(range(1, args.users + 1), size)
+
+        def single() -> None:
+            for user_id in ids:
+                response = profile.handler(event('GET', {'id': str(user_id)}), Context())
+                assert response['statusCode'] == 200, response
+
+        def batch() -> None:
+            params = {'ids': ','.join(map(str, ids)), 'fields': LIST_FIELDS}
+            response = profile.handler(event('GET', params), Context())
+            assert response['statusCode'] == 200, response
+
+        print(f'{size:4} profiles  {size:4} x single  {summary(timed(single, args.repeat))}')
+        print(f'{"":14}1 x multi-get  {summary(timed(batch, args.repeat))}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+'''
+Benchmark: reads routed to streaming replicas.
+
+Runs against the schema built by bench/seed.py on the primary
+(DATABASE_URL), read through the replicas in DATABASE_REPLICA_URLS. The
+primary's own DSN works as a stand-in replica, though it never lags; the
+paused-replay section needs a real replica and superuser on it. Prints:
+- GET latency against the primary and routed, and how reads spread
+- read-your-writes: a message is sent and its chat read right away,
+  without and with X-Read-After, counting reads that miss the message
+- send latency with and without the X-Db-Lsn lookup
+- replay paused on the first replica: reads that carry X-Read-After fall
+  back to the primary at once, plain reads once it is DB_REPLICA_MAX_LAG
+  behind
+- an unreachable replica next to the others: reads carry on without it
+
+    DATABASE_URL=postgresql://... DATABASE_REPLICA_URLS=postgresql://... python bench/replicas.py
+'''
+import argparse
+import json
+import os
+import time
+from types import ModuleType
+from typing import Any, Dict, List, Optional
+
+import psycopg2
+
+from common import event, load_handler, summary, timed, with_search_path, Context
+from seed import SCHEMA
+
+UNREACHABLE_DSN = 'postgresql://postgres@127.0.0.1:1/app?connect_timeout=1'
+
+
+def url_with_search_path(url: str, schema: str) -> str:
+    return f"{url}{'&' if '?' in url else '?'}options=-csearch_path%3D{schema}%2Cpublic"
+
+
+def load_chats(dsn: str, replicas: List[str], env: Optional[Dict[str, str]] = None) -> ModuleType:
+    env = {'DATABASE_REPLICA_URLS': ','.join(replicas), **(env or {})}
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        return load_handler('chats', dsn)
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                del os.environ[key]
+            else:
+                os.environ[key] = value
+
+
+def send(chats: ModuleType, chat_id: int, user_id: int, n: int) -> Dict[str, object]:
+    response = chats.handler(event('POST', body={
+        'action': 'send', 'chat_id': chat_id, 'sender_id': user_id, 'content': f'replica bench {n}'
+    }), Context())
+    assert response['statusCode'] == 200, response
+    return {'id': json.loads(response['body'])['data']['id'], 'lsn': response['headers'].get('X-Db-Lsn')}
+
+
+def newest_ids(chats: ModuleType, chat_id: int, user_id: int, read_after: Optional[str] = None) -> List[int]:
+    headers = {'X-Read-After': read_after} if read_after else {}
+    response = chats.handler(event('GET', {
+        'action': 'messages', 'chat_id': str(chat_id), 'user_id': str(user_id), 'limit': '5'
+    }, headers=headers), Context())
+    assert response['statusCode'] == 200, response
+    return [message['id'] for message in json.loads(response['body'])['messages']]
+
+
+def router(chats: ModuleType) -> Any:
+    '''The read router of the db module a handler was loaded with'''
+    return chats.get_read_pool.__globals__['get_router']()
+
+
+def counters(chats: ModuleType) -> Dict[str, object]:
+    stats = router(chats).stats()
+    return {key: value for key, value in stats.items() if key != 'replicas'}
+
+
+def read_your_writes(chats: ModuleType, chat_id: int, user_id: int, calls: int, with_header: bool) -> str:
+    missed = 0
+    for n in range(calls):
+        sent = send(chats, chat_id, user_id, n)
+        if sent['id'] not in newest_ids(chats, chat_id, user_id, sent['lsn'] if with_header else None):
+            missed += 1
+    return f'{missed} of {calls} reads missed the message just sent'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--schema', default=SCHEMA)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    dsn = with_search_path(os.environ['DATABASE_URL'], args.schema)
+    # Replicas stay URLs, as DATABASE_REPLICA_URLS is split on commas
+    replicas = [url_with_search_path(replica.strip(), args.schema)
+                for replica in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if replica.strip()]
+    assert replicas, 'DATABASE_REPLICA_URLS names no replica'
+
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cursor:
+        cursor.execute('SELECT chat_id, user_id FROM chat_participants ORDER BY chat_id, user_id LIMIT 1')
+        chat_id, user_id = cursor.fetchone()
+    conn.close()
+
+    direct = load_chats(dsn, [])
+    routed = load_chats(dsn, replicas)
+    print(f'{len(replicas)} replicas, {args.requests} GETs of the newest messages of chat {chat_id}')
+    for label, chats in (('primary', direct), ('routed', routed)):
+        samples = timed(lambda: newest_ids(chats, chat_id, user_id), args.requests)
+        print(f'{label:22}{summary(samples)}')
+    print(f'{"":22}{counters(routed)}')
+
+    print('send, then read the chat at once')
+    routed = load_chats(dsn, replicas)
+    print(f'{"without X-Read-After":22}{read_your_writes(routed, chat_id, user_id, args.requests, False)}')
+    routed = load_chats(dsn, replicas)
+    print(f'{"with X-Read-After":22}{read_your_writes(routed, chat_id, user_id, args.requests, True)}')
+    print(f'{"":22}{counters(routed)}')
+
+    # Interleaved, so both see the same table and WAL growth
+    sends: Dict[str, List[float]] = {'send, no replicas': [], 'send with X-Db-Lsn': []}
+    for n in range(args.requests):
+        for label, chats in zip(sends, (direct, routed)):
+            sends[label].extend(timed(lambda: send(chats, chat_id, user_id, n), 1))
+    for label, samples in sends.items():
+        print(f'{label:22}{summary(samples)}')
+
+    with psycopg2.connect(with_search_path(os.environ['DATABASE_REPLICA_URLS'].split(',')[0], args.schema)) as replica, replica.cursor() as cursor:
+        replica.autocommit = True
+        cursor.execute('SELECT pg_is_in_recovery()')
+        in_recovery = cursor.fetchone()[0]
+        if not in_recovery:
+            print('first replica is not in recovery, skipping paused replay')
+        else:
+            max_lag = 2
+            routed = load_chats(dsn, replicas, {'DB_REPLICA_MAX_LAG': str(max_lag), 'DB_REPLICA_CHECK_INTERVAL': '0.5'})
+            newest_ids(routed, chat_id, user_id)
+            cursor.execute('SELECT pg_wal_replay_pause()')
+            try:
+                sent = send(routed, chat_id, user_id, 0)
+                samples, missed = [], 0
+                for _ in range(args.requests):
+                    started = time.perf_counter()
+                    if sent['id'] not in newest_ids(routed, chat_id, user_id, sent['lsn']):
+                        missed += 1
+                    samples.append((time.perf_counter() - started) * 1000)
+                print(f'replay paused, reads with X-Read-After: {missed} missed the write')
+                print(f'{"":22}{summary(samples)}  {counters(routed)}')
+                # Past the lag limit the paused replica gets no reads at all
+                send(routed, chat_id, user_id, 1)
+                time.sleep(max_lag + 1)
+                before = counters(routed)
+                for _ in range(args.requests):
+                    newest_ids(routed, chat_id, user_id)
+                after = counters(routed)
+                print(f'replay paused {max_lag + 1}s, plain reads: '
+                      f'{after["replica_reads"] - before["replica_reads"]} on replicas, '
+                      f'{after["primary_reads"] - before["primary_reads"]} on the primary')
+                print(f'{"":22}{router(routed).stats()["replicas"][0]}')
+            finally:
+                cursor.execute('SELECT pg_wal_replay_resume()')
+    replica.close()
+
+    routed = load_chats(dsn, [UNREACHABLE_DSN] + replicas)
+    samples = timed(lambda: newest_ids(routed, chat_id, user_id), args.requests)
+    print(f'{"one replica down":22}{summary(samples)}')
+    print(f'{"":22}{counters(routed)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+'''
+Seed a benchmark schema: apply db_migrations, then load synthetic data.
+
+At --scale 1 that is 1M users, 100k chats (one in ten a group of 3-50
+members), 50M messages skewed towards the busiest tenth of the chats, and
+50 contacts for each of the first 10k users. Every table is created by the
+migrations themselves into the bench schema, so the benchmarks run against
+the same columns, indexes and triggers as production.
+
+Members and senders are a pure function of the chat id (see MEMBER_SQL),
+which lets the harness build realistic requests without reading the data.
+
+    DATABASE_URL=postgresql://... python bench/seed.py --scale 1
+'''
+import argparse
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import psycopg2
+
+from common import with_search_path
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / 'db_migrations'
+
+SCHEMA = 'bench'
+
+USERS = 1_000_000
+CHATS = 100_000
+MESSAGES = 50_000_000
+CONTACT_OWNERS = 10_000
+CONTACTS_PER_OWNER = 50
+MESSAGE_CHUNK = 1_000_000
+
+# Member k of chat c, a user id in 2..users+1 (id 1 is the migrations' demo
+# user). Direct chats have members 0 and 1, groups (c % 10 = 0) 3 + c % 48.
+# Written for parameterized statements, hence the doubled %%.
+MEMBER_SQL = '2 + (({chat}::bigint * 7919 + ({k})::bigint * 104729) %% {users})'
+GROUP_SIZE_SQL = 'CASE WHEN {chat} %% 10 = 0 THEN 3 + {chat} %% 48 ELSE 2 END'
+
+
+def member(chat: int, k: int, users: int) -> int:
+    '''Python twin of MEMBER_SQL'''
+    return 2 + (chat * 7919 + k * 104729) % users
+
+
+def group_size(chat: int) -> int:
+    '''Python twin of GROUP_SIZE_SQL'''
+    return 3 + chat % 48 if chat % 10 == 0 else 2
+
+
+def sizes(scale: float) -> Dict[str, int]:
+    return {
+        'users': max(100, int(USERS * scale)),
+        'chats': max(10, int(CHATS * scale)),
+        'messages': max(1000, int(MESSAGES * scale)),
+        'contact_owners': max(10, int(CONTACT_OWNERS * scale)),
+    }
+
+
+def step(label: str) -> Any:
+    '''Print a label now and its duration when the with-block ends'''
+    class Step:
+        def __enter__(self) -> None:
+            self.started = time.perf_counter()
+            print(f'{label} ...', end='', flush=True)
+
+        def __exit__(self, *exc: Any) -> None:
+            print(f' {time.perf_counter() - self.started:.1f}s', flush=True)
+    return Step()
+
+
+def migration_version(path: Path) -> int:
+    return int(path.name[1:].split('__')[0])
+
+
+def migrate(conn, until: Optional[int] = None) -> None:
+    '''Apply the migrations in order, or only those up to version until'''
+    with conn.cursor() as cursor:
+        for migration in sorted(MIGRATIONS_DIR.glob('V*__*.sql'), key=migration_version):
+            if until is not None and migration_version(migration) > until:
+                continue
+            with step(f'migration {migration.name}'):
+                cursor.execute(migration.read_text(encoding='utf-8'))
+    conn.commit()
+
+
+def seed(conn, counts: Dict[str, int]) -> None:
+    users, chats, messages = counts['users'], counts['chats'], counts['messages']
+    params = {'users': users, 'chats': chats}
+    with conn.cursor() as cursor:
+        with step(f'{users} users'):
+            cursor.execute("""
+                INSERT INTO users (username, full_name, email, phone, unique_id, bio, status, last_seen)
+                SELECT
+                    'user_' || i,
+                    (ARRAY['Анна', 'Максим', 'Ivan', 'Anna', 'Olga', 'Peter', 'Мария', 'Dmitry'])[1 + i %% 8]
+                        || ' ' ||
+                    (ARRAY['Petrova', 'Ivanov', 'Smirnov', 'Петров', 'Kuznetsova', 'Popov', 'Соколова'])[1 + (i / 8) %% 7],
+                    'user_' || i || '@example.com',
+                    '+7 (9' || LPAD((i %% 100)::text, 2, '0') || ') ' || LPAD((i / 100)::text, 7, '0'),
+                    SUBSTRING(ENCODE(SHA256(('79' || LPAD((i %% 100)::text, 2, '0') || LPAD((i / 100)::text, 7, '0'))::bytea), 'hex'), 1, 16),
+                    'Bio of user ' || i,
+                    'offline',
+                    LOCALTIMESTAMP - make_interval(secs => i %% 86400)
+                FROM generate_series(1, %(users)s) AS i
+            """, params)
+
+        with step(f'{chats} chats'):
+            cursor.execute("""
+                INSERT INTO chats (name, is_group)
+                SELECT CASE WHEN i %% 10 = 0 THEN 'Group ' || i ELSE 'Chat ' || i END, i %% 10 = 0
+                FROM generate_series(1, %(chats)s) AS i
+            """, params)
+            cursor.execute(f"""
+                INSERT INTO chat_participants (chat_id, user_id)
+                SELECT c.id, {MEMBER_SQL.format(chat='c.id', k='k', users='%(users)s')}
+                FROM chats c, generate_series(0, {GROUP_SIZE_SQL.format(chat='c.id')} - 1) AS k
+                ON CONFLICT (chat_id, user_id) DO NOTHING
+            """, params)
+            cursor.execute('SELECT MAX(id) FROM chats')
+            params['max_chat'] = cursor.fetchone()[0]
+        conn.commit()
+
+        # Messages span the past year; a partitioned table needs its months first
+        cursor.execute("SELECT to_regproc('ensure_message_partitions') IS NOT NULL")
+        if cursor.fetchone()[0]:
+            cursor.execute("SELECT ensure_message_partitions(3, (LOCALTIMESTAMP - INTERVAL '365 days')::date)")
+            conn.commit()
+
+        # The change_txid default stamps the same value the trigger would
+        cursor.execute('ALTER TABLE messages DISABLE TRIGGER trg_messages_change_txid')
+        for start in range(0, messages, MESSAGE_CHUNK):
+            end = min(messages, start + MESSAGE_CHUNK)
+            with step(f'messages {start}-{end} of {messages}'):
+                cursor.execute(f"""
+                    INSERT INTO messages (chat_id, sender_id, content, message_type, created_at)
+                    SELECT
+                        chat,
+                        {MEMBER_SQL.format(chat='chat', k=f"i %% ({GROUP_SIZE_SQL.format(chat='chat')})", users='%(users)s')},
+                        'Message ' || i || ' ' || REPEAT(CHR(97 + (i %% 26)::int), 10 + (i %% 80)::int),
+                        'text',
+                        LOCALTIMESTAMP - INTERVAL '365 days' + (i::float8 / %(messages)s) * INTERVAL '365 days'
+                    FROM (
+                        SELECT i, CASE WHEN i %% 2 = 0
+                            THEN 1 + (i * 2654435761) %% GREATEST(%(max_chat)s / 10, 1)
+                            ELSE 1 + (i * 2654435761) %% %(max_chat)s
+                        END AS chat
+                        FROM generate_series(%(start)s::bigint, %(end)s::bigint - 1) AS i
+                    ) s
+                """, {**params, 'messages': messages, 'start': start, 'end': end})
+            conn.commit()
+        cursor.execute('ALTER TABLE messages ENABLE TRIGGER trg_messages_change_txid')
+
+        with step('chat summaries and read watermarks'):
+            cursor.execute("""
+                UPDATE chats c SET
+                    last_message_id = l.id,
+                    last_message_preview = LEFT(l.content, 200),
+                    last_message_at = l.created_at
+                FROM chats c2
+                CROSS JOIN LATERAL (
+                    SELECT id, content, created_at FROM messages m
+                    WHERE m.chat_id = c2.id
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT 1
+                ) l
+                WHERE c.id = c2.id
+            """)
+            # One participant in five is behind by the chat's last 20 messages
+            cursor.execute("""
+                UPDATE chat_participants cp SET
+                    last_read_message_id = CASE WHEN cp.id % 5 = 0 THEN (
+                        SELECT MIN(id) FROM (
+                            SELECT id FROM messages m WHERE m.chat_id = cp.chat_id
+                            ORDER BY created_at DESC, id DESC LIMIT 20
+                        ) recent
+                    ) ELSE c.last_message_id END,
+                    unread_count = CASE WHEN cp.id % 5 = 0 THEN 19 ELSE 0 END
+                FROM chats c
+                WHERE c.id = cp.chat_id
+            """)
+        conn.commit()
+
+        with step(f"contacts for {counts['contact_owners']} users"):
+            cursor.execute(f"""
+                INSERT INTO contacts (user_id, contact_user_id, contact_name)
+                SELECT owner, {MEMBER_SQL.format(chat='owner', k='k + 1', users='%(users)s')}, 'Contact ' || k
+                FROM generate_series(2, %(owners)s + 1) AS owner, generate_series(1, %(per_owner)s) AS k
+                ON CONFLICT (user_id, contact_user_id) DO NOTHING
+            """, {**params, 'owners': counts['contact_owners'], 'per_owner': CONTACTS_PER_OWNER})
+        conn.commit()
+
+        with step('analyze'):
+            for table in ('users', 'chats', 'chat_participants', 'messages', 'contacts'):
+                cursor.execute(f'ANALYZE {table}')
+        conn.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--schema', default=SCHEMA)
+    parser.add_argument('--scale', type=float, default=1.0, help='1.0 = 1M users, 100k chats, 50M messages')
+    parser.add_argument('--reset', action='store_true', help='drop the schema first')
+    parser.add_argument('--until', type=int, metavar='VERSION',
+                        help='apply migrations only up to this version, to compare with an older schema')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(with_search_path(os.environ['DATABASE_URL'], args.schema))
+    with conn.cursor() as cursor:
+        if args.reset:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {args.schema} CASCADE')
+        cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {args.schema}')
+        cursor.execute('SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = %s', (args.schema,))
+        if cursor.fetchone()[0]:
+            raise SystemExit(f'schema {args.schema} is not empty; pass --reset to rebuild it')
+    conn.commit()
+
+    counts = sizes(args.scale)
+    migrate(conn, args.until)
+    seed(conn, counts)
+    conn.close()
+    print(f"seeded {args.schema}: {counts}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+'''
+Benchmark: CPU and payload of row serialization.
+
+Runs against the schema built by bench/seed.py. For message pages of several
+sizes it fetches and encodes the same rows three ways: RealDictCursor with
+dict(row) and json.dumps(default=str) as the handlers used to, the shared
+serialize module's tuple cursor with row objects, and its columnar format.
+Then it times backend/chats action=messages end to end in both formats.
+CPU time is this process only; the database's share is not counted.
+
+    DATABASE_URL=postgresql://... python bench/serialization.py
+'''
+import argparse
+import json
+import os
+import time
+from typing import Any, Callable, List, Tuple
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from common import event, load_handler, percentile, summary, timed, with_search_path, Context
+from seed import SCHEMA
+
+PAGE_SIZES = [50, 200, 1000, 5000]
+
+MESSAGES_QUERY = """
+    SELECT
+        m.id, m.content, m.message_type, m.created_at,
+        m.sender_id, u.full_name as sender_name, u.avatar_url as sender_avatar
+    FROM messages m
+    INNER JOIN users u ON m.sender_id = u.id
+    WHERE m.chat_id = %s
+    ORDER BY m.created_at DESC, m.id DESC
+    LIMIT %s
+"""
+
+
+def cpu_timed(fn: Callable[[], Any], repeat: int) -> Tuple[List[float], Any]:
+    '''CPU milliseconds of this process for each of repeat calls, and the last result'''
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.process_time()
+        result = fn()
+        samples.append((time.process_time() - started) * 1000)
+    return samples, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--schema', default=SCHEMA)
+    parser.add_argument('--chat', type=int, help='chat to read (default: the one with most messages)')
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    dsn = with_search_path(os.environ['DATABASE_URL'], args.schema)
+    chats = load_handler('chats', dsn)
+    serialize = chats.serialize
+    conn = psycopg2.connect(dsn)
+    if args.chat is None:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT chat_id FROM messages GROUP BY chat_id ORDER BY COUNT(*) DESC LIMIT 1')
+            args.chat = cursor.fetchone()[0]
+
+    def legacy(size: int) -> str:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(MESSAGES_QUERY, (args.chat, size))
+            return json.dumps([dict(row) for row in cursor.fetchall()], default=str)
+
+    def shared(size: int, columnar: bool) -> str:
+        with serialize.cursor(conn) as cursor:
+            cursor.execute(MESSAGES_QUERY, (args.chat, size))
+            rows = cursor.fetchall()
+            return json.dumps(serialize.table(serialize.columns(cursor), rows, columnar))
+
+    print(f'chat {args.chat}, {args.repeat} runs, CPU per request')
+    for size in PAGE_SIZES:
+        base_cpu, base_body = cpu_timed(lambda: legacy(size), args.repeat)
+        print(f'{size:5} rows  legacy    {summary(base_cpu)}  {len(base_body):9} bytes')
+        for label, columnar in (('objects', False), ('columnar', True)):
+            cpu, body = cpu_timed(lambda: shared(size, columnar), args.repeat)
+            if not columnar:
+                assert json.loads(body) == json.loads(base_body), 'row objects differ from the legacy encoding'
+            print(f'{"":11}{label:10}{summary(cpu)}  {len(body):9} bytes  '
+                  f'cpu x{percentile(base_cpu, 50) / max(percentile(cpu, 50), 1e-6):.2f}  '
+                  f'size {len(body) / len(base_body):.0%}')
+    conn.close()
+
+    print('backend/chats action=messages, wall clock')
+    for size in (50, 200):
+        for label, extra in (('objects', {}), ('columnar', {'format': 'columnar'})):
+            params = {'action': 'messages', 'chat_id': str(args.chat), 'user_id': '2', 'limit': str(size), **extra}
+
+            def request() -> None:
+                response = chats.handler(event('GET', params), Context())
+                assert response['statusCode'] == 200, response
+
+            print(f'{size:5} rows  {label:10}{summary(timed(request, args.repeat))}')
+
+
+if __name__ == '__main__':
+    main()
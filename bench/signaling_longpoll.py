@@ -0,0 +1,116 @@
+'''
+Load test: signaling call setup with tight polling versus long-polling.
+
+Simulates calls against the in-process webrtc-signaling handler. The caller
+posts an offer and ICE candidates, the callee answers with its own, and both
+sides fetch their queue either with a fixed-interval GET loop or with
+GET ?wait=. Reports handler invocations per call and setup latency (start
+until both sides have everything they need).
+
+    SIGNALING_STORE=memory python bench/signaling_longpoll.py --calls 200
+'''
+import argparse
+import json
+import threading
+import time
+from typing import Any, Dict, List
+
+from common import event, load_handler, percentile, Context
+
+CANDIDATES = 8
+
+
+class Counter:
+    def __init__(self) -> None:
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, n: int = 1) -> None:
+        with self._lock:
+            self.value += n
+
+
+def run_call(signaling: Any, call: int, mode: str, interval: float, candidate_gap: float,
+             posts: Counter, polls: Counter) -> float:
+    caller, callee, room = f'caller-{call}', f'callee-{call}', f'room-{call}'
+
+    def post(message: Dict[str, Any]) -> None:
+        posts.add()
+        signaling.handler(event('POST', body={'roomId': room, **message}), Context())
+
+    def receive(user: str, received: List[Dict[str, Any]], expected: int) -> None:
+        # Queued candidates come back merged into ice-candidates entries
+        def count() -> int:
+            return sum(len(m['data']) if m['type'] == 'ice-candidates' else 1 for m in received)
+
+        while count() < expected:
+            params = {'userId': user}
+            if mode == 'long-poll':
+                params['wait'] = '25'
+            polls.add()
+            response = signaling.handler(event('GET', params), Context())
+            received.extend(json.loads(response['body'])['messages'])
+            if mode == 'poll' and count() < expected:
+                time.sleep(interval)
+
+    def send_candidates(sender: str, receiver: str) -> None:
+        for index in range(CANDIDATES):
+            time.sleep(candidate_gap)
+            post({'type': 'ice-candidate', 'from': sender, 'to': receiver, 'data': {'candidate': index}})
+
+    def callee_side() -> None:
+        received: List[Dict[str, Any]] = []
+        receive(callee, received, 1)
+        post({'type': 'answer', 'from': callee, 'to': caller, 'data': {'sdp': 'answer'}})
+        candidates = threading.Thread(target=send_candidates, args=(callee, caller))
+        candidates.start()
+        receive(callee, received, 1 + CANDIDATES)
+        candidates.join()
+
+    started = time.perf_counter()
+    callee_thread = threading.Thread(target=callee_side)
+    callee_thread.start()
+    post({'type': 'join', 'from': caller, 'to': ''})
+    post({'type': 'offer', 'from': caller, 'to': callee, 'data': {'sdp': 'offer'}})
+    send_candidates(caller, callee)
+    receive(caller, [], 1 + CANDIDATES)
+    callee_thread.join()
+    return (time.perf_counter() - started) * 1000
+
+
+def run(mode: str, calls: int, concurrency: int, interval: float, candidate_gap: float) -> None:
+    signaling = load_handler('webrtc-signaling')
+    posts, polls = Counter(), Counter()
+    latencies: List[float] = []
+    lock = threading.Lock()
+    next_call = iter(range(calls))
+
+    def worker() -> None:
+        for call in next_call:
+            latency = run_call(signaling, call, mode, interval, candidate_gap, posts, polls)
+            with lock:
+                latencies.append(latency)
+
+    workers = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    print(f'{mode:10} invocations/call={(posts.value + polls.value) / calls:6.1f} '
+          f'(GET {polls.value / calls:5.1f})  '
+          f'setup p50={percentile(latencies, 50):7.1f}ms  p95={percentile(latencies, 95):7.1f}ms')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.25, help='tight-poll interval, seconds')
+    parser.add_argument('--candidate-gap', type=float, default=0.01, help='delay between ICE candidates, seconds')
+    args = parser.parse_args()
+    for mode in ('poll', 'long-poll'):
+        run(mode, args.calls, args.concurrency, args.interval, args.candidate_gap)
+
+
+if __name__ == '__main__':
+    main()
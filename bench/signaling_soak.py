@@ -0,0 +1,78 @@
+'''
+Soak test: signaling memory stays flat across many abandoned calls.
+
+Drives simulated calls through the in-process webrtc-signaling handler with
+the memory store and short TTLs. Half of the callees never poll, no caller
+ever polls, and only one side leaves. Samples traced memory and the store
+gauges as it goes and exits non-zero if memory after warm-up grows beyond
+the tolerance. Without expiry every abandoned call leaves its room and queue
+behind, about 7 KiB per call with these payloads (run with --ttl 1e6).
+
+    python bench/signaling_soak.py --calls 100000
+'''
+import argparse
+import os
+import statistics
+import sys
+import tracemalloc
+
+from common import event, load_handler, Context
+
+CANDIDATES = 4
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=100_000)
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--ttl', type=float, default=0.2, help='message TTL, seconds; rooms get 2.5x')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed growth after warm-up')
+    args = parser.parse_args()
+
+    os.environ['SIGNALING_STORE'] = 'memory'
+    os.environ['SIGNALING_MESSAGE_TTL'] = str(args.ttl)
+    os.environ['SIGNALING_ROOM_TTL'] = str(args.ttl * 2.5)
+    os.environ['SIGNALING_STATS_INTERVAL'] = '1e9'
+    signaling = load_handler('webrtc-signaling')
+    context = Context()
+
+    def post(room: str, message_type: str, sender: str, receiver: str = '') -> None:
+        signaling.handler(event('POST', body={'type': message_type, 'from': sender, 'to': receiver,
+                                              'roomId': room, 'data': {'sdp': 'x' * 200}}), context)
+
+    tracemalloc.start()
+    sample_every = max(1, args.calls // args.samples)
+    samples = []
+    for call in range(args.calls):
+        room, caller, callee = f'room-{call}', f'caller-{call}', f'callee-{call}'
+        post(room, 'join', caller)
+        post(room, 'join', callee)
+        post(room, 'offer', caller, callee)
+        for _ in range(CANDIDATES):
+            post(room, 'ice-candidate', caller, callee)
+        if call % 2 == 0:
+            signaling.handler(event('GET', {'userId': callee}), context)
+            post(room, 'answer', callee, caller)
+            for _ in range(CANDIDATES):
+                post(room, 'ice-candidate', callee, caller)
+        post(room, 'leave', caller)
+
+        if (call + 1) % sample_every == 0:
+            current, _ = tracemalloc.get_traced_memory()
+            samples.append(current)
+            print(f'{call + 1:8} calls  traced={current / 1024:9.1f}KiB  {signaling.store.stats()}')
+
+    tracemalloc.stop()
+    # The live population fluctuates with throughput, so compare the halves of
+    # the post-warm-up run; a leak grows with the number of calls
+    warm = samples[len(samples) // 5:]
+    half = len(warm) // 2
+    earlier, later = statistics.fmean(warm[:half]), statistics.fmean(warm[half:])
+    growth = (later - earlier) / earlier
+    print(f'growth after warm-up: {growth:+.1%} (tolerance {args.tolerance:.0%})')
+    if growth > args.tolerance:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+'''
+Benchmark: ranked user search on a synthetic table of a million users.
+
+Seeds bench_user_search.users (same columns and indexes as public.users, run
+the migrations first) and times the legacy ILIKE/LIKE scan against the
+backend/user-search handler for a mix of search-as-you-type terms. The search
+cache is disabled so every ranked run hits the database.
+
+    DATABASE_URL=postgresql://... python bench/user_search.py --users 1000000
+'''
+import argparse
+import os
+
+import psycopg2
+
+from common import event, load_handler, summary, timed, with_search_path, Context
+
+SCHEMA = 'bench_user_search'
+
+LEGACY_QUERY = """
+    SELECT id, unique_id, username, full_name, phone, avatar_url, status
+    FROM users
+    WHERE username ILIKE %(contains)s
+       OR phone LIKE %(contains)s
+    LIMIT 20
+"""
+
+TERMS = ['user_4242', 'user_42', 'ann', 'an', 'petrov', 'ivanva', '9991234', '+7 (999) 00']
+
+
+def seed(conn, users: int) -> None:
+    with conn.cursor() as cursor:
+        cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA}')
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {SCHEMA}.users (LIKE public.users INCLUDING ALL)')
+        cursor.execute(f'SELECT COUNT(*) FROM {SCHEMA}.users')
+        if cursor.fetchone()[0] == users:
+            return
+        cursor.execute(f'TRUNCATE {SCHEMA}.users')
+        cursor.execute(f"""
+            INSERT INTO {SCHEMA}.users (id, username, full_name, email, phone, unique_id, status)
+            SELECT 
+                i,
+                'user_' || i,
+                (ARRAY['Анна', 'Максим', 'Ivan', 'Anna', 'Olga', 'Peter', 'Мария', 'Dmitry'])[1 + i %% 8]
+                    || ' ' ||
+                (ARRAY['Petrova', 'Ivanov', 'Smirnov', 'Петров', 'Kuznetsova', 'Popov', 'Соколова'])[1 + (i / 8) %% 7],
+                'user_' || i || '@example.com',
+                '+7 (9' || LPAD((i %% 100)::text, 2, '0') || ') ' || LPAD((i / 100)::text, 7, '0'),
+                SUBSTRING(MD5(i::text), 1, 16),
+                'offline'
+            FROM generate_series(1, %s) AS i
+        """, (users,))
+        cursor.execute(f'ANALYZE {SCHEMA}.users')
+    conn.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    dsn = with_search_path(os.environ['DATABASE_URL'], SCHEMA)
+    conn = psycopg2.connect(dsn)
+    seed(conn, args.users)
+    os.environ['SEARCH_CACHE_TTL'] = '0'
+    search = load_handler('user-search', dsn)
+
+    print(f'{args.users} users, {args.repeat} runs per term')
+    for term in TERMS:
+        def legacy() -> None:
+            with conn.cursor() as cursor:
+                cursor.execute(LEGACY_QUERY, {'contains': f'%{term}%'})
+                cursor.fetchall()
+
+        def ranked() -> None:
+            response = search.handler(event('GET', {'q': term}), Context())
+            assert response['statusCode'] == 200, response
+
+        print(f'{term!r:16} legacy  {summary(timed(legacy, args.repeat))}')
+        print(f'{"":16} ranked  {summary(timed(ranked, args.repeat))}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+-- Composite index backing keyset pagination of chat history:
+-- WHERE chat_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_messages_chat_created_id ON messages(chat_id, created_at, id);
+
+-- The single-column chat_id index is a prefix of the new one
+DROP INDEX IF EXISTS idx_messages_chat_id;
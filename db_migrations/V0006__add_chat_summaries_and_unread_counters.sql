@@ -0,0 +1,33 @@
+-- Denormalized last-message summary per chat, maintained by chats action=send
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_id INTEGER;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_preview VARCHAR(200);
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP;
+
+-- Per-participant unread counter
+ALTER TABLE chat_participants ADD COLUMN IF NOT EXISTS unread_count INTEGER NOT NULL DEFAULT 0;
+
+-- Backfill summaries from the latest message of each chat
+UPDATE chats c SET
+    last_message_id = lm.id,
+    last_message_preview = LEFT(lm.content, 200),
+    last_message_at = lm.created_at
+FROM (
+    SELECT DISTINCT ON (chat_id) id, chat_id, content, created_at
+    FROM messages
+    ORDER BY chat_id, created_at DESC, id DESC
+) lm
+WHERE c.id = lm.chat_id;
+
+-- Backfill unread counters: unread messages sent by someone else
+UPDATE chat_participants cp SET unread_count = uc.unread_count
+FROM (
+    SELECT p.id, COUNT(m.id) AS unread_count
+    FROM chat_participants p
+    JOIN messages m ON m.chat_id = p.chat_id AND m.is_read = false AND m.sender_id != p.user_id
+    GROUP BY p.id
+) uc
+WHERE cp.id = uc.id;
+
+-- Chat list lookup: participant rows of a user, then chats by primary key
+CREATE INDEX IF NOT EXISTS idx_chat_participants_user_chat ON chat_participants(user_id, chat_id);
+DROP INDEX IF EXISTS idx_chat_participants_user;
@@ -0,0 +1,32 @@
+-- Change tracking for delta sync (chats action=sync).
+-- Every insert/update stamps the writing transaction id; a sync token is a
+-- transaction snapshot xmin, so "changed since token" is change_txid >= token.
+CREATE OR REPLACE FUNCTION stamp_change_txid() RETURNS trigger AS $$
+BEGIN
+    NEW.change_txid := txid_current();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS change_txid BIGINT NOT NULL DEFAULT txid_current();
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS change_txid BIGINT NOT NULL DEFAULT txid_current();
+ALTER TABLE chat_participants ADD COLUMN IF NOT EXISTS change_txid BIGINT NOT NULL DEFAULT txid_current();
+
+DROP TRIGGER IF EXISTS trg_chats_change_txid ON chats;
+CREATE TRIGGER trg_chats_change_txid
+    BEFORE INSERT OR UPDATE ON chats
+    FOR EACH ROW EXECUTE FUNCTION stamp_change_txid();
+
+DROP TRIGGER IF EXISTS trg_messages_change_txid ON messages;
+CREATE TRIGGER trg_messages_change_txid
+    BEFORE INSERT OR UPDATE ON messages
+    FOR EACH ROW EXECUTE FUNCTION stamp_change_txid();
+
+DROP TRIGGER IF EXISTS trg_chat_participants_change_txid ON chat_participants;
+CREATE TRIGGER trg_chat_participants_change_txid
+    BEFORE INSERT OR UPDATE ON chat_participants
+    FOR EACH ROW EXECUTE FUNCTION stamp_change_txid();
+
+-- Message deltas are read per chat in (change_txid, id) order
+CREATE INDEX IF NOT EXISTS idx_messages_chat_change ON messages(chat_id, change_txid, id);
+CREATE INDEX IF NOT EXISTS idx_chat_participants_chat_change ON chat_participants(chat_id, change_txid);
@@ -0,0 +1,4 @@
+-- Client-generated message id: makes retried chats action=send_batch idempotent
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS client_id VARCHAR(64);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_sender_client_id ON messages(sender_id, client_id);
@@ -0,0 +1,23 @@
+-- Per-participant read watermark: everything up to this message id has been read
+ALTER TABLE chat_participants ADD COLUMN IF NOT EXISTS last_read_message_id INTEGER;
+
+-- Convert per-message is_read flags: the watermark is the newest message from
+-- someone else that was marked read
+UPDATE chat_participants cp SET last_read_message_id = r.last_read_message_id
+FROM (
+    SELECT p.id, MAX(m.id) AS last_read_message_id
+    FROM chat_participants p
+    JOIN messages m ON m.chat_id = p.chat_id AND m.sender_id != p.user_id AND m.is_read = true
+    GROUP BY p.id
+) r
+WHERE cp.id = r.id;
+
+-- Recompute unread counters relative to the watermark
+UPDATE chat_participants cp SET unread_count = COALESCE((
+    SELECT COUNT(*) FROM messages m
+    WHERE m.chat_id = cp.chat_id
+      AND m.sender_id != cp.user_id
+      AND m.id > COALESCE(cp.last_read_message_id, 0)
+), 0);
+
+ALTER TABLE messages DROP COLUMN IF EXISTS is_read;
@@ -0,0 +1,17 @@
+-- Indexes for ranked user search (backend/user-search)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Substring and similarity matching on names
+CREATE INDEX IF NOT EXISTS idx_users_username_trgm ON users USING GIN (username gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_users_full_name_trgm ON users USING GIN (full_name gin_trgm_ops);
+
+-- Prefix matching for one- and two-letter terms
+CREATE INDEX IF NOT EXISTS idx_users_username_lower_prefix ON users (lower(username) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_full_name_lower_prefix ON users (lower(full_name) text_pattern_ops);
+
+-- Digits-only phone so "+7 (999) 123" and "7999123" find the same user
+ALTER TABLE users ADD COLUMN IF NOT EXISTS phone_digits VARCHAR(20)
+    GENERATED ALWAYS AS (REGEXP_REPLACE(phone, '[^0-9]', '', 'g')) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_users_phone_digits ON users (phone_digits text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_phone_digits_trgm ON users USING GIN (phone_digits gin_trgm_ops);
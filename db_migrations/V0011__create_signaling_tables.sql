@@ -0,0 +1,18 @@
+-- Shared state for backend/webrtc-signaling with SIGNALING_STORE=postgres.
+-- Signaling data is short-lived and re-sent by clients on failure, so the
+-- tables are UNLOGGED to keep WAL out of the call-setup path.
+CREATE UNLOGGED TABLE IF NOT EXISTS signaling_rooms (
+    room_id VARCHAR(100) NOT NULL,
+    user_id VARCHAR(100) NOT NULL,
+    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (room_id, user_id)
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS signaling_queue (
+    id BIGSERIAL PRIMARY KEY,
+    user_id VARCHAR(100) NOT NULL,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_signaling_queue_user ON signaling_queue(user_id, id);
@@ -0,0 +1,4 @@
+-- Periodic sweeps in backend/webrtc-signaling delete expired queue entries
+-- and rooms nobody joined recently
+CREATE INDEX IF NOT EXISTS idx_signaling_queue_created_at ON signaling_queue(created_at);
+CREATE INDEX IF NOT EXISTS idx_signaling_rooms_joined_at ON signaling_rooms(joined_at);
@@ -0,0 +1,10 @@
+-- Nearest-first candidates for ranked user search (backend/user-search):
+-- results within a rank are ordered by similarity to this one document, so
+-- each page is read in order from its GiST index instead of scoring every
+-- row that matches a short or common term
+ALTER TABLE users ADD COLUMN IF NOT EXISTS search_text TEXT
+    GENERATED ALWAYS AS (
+        username || ' ' || full_name || ' ' || COALESCE(REGEXP_REPLACE(phone, '[^0-9]', '', 'g'), '')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_users_search_text_trgm_gist ON users USING GIST (search_text gist_trgm_ops);
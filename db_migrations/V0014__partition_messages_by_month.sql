@@ -0,0 +1,139 @@
+-- Range-partition messages by month of created_at. Indexes become local to a
+-- partition, so vacuum, index bloat and cold history are per month, and reads
+-- bounded in time skip the partitions outside the bound.
+-- backend/chats keeps partitions created a few months ahead with
+-- ensure_message_partitions(); archive_message_partitions() detaches old months
+-- into stand-alone messages_archive_YYYY_MM tables. There is no default
+-- partition: it would stop the planner from reading partitions in order.
+
+-- Monthly partitions from from_month (default: the current month) through
+-- months_ahead months from now; returns how many were created
+CREATE OR REPLACE FUNCTION ensure_message_partitions(months_ahead INTEGER DEFAULT 3, from_month DATE DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    parent REGCLASS := 'messages'::regclass;
+    parent_schema TEXT;
+    month DATE := date_trunc('month', COALESCE(from_month, LOCALTIMESTAMP::date))::date;
+    last_month DATE := (date_trunc('month', LOCALTIMESTAMP) + make_interval(months => months_ahead))::date;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    SELECT n.nspname INTO parent_schema
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.oid = parent;
+    WHILE month <= last_month LOOP
+        partition_name := 'messages_' || to_char(month, 'YYYY_MM');
+        IF to_regclass(format('%I.%I', parent_schema, partition_name)) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I.%I PARTITION OF %s FOR VALUES FROM (%L) TO (%L)',
+                parent_schema, partition_name, parent, month, (month + INTERVAL '1 month')::date);
+            created := created + 1;
+        END IF;
+        month := (month + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql SET lock_timeout = '2s';
+
+-- Detach the monthly partitions older than the current month minus keep_months,
+-- renamed to messages_archive_YYYY_MM, and forget their send_batch client ids;
+-- returns how many were archived
+CREATE OR REPLACE FUNCTION archive_message_partitions(keep_months INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    parent REGCLASS := 'messages'::regclass;
+    boundary DATE := (date_trunc('month', LOCALTIMESTAMP) - make_interval(months => keep_months))::date;
+    partition_schema TEXT;
+    partition_name TEXT;
+    archived INTEGER := 0;
+BEGIN
+    FOR partition_schema, partition_name IN
+        SELECT n.nspname, c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE i.inhparent = parent
+          AND c.relname ~ '^messages_[0-9]{4}_[0-9]{2}$'
+          AND to_date(substr(c.relname, 10), 'YYYY_MM') < boundary
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE %s DETACH PARTITION %I.%I', parent, partition_schema, partition_name);
+        EXECUTE format('ALTER TABLE %I.%I RENAME TO %I', partition_schema, partition_name,
+            'messages_archive_' || substr(partition_name, 10));
+        archived := archived + 1;
+    END LOOP;
+    DELETE FROM message_client_ids WHERE created_at < boundary;
+    RETURN archived;
+END;
+$$ LANGUAGE plpgsql SET lock_timeout = '2s';
+
+-- A unique index on a partitioned table has to include created_at, which would
+-- not catch a retried batch; send_batch claims (sender_id, client_id) here
+CREATE TABLE IF NOT EXISTS message_client_ids (
+    sender_id INTEGER NOT NULL,
+    client_id VARCHAR(64) NOT NULL,
+    message_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (sender_id, client_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_message_client_ids_created_at ON message_client_ids(created_at);
+
+-- Convert the plain table once: rename it away, create the partitioned table
+-- with the same columns and sequence, copy the rows and drop the old table
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'messages'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    ALTER SEQUENCE messages_id_seq OWNED BY NONE;
+    ALTER TABLE messages RENAME TO messages_unpartitioned;
+    DROP TRIGGER IF EXISTS trg_messages_change_txid ON messages_unpartitioned;
+    -- Frees the constraint and index names for the partitioned table
+    ALTER TABLE messages_unpartitioned
+        DROP CONSTRAINT IF EXISTS messages_pkey,
+        DROP CONSTRAINT IF EXISTS messages_chat_id_fkey,
+        DROP CONSTRAINT IF EXISTS messages_sender_id_fkey,
+        ALTER COLUMN id DROP NOT NULL,
+        ALTER COLUMN content DROP NOT NULL,
+        ALTER COLUMN change_txid DROP NOT NULL;
+    DROP INDEX IF EXISTS idx_messages_created_at;
+    DROP INDEX IF EXISTS idx_messages_chat_created_id;
+    DROP INDEX IF EXISTS idx_messages_chat_change;
+    DROP INDEX IF EXISTS idx_messages_sender_client_id;
+
+    CREATE TABLE messages (
+        id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+        chat_id INTEGER REFERENCES chats(id),
+        sender_id INTEGER REFERENCES users(id),
+        content TEXT NOT NULL,
+        message_type VARCHAR(20) DEFAULT 'text',
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        change_txid BIGINT NOT NULL DEFAULT txid_current(),
+        client_id VARCHAR(64),
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+    ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+
+    PERFORM ensure_message_partitions(3, (SELECT MIN(created_at)::date FROM messages_unpartitioned));
+    INSERT INTO messages (id, chat_id, sender_id, content, message_type, created_at, change_txid, client_id)
+    SELECT id, chat_id, sender_id, content, message_type, COALESCE(created_at, LOCALTIMESTAMP), change_txid, client_id
+    FROM messages_unpartitioned;
+
+    INSERT INTO message_client_ids (sender_id, client_id, message_id, created_at)
+    SELECT sender_id, client_id, id, COALESCE(created_at, LOCALTIMESTAMP)
+    FROM messages_unpartitioned
+    WHERE sender_id IS NOT NULL AND client_id IS NOT NULL
+    ON CONFLICT DO NOTHING;
+
+    DROP TABLE messages_unpartitioned;
+END $$;
+
+-- Keyset pagination of chat history and per-chat delta sync, now per partition
+CREATE INDEX IF NOT EXISTS idx_messages_chat_created_id ON messages(chat_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_messages_chat_change ON messages(chat_id, change_txid, id);
+
+DROP TRIGGER IF EXISTS trg_messages_change_txid ON messages;
+CREATE TRIGGER trg_messages_change_txid
+    BEFORE INSERT OR UPDATE ON messages
+    FOR EACH ROW EXECUTE FUNCTION stamp_change_txid();
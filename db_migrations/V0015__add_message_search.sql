@@ -0,0 +1,13 @@
+-- Full-text search over message content (backend/chats action=search).
+-- The russian configuration stems Cyrillic words with the Russian snowball
+-- stemmer and ASCII words with the English one, with both stop-word lists,
+-- so one vector serves both languages
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('russian', content)) STORED;
+
+-- A search runs once per chat of the user; with chat_id in the same GIN index
+-- a common word is intersected with that chat's entries instead of being
+-- fetched across all chats and filtered
+CREATE INDEX IF NOT EXISTS idx_messages_chat_search ON messages USING GIN (chat_id, search_vector);
@@ -0,0 +1,26 @@
+-- Call log written by backend/webrtc-signaling from offer/answer/leave.
+-- A call is the signaling room it was negotiated in; clients use a fresh
+-- roomId per call, and one room has at most one call that has not ended
+ALTER TABLE calls ADD COLUMN IF NOT EXISTS room_id VARCHAR(100);
+ALTER TABLE calls ADD COLUMN IF NOT EXISTS answered_at TIMESTAMP;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_calls_open_room ON calls(room_id) WHERE ended_at IS NULL;
+
+-- Unanswered calls past the ring timeout are closed as missed
+CREATE INDEX IF NOT EXISTS idx_calls_ringing_started ON calls(started_at) WHERE status = 'ringing';
+
+-- Call history pages each side newest-first: with id after the user the
+-- existing indexes return the page in order and stop at its limit, where the
+-- planner would otherwise walk calls_pkey backwards filtering on the user
+DO $$
+BEGIN
+    IF (SELECT indnatts FROM pg_index WHERE indexrelid = to_regclass('idx_calls_caller')) = 1 THEN
+        DROP INDEX idx_calls_caller;
+    END IF;
+    IF (SELECT indnatts FROM pg_index WHERE indexrelid = to_regclass('idx_calls_receiver')) = 1 THEN
+        DROP INDEX idx_calls_receiver;
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_calls_caller ON calls(caller_id, id);
+CREATE INDEX IF NOT EXISTS idx_calls_receiver ON calls(receiver_id, id);
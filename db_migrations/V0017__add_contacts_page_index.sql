@@ -0,0 +1,10 @@
+-- Contacts GET pages a user's contacts newest first, keyset on (added_at, id);
+-- the cursor's row comparison needs added_at to be set
+UPDATE contacts SET added_at = 'epoch' WHERE added_at IS NULL;
+ALTER TABLE contacts ALTER COLUMN added_at SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_contacts_user_added ON contacts(user_id, added_at DESC, id DESC);
+
+-- Lookups by user_id are served by the index above and by the
+-- (user_id, contact_user_id) unique constraint
+DROP INDEX IF EXISTS idx_contacts_user_id;
@@ -47,7 +47,7 @@ export default function AddContactDialog({
       );
       if (response.ok) {
         const data = await response.json();
-        setSearchResults(data.filter((user: User) => user.id !== currentUserId));
+        setSearchResults(data.users.filter((user: User) => user.id !== currentUserId));
       }
     } catch (error) {
       console.error('Error searching users:', error);
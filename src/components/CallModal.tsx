@@ -6,6 +6,9 @@ import Icon from '@/components/ui/icon';
 interface CallModalProps {
   isOpen: boolean;
   onClose: () => void;
+  userId: number;
+  // The contact's user id; calls without one are relayed but not logged
+  contactId?: number;
   contactName: string;
   isVideo: boolean;
   isOutgoing: boolean;
@@ -13,7 +16,7 @@ interface CallModalProps {
 
 const SIGNALING_URL = 'https://functions.poehali.dev/6aa9c253-b235-495c-8e1d-9a3af7eb54c8';
 
-export default function CallModal({ isOpen, onClose, contactName, isVideo, isOutgoing }: CallModalProps) {
+export default function CallModal({ isOpen, onClose, userId, contactId, contactName, isVideo, isOutgoing }: CallModalProps) {
   const [callStatus, setCallStatus] = useState<'connecting' | 'connected' | 'ended'>('connecting');
   const [isMuted, setIsMuted] = useState(false);
   const [isVideoEnabled, setIsVideoEnabled] = useState(isVideo);
@@ -24,6 +27,13 @@ export default function CallModal({ isOpen, onClose, contactName, isVideo, isOut
   const peerConnectionRef = useRef<RTCPeerConnection | null>(null);
   const localStreamRef = useRef<MediaStream | null>(null);
   const callTimerRef = useRef<NodeJS.Timeout | null>(null);
+  const pendingCandidatesRef = useRef<RTCIceCandidate[]>([]);
+  const candidateFlushRef = useRef<NodeJS.Timeout | null>(null);
+  // The call log keys calls by room, so every call gets a fresh one
+  const roomIdRef = useRef('');
+  // Settles once the offer is posted; candidates wait for it, as the server
+  // drops whatever a peer queued before its offer
+  const descriptionPostedRef = useRef<Promise<void>>(Promise.resolve());
 
   useEffect(() => {
     if (isOpen && callStatus === 'connected') {
@@ -41,6 +51,8 @@ export default function CallModal({ isOpen, onClose, contactName, isVideo, isOut
 
   useEffect(() => {
     if (!isOpen) return;
+    roomIdRef.current = `call-${userId}-${Date.now()}`;
+    descriptionPostedRef.current = Promise.resolve();
 
     const initCall = async () => {
       try {
@@ -74,18 +86,37 @@ export default function CallModal({ isOpen, onClose, contactName, isVideo, isOut
           }
         };
 
+        const flushCandidates = async () => {
+          if (candidateFlushRef.current) {
+            clearTimeout(candidateFlushRef.current);
+            candidateFlushRef.current = null;
+          }
+          await descriptionPostedRef.current;
+          const candidates = pendingCandidatesRef.current;
+          pendingCandidatesRef.current = [];
+          if (candidates.length === 0) return;
+          await fetch(SIGNALING_URL, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+              type: 'ice-candidates',
+              from: userId,
+              to: contactId ?? contactName,
+              roomId: roomIdRef.current,
+              data: candidates
+            })
+          });
+        };
+
+        // Candidates arrive in bursts; send each burst as one request
         peerConnection.onicecandidate = async (event) => {
-          if (event.candidate) {
-            await fetch(SIGNALING_URL, {
-              method: 'POST',
-              headers: { 'Content-Type': 'application/json' },
-              body: JSON.stringify({
-                type: 'ice-candidate',
-                from: 'current-user',
-                to: contactName,
-                data: event.candidate
-              })
-            });
+          if (!event.candidate) {
+            await flushCandidates();
+            return;
+          }
+          pendingCandidatesRef.current.push(event.candidate);
+          if (!candidateFlushRef.current) {
+            candidateFlushRef.current = setTimeout(flushCandidates, 100);
           }
         };
 
@@ -100,18 +131,25 @@ export default function CallModal({ isOpen, onClose, contactName, isVideo, isOut
 
         if (isOutgoing) {
           const offer = await peerConnection.createOffer();
+          let offerPosted = () => {};
+          descriptionPostedRef.current = new Promise<void>(resolve => { offerPosted = resolve; });
           await peerConnection.setLocalDescription(offer);
           
-          await fetch(SIGNALING_URL, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-              type: 'offer',
-              from: 'current-user',
-              to: contactName,
-              data: offer
-            })
-          });
+          try {
+            await fetch(SIGNALING_URL, {
+              method: 'POST',
+              headers: { 'Content-Type': 'application/json' },
+              body: JSON.stringify({
+                type: 'offer',
+                from: userId,
+                to: contactId ?? contactName,
+                roomId: roomIdRef.current,
+                data: offer
+              })
+            });
+          } finally {
+            offerPosted();
+          }
         }
 
         setTimeout(() => setCallStatus('connected'), 2000);
@@ -125,6 +163,11 @@ export default function CallModal({ isOpen, onClose, contactName, isVideo, isOut
     initCall();
 
     return () => {
+      if (candidateFlushRef.current) {
+        clearTimeout(candidateFlushRef.current);
+        candidateFlushRef.current = null;
+      }
+      pendingCandidatesRef.current = [];
       if (localStreamRef.current) {
         localStreamRef.current.getTracks().forEach(track => track.stop());
       }
@@ -132,10 +175,15 @@ export default function CallModal({ isOpen, onClose, contactName, isVideo, isOut
         peerConnectionRef.current.close();
       }
     };
-  }, [isOpen, isVideo, isOutgoing, contactName]);
+  }, [isOpen, isVideo, isOutgoing, userId, contactId, contactName]);
 
   const handleEndCall = () => {
     setCallStatus('ended');
+    fetch(SIGNALING_URL, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ type: 'leave', from: userId, roomId: roomIdRef.current })
+    }).catch(() => {});
     if (localStreamRef.current) {
       localStreamRef.current.getTracks().forEach(track => track.stop());
     }
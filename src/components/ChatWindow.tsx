@@ -59,7 +59,7 @@ export default function ChatWindow({ chat, onClose, onCall, currentUserId }: Cha
       );
       if (response.ok) {
         const data = await response.json();
-        setMessages(data);
+        setMessages([...data.messages].reverse());
       }
     } catch (error) {
       console.error('Error fetching messages:', error);
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '@/components/ui/tabs';
 import { Avatar, AvatarFallback, AvatarImage } from '@/components/ui/avatar';
 import { Badge } from '@/components/ui/badge';
@@ -14,6 +14,7 @@ import CallModal from '@/components/CallModal';
 import ThemeToggle from '@/components/ThemeToggle';
 import AddContactDialog from '@/components/AddContactDialog';
 import IncomingCallDialog from '@/components/IncomingCallDialog';
+import func2url from '../../backend/func2url.json';
 
 interface UserProfile {
   id: number;
@@ -36,6 +37,13 @@ interface Chat {
   avatar_url?: string;
 }
 
+const CONTACTS_URL = 'https://functions.poehali.dev/26146939-005e-4eb7-af42-13d391ce1e74';
+const CONTACTS_PAGE_SIZE = 50;
+// The presence function's URL is filled in on deploy; no heartbeats until then
+const PRESENCE_URL = (func2url as Record<string, string | undefined>).presence;
+// Keep it plus PRESENCE_WRITE_THRESHOLD and the flush interval below PRESENCE_ONLINE_TTL
+const PRESENCE_HEARTBEAT_INTERVAL = 30_000;
+
 export default function Index() {
   const [activeTab, setActiveTab] = useState('chats');
   const [selectedChat, setSelectedChat] = useState<Chat | null>(null);
@@ -43,9 +51,11 @@ export default function Index() {
   const [addContactDialogOpen, setAddContactDialogOpen] = useState(false);
   const [chats, setChats] = useState<Chat[]>([]);
   const [contacts, setContacts] = useState<any[]>([]);
+  const [contactsCursor, setContactsCursor] = useState<number | null>(null);
+  const [loadingMoreContacts, setLoadingMoreContacts] = useState(false);
   const [activeCall, setActiveCall] = useState<{type: 'audio' | 'video', userName: string, userAvatar?: string} | null>(null);
   const [callModalOpen, setCallModalOpen] = useState(false);
-  const [callConfig, setCallConfig] = useState<{contactName: string, isVideo: boolean, isOutgoing: boolean}>({contactName: '', isVideo: false, isOutgoing: true});
+  const [callConfig, setCallConfig] = useState<{contactId?: number, contactName: string, isVideo: boolean, isOutgoing: boolean}>({contactName: '', isVideo: false, isOutgoing: true});
   const [incomingCall, setIncomingCall] = useState<{callerName: string, callerAvatar?: string, isVideo: boolean} | null>(null);
   const [userProfile, setUserProfile] = useState<UserProfile>({
     id: 1,
@@ -57,6 +67,20 @@ export default function Index() {
     status: 'online',
   });
 
+  useEffect(() => {
+    if (!PRESENCE_URL) return;
+    const heartbeat = () => {
+      fetch(PRESENCE_URL, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ user_id: userProfile.id })
+      }).catch(() => {});
+    };
+    heartbeat();
+    const timer = setInterval(heartbeat, PRESENCE_HEARTBEAT_INTERVAL);
+    return () => clearInterval(timer);
+  }, [userProfile.id]);
+
   useEffect(() => {
     fetchUserProfile();
     fetchChats();
@@ -107,18 +131,57 @@ export default function Index() {
     }
   };
 
+  // Bumped by every fetchContacts, so a reload discards a page of the older list still in flight
+  const contactsRequestRef = useRef(0);
+  const contactsEndRef = useRef<HTMLDivElement>(null);
+
+  const fetchContactsPage = async (cursor: number | null) => {
+    const response = await fetch(`${CONTACTS_URL}?user_id=${userProfile.id}&limit=${CONTACTS_PAGE_SIZE}${cursor !== null ? `&cursor=${cursor}` : ''}`);
+    if (!response.ok) return null;
+    return response.json();
+  };
+
   const fetchContacts = async () => {
+    const request = ++contactsRequestRef.current;
     try {
-      const response = await fetch(`https://functions.poehali.dev/26146939-005e-4eb7-af42-13d391ce1e74?user_id=${userProfile.id}`);
-      if (response.ok) {
-        const data = await response.json();
-        setContacts(data);
-      }
+      const data = await fetchContactsPage(null);
+      if (!data || request !== contactsRequestRef.current) return;
+      setContacts(data.contacts);
+      setContactsCursor(data.next_cursor);
+    } catch (error) {
+      console.error('Error fetching contacts:', error);
+    }
+  };
+
+  // The next page is fetched when the end of the list scrolls into view
+  const loadMoreContacts = async () => {
+    if (contactsCursor === null || loadingMoreContacts) return;
+    const request = contactsRequestRef.current;
+    setLoadingMoreContacts(true);
+    try {
+      const data = await fetchContactsPage(contactsCursor);
+      if (!data || request !== contactsRequestRef.current) return;
+      setContacts(prev => [...prev, ...data.contacts]);
+      setContactsCursor(data.next_cursor);
     } catch (error) {
       console.error('Error fetching contacts:', error);
+    } finally {
+      setLoadingMoreContacts(false);
     }
   };
 
+  useEffect(() => {
+    const end = contactsEndRef.current;
+    if (!end || contactsCursor === null) return;
+    const observer = new IntersectionObserver(entries => {
+      if (entries[0].isIntersecting) {
+        loadMoreContacts();
+      }
+    });
+    observer.observe(end);
+    return () => observer.disconnect();
+  }, [contactsCursor, loadingMoreContacts, activeTab]);
+
   const handleProfileUpdate = (updatedProfile: UserProfile) => {
     setUserProfile(updatedProfile);
   };
@@ -343,7 +406,7 @@ export default function Index() {
                   <div
                     key={contact.id}
                     className="p-4 hover:bg-muted/50 cursor-pointer transition-colors animate-slide-up"
-                    style={{ animationDelay: `${index * 50}ms` }}
+                    style={{ animationDelay: `${(index % CONTACTS_PAGE_SIZE) * 50}ms` }}
                   >
                     <div className="flex items-center gap-3">
                       <div className="relative">
@@ -368,6 +431,7 @@ export default function Index() {
                           className="text-secondary hover:bg-secondary/10 rounded-full"
                           onClick={() => {
                             setCallConfig({
+                              contactId: contact.id,
                               contactName: contact.full_name,
                               isVideo: true,
                               isOutgoing: true
@@ -389,6 +453,11 @@ export default function Index() {
                   </div>
                 ))
               )}
+              {contactsCursor !== null && (
+                <div ref={contactsEndRef} className="flex justify-center p-4 text-muted-foreground">
+                  {loadingMoreContacts && <Icon name="Loader2" size={20} className="animate-spin" />}
+                </div>
+              )}
             </div>
           </ScrollArea>
           
@@ -558,6 +627,8 @@ export default function Index() {
       <CallModal
         isOpen={callModalOpen}
         onClose={() => setCallModalOpen(false)}
+        userId={userProfile.id}
+        contactId={callConfig.contactId}
         contactName={callConfig.contactName}
         isVideo={callConfig.isVideo}
         isOutgoing={callConfig.isOutgoing}